@@ -0,0 +1 @@
+"""Benchmarks for photometadata, run with `python -m benchmarks`"""
@@ -0,0 +1,123 @@
+"""Command line interface for generating corpora and running benchmarks"""
+
+import json
+import platform
+import subprocess
+import tempfile
+from pathlib import Path
+
+import typer
+
+from .corpus import CorpusSpec, generate, load
+from .suite import BENCHMARKS, run
+
+application = typer.Typer(
+    context_settings={"help_option_names": ["-h", "--help"]},
+    help="Benchmarks for photometadata",
+    no_args_is_help=True,
+)
+
+
+@application.command()
+def corpus(
+    path: Path,
+    *,
+    photos: int = 500,
+    fan_out: int = 4,
+    depth: int = 2,
+    width: int = 640,
+    height: int = 480,
+    conflicting_dates: float = 0.1,
+    missing_copyright: float = 0.2,
+    keywords: float = 0.5,
+    broken: float = 0.02,
+    duplicates: float = 0.05,
+    seed: int = 0,
+) -> None:
+    """Generate a synthetic photo library."""
+    spec = CorpusSpec(
+        photos=photos,
+        fan_out=fan_out,
+        depth=depth,
+        width=width,
+        height=height,
+        conflicting_dates=conflicting_dates,
+        missing_copyright=missing_copyright,
+        keywords=keywords,
+        broken=broken,
+        duplicates=duplicates,
+        seed=seed,
+    )
+    generated = generate(path, spec)
+    typer.echo(
+        f"Generated {photos} photos, including {generated.n_duplicates} duplicates, under {generated.path}"
+    )
+
+
+@application.command("run")
+def run_benchmarks(
+    *,
+    corpus: Path | None = None,
+    output: Path | None = None,
+    benchmark: list[str] = typer.Option(list(BENCHMARKS), "--benchmark", "-b"),
+    photos: int = 500,
+    seed: int = 0,
+    repeat: int = 1,
+) -> None:
+    """Time each benchmark and report the results as JSON.
+
+    Benchmarks run on a library created with the corpus command if one is given,
+    otherwise on a freshly generated library with default settings.
+    """
+    with tempfile.TemporaryDirectory() as workspace:
+        if corpus:
+            library = load(corpus)
+        else:
+            spec = CorpusSpec(photos=photos, seed=seed)
+            library = generate(Path(workspace) / "corpus", spec)
+        results = run(library, benchmark, repeat=repeat)
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": library.spec.to_dict(),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        output.write_text(text + "\n", encoding="utf-8")
+    else:
+        typer.echo(text)
+
+
+@application.command()
+def compare(baseline: Path, candidate: Path) -> None:
+    """Compare the throughput in two benchmark reports."""
+    before = json.loads(baseline.read_text(encoding="utf-8"))["results"]
+    after = json.loads(candidate.read_text(encoding="utf-8"))["results"]
+    for name in [name for name in before if name in after]:
+        speedup = after[name]["files_per_second"] / before[name]["files_per_second"]
+        memory = after[name]["peak_rss"] / before[name]["peak_rss"]
+        typer.echo(
+            f"{name:12} {before[name]['files_per_second']:10.1f} -> "
+            f"{after[name]['files_per_second']:10.1f} files/s ({speedup:.2f}x), "
+            f"peak RSS {memory:.2f}x"
+        )
+
+
+def git_commit() -> str | None:
+    """Return the commit being benchmarked, if running from a git checkout"""
+    try:
+        process = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        )
+    except OSError:
+        return None
+    return process.stdout.strip() or None
+
+
+if __name__ == "__main__":
+    application()
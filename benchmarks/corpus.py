@@ -0,0 +1,151 @@
+"""Generator for deterministic synthetic photo libraries"""
+
+import json
+import random
+import shutil
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from PIL import Image
+
+from photometadata.processors import MetadataUpdate, NativeWriter
+
+SETTINGS = """\
+azure:
+  endpoint: http://127.0.0.1:9/
+  subscription_key: benchmark
+copyright:
+  - name: Benchmark Photographer
+    whenever:
+      - filename-regex: .*
+"""
+CAMERAS = [
+    ("Apple", "iPhone 12"),
+    ("Canon", "Canon EOS 5D"),
+    ("NIKON CORPORATION", "NIKON D750"),
+]
+KEYWORDS = ["beach", "dog", "mountain", "people", "sky", "tree", "water"]
+
+
+@dataclass
+class CorpusSpec:
+    """Parameters of a synthetic photo library.
+
+    Fractions are of the total number of photos. Conflicting dates differ by a
+    few seconds, so that MetadataFixer resolves them without prompting.
+    """
+
+    photos: int = 500
+    fan_out: int = 4
+    depth: int = 2
+    width: int = 640
+    height: int = 480
+    conflicting_dates: float = 0.1
+    missing_copyright: float = 0.2
+    keywords: float = 0.5
+    broken: float = 0.02
+    duplicates: float = 0.05
+    seed: int = 0
+
+    def to_dict(self) -> dict[str, int | float]:
+        return asdict(self)
+
+
+SPEC_FILENAME = "corpus.json"
+
+
+@dataclass
+class Corpus:
+    """A generated photo library together with the settings to process it"""
+
+    path: Path
+    settings: Path
+    spec: CorpusSpec
+    n_duplicates: int
+
+
+def directories(spec: CorpusSpec) -> list[Path]:
+    """Return the relative paths of all directories in the library tree"""
+    paths = [Path(".")]
+    level = [Path(".")]
+    for depth in range(spec.depth):
+        level = [
+            parent / f"dir{depth}-{idx}"
+            for parent in level
+            for idx in range(spec.fan_out)
+        ]
+        paths += level
+    return paths
+
+
+def generate(path: str | Path, spec: CorpusSpec) -> Corpus:
+    """Generate a photo library under `path`, replacing anything already there"""
+    root = Path(path)
+    if root.exists():
+        shutil.rmtree(root)
+    rng = random.Random(spec.seed)
+    folders = [root / folder for folder in directories(spec)]
+    for folder in folders:
+        folder.mkdir(parents=True, exist_ok=True)
+    settings = root / "settings.yaml"
+    settings.write_text(SETTINGS, encoding="utf-8")
+    n_duplicates = round(spec.photos * spec.duplicates)
+    (root / SPEC_FILENAME).write_text(
+        json.dumps(spec.to_dict() | {"n_duplicates": n_duplicates}, indent=2),
+        encoding="utf-8",
+    )
+
+    writer = NativeWriter()
+    originals = []
+    start = datetime(2015, 1, 1)
+    for idx in range(spec.photos - n_duplicates):
+        date = start + timedelta(seconds=rng.randrange(10 * 365 * 24 * 3600))
+        file_path = (
+            folders[idx % len(folders)] / f"IMG_{date:%Y%m%d_%H%M%S}_{idx:05d}.jpg"
+        )
+        write_photo(file_path, date, spec, rng)
+        if rng.random() < spec.keywords:
+            writer.apply(MetadataUpdate(file_path, keywords=rng.sample(KEYWORDS, k=3)))
+        if rng.random() < spec.broken:
+            # Keep the header but drop the end of the image data
+            data = file_path.read_bytes()
+            file_path.write_bytes(data[: len(data) * 2 // 3])
+        else:
+            originals.append(file_path)
+
+    for idx, original in enumerate(rng.sample(originals, k=n_duplicates)):
+        shutil.copyfile(original, rng.choice(folders) / f"copy-{idx:05d}.jpg")
+    return Corpus(root, settings, spec, n_duplicates)
+
+
+def load(path: str | Path) -> Corpus:
+    """Load a library previously created by generate()"""
+    root = Path(path)
+    data = json.loads((root / SPEC_FILENAME).read_text(encoding="utf-8"))
+    n_duplicates = data.pop("n_duplicates")
+    return Corpus(root, root / "settings.yaml", CorpusSpec(**data), n_duplicates)
+
+
+def write_photo(
+    file_path: Path, date: datetime, spec: CorpusSpec, rng: random.Random
+) -> None:
+    """Write a single photo with unique image content and EXIF tags"""
+    # Upscaling random noise gives smooth images that compress like photos
+    tile = Image.frombytes("RGB", (16, 12), rng.randbytes(16 * 12 * 3))
+    image = tile.resize((spec.width, spec.height), Image.Resampling.BICUBIC)
+
+    make, model = rng.choice(CAMERAS)
+    original = date
+    if rng.random() < spec.conflicting_dates:
+        original = date + timedelta(seconds=rng.randint(1, 4))
+    exif = Image.Exif()
+    exif[0x010F] = make
+    exif[0x0110] = model
+    exif[0x0132] = f"{date:%Y:%m:%d %H:%M:%S}"
+    if rng.random() >= spec.missing_copyright:
+        exif[0x8298] = "Benchmark Photographer"
+    exif_ifd = exif.get_ifd(0x8769)
+    exif_ifd[0x9003] = f"{original:%Y:%m:%d %H:%M:%S}"
+    exif_ifd[0x9004] = f"{date:%Y:%m:%d %H:%M:%S}"
+    image.save(file_path, format="JPEG", quality=90, exif=exif.tobytes())
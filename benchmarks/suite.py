@@ -0,0 +1,114 @@
+"""Timed benchmarks of the main photo processing paths"""
+
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import stat
+import tempfile
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from photometadata.library import Library
+from photometadata.metadata import Metadata
+from photometadata.processors import Checker, DuplicateIdentifier, MetadataFixer
+from photometadata.settings import Settings
+
+from .corpus import Corpus
+
+
+def bench_scan(library_path: Path, settings: Settings) -> int:
+    """Find all photos in the library"""
+    library = Library(library_path, settings)
+    return sum(len(entries) for _, entries in library.directories())
+
+
+def bench_metadata(library_path: Path, settings: Settings) -> int:
+    """Parse the metadata of every photo, without decoding image data"""
+    library = Library(library_path, settings)
+    n_photos = 0
+    for _, entries in library.directories():
+        for entry in entries:
+            Metadata(entry.path, fingerprint=False)
+            n_photos += 1
+    return n_photos
+
+
+def bench_check(library_path: Path, settings: Settings) -> int:
+    """Run the checker, including the broken image check"""
+    library = Library(library_path, settings)
+    return sum(1 for _ in library.process(Checker(broken_only=False)))
+
+
+def bench_duplicates(library_path: Path, settings: Settings) -> int:
+    """Identify exact duplicates"""
+    library = Library(library_path, settings)
+    identifier = DuplicateIdentifier()
+    n_photos = 0
+    for photo in library.walk(fingerprint=False):
+        identifier(photo)
+        n_photos += 1
+    identifier.identify()
+    return n_photos
+
+
+def bench_fix(library_path: Path, settings: Settings) -> int:
+    """Fix metadata, with a stub in place of exiv2"""
+    library = Library(library_path, settings)
+    return sum(1 for _ in library.process(MetadataFixer(settings)))
+
+
+BENCHMARKS: dict[str, Callable[[Path, Settings], int]] = {
+    "scan": bench_scan,
+    "metadata": bench_metadata,
+    "check": bench_check,
+    "duplicates": bench_duplicates,
+    "fix": bench_fix,
+}
+# Benchmarks that modify the library, so are run on a copy of it
+MODIFIES_LIBRARY = {"fix"}
+
+
+def measure(name: str, corpus: Corpus) -> dict[str, float]:
+    """Run a benchmark in the current process, returning its measurements"""
+    logging.disable(logging.CRITICAL)
+    settings = Settings(corpus.settings)
+    with tempfile.TemporaryDirectory() as workspace:
+        stub = Path(workspace) / "bin" / "exiv2"
+        stub.parent.mkdir()
+        stub.write_text("#!/bin/sh\nexit 0\n", encoding="utf-8")
+        stub.chmod(stub.stat().st_mode | stat.S_IEXEC)
+        os.environ["PATH"] = f"{stub.parent}{os.pathsep}{os.environ['PATH']}"
+        library_path = corpus.path
+        if name in MODIFIES_LIBRARY:
+            library_path = Path(workspace) / "library"
+            shutil.copytree(corpus.path, library_path)
+        start = time.perf_counter()
+        n_files = BENCHMARKS[name](library_path, settings)
+        seconds = time.perf_counter() - start
+    return {
+        "files": n_files,
+        "seconds": seconds,
+        "files_per_second": n_files / seconds if seconds else 0.0,
+        # Reported in kilobytes on Linux and bytes on macOS
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def run(corpus: Corpus, names: list[str], repeat: int = 1) -> dict[str, dict]:
+    """Run benchmarks, each in a fresh process so that peak memory is separate.
+
+    The fastest of `repeat` runs is reported for each benchmark.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for name in names:
+        runs = []
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                runs.append(executor.submit(measure, name, corpus).result())
+        results[name] = min(runs, key=lambda result: result["seconds"])
+    return results
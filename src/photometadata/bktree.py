@@ -0,0 +1,63 @@
+"""BK-tree index for nearest-neighbour queries under a discrete metric"""
+
+from collections.abc import Callable
+from typing import Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class _Node(Generic[T]):
+    __slots__ = ("key", "values", "children")
+
+    def __init__(self, key: int, value: T) -> None:
+        self.key = key
+        self.values = [value]
+        self.children: dict[int, "_Node[T]"] = {}
+
+
+class BKTree(Generic[T]):
+    """Burkhard-Keller tree mapping integer keys to values.
+
+    Searching for keys within a small distance of a query only visits subtrees
+    whose distance from their parent is compatible with the triangle inequality,
+    rather than comparing against every key in the tree.
+    """
+
+    def __init__(self, distance: Callable[[int, int], int]) -> None:
+        self.distance = distance
+        self.root: _Node[T] | None = None
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, key: int, value: T) -> None:
+        """Add a value to the tree under the given key"""
+        self.size += 1
+        if self.root is None:
+            self.root = _Node(key, value)
+            return
+        node = self.root
+        while True:
+            distance = self.distance(key, node.key)
+            if distance == 0:
+                node.values.append(value)
+                return
+            if distance not in node.children:
+                node.children[distance] = _Node(key, value)
+                return
+            node = node.children[distance]
+
+    def search(self, key: int, threshold: int) -> list[tuple[int, T]]:
+        """Return (distance, value) for all values within threshold of key"""
+        matches: list[tuple[int, T]] = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            distance = self.distance(key, node.key)
+            if distance <= threshold:
+                matches.extend((distance, value) for value in node.values)
+            for child_distance, child in node.children.items():
+                if distance - threshold <= child_distance <= distance + threshold:
+                    stack.append(child)
+        return matches
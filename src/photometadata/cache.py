@@ -0,0 +1,439 @@
+"""Persistent on-disk caches of parsed photo metadata, classification and check results"""
+
+import json
+import logging
+import os
+import sqlite3
+from collections.abc import Iterable
+from pathlib import Path
+
+from photometadata.metadata import Metadata
+from photometadata.profiling import span
+from photometadata.query import Query
+
+logger = logging.getLogger(__name__)
+
+
+def default_cache_path(name: str = "metadata.sqlite") -> Path:
+    """Return the default location of a cache file"""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "photometadata" / name
+
+
+class MetadataCache:
+    """SQLite cache of parsed metadata, invalidated by file size, mtime and inode"""
+
+    # Increment whenever the format written by Metadata.to_dict changes
+    SCHEMA_VERSION = 3
+    COMMIT_INTERVAL = 1000
+
+    def __init__(self, path: str | Path | None = None, *, rebuild: bool = False):
+        self.path = Path(path) if path else default_cache_path()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if rebuild or version != self.SCHEMA_VERSION:
+            logger.info(f"Rebuilding metadata cache at [cyan]{self.path}[/]")
+            self.connection.execute("DROP TABLE IF EXISTS metadata")
+            self.connection.execute(f"PRAGMA user_version={self.SCHEMA_VERSION}")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS metadata ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " inode INTEGER NOT NULL,"
+            " data TEXT NOT NULL"
+            ")"
+        )
+        self.connection.commit()
+        self.n_hits = 0
+        self.n_misses = 0
+        self.n_pending = 0
+
+    @staticmethod
+    def key(file_path: str | Path) -> tuple[int, int, int]:
+        """Return the (size, mtime_ns, inode) key used to validate cache entries"""
+        stat = os.stat(file_path)
+        return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+    def get(
+        self,
+        file_path: str | Path,
+        key: tuple[int, int, int],
+        *,
+        fingerprint: bool = True,
+        perceptual_hash: bool = False,
+    ) -> Metadata | None:
+        """Return cached metadata if there is an entry matching the given key
+
+        If `fingerprint` or `perceptual_hash` are set, entries without the
+        corresponding value are treated as missing.
+        """
+        with span("cache.get"):
+            row = self.connection.execute(
+                "SELECT size, mtime_ns, inode, data FROM metadata WHERE path = ?",
+                (str(file_path),),
+            ).fetchone()
+            if row and tuple(row[:3]) == key:
+                metadata = Metadata.from_dict(json.loads(row[3]))
+            else:
+                metadata = None
+        if (
+            metadata
+            and (metadata.has_fingerprint or not fingerprint)
+            and (metadata.has_perceptual_hash or not perceptual_hash)
+        ):
+            self.n_hits += 1
+            return metadata
+        self.n_misses += 1
+        return None
+
+    def load(
+        self,
+        file_path: str | Path,
+        key: tuple[int, int, int] | None = None,
+        **options: bool,
+    ) -> Metadata:
+        """Load metadata from the cache, parsing the file if the entry is stale
+
+        Any options are passed to the Metadata constructor.
+        """
+        key = key or self.key(file_path)
+        if metadata := self.get(file_path, key, **options):
+            return metadata
+        metadata = Metadata(file_path, **options)
+        self.store(file_path, metadata, key)
+        return metadata
+
+    def store(
+        self, file_path: str | Path, metadata: Metadata, key: tuple[int, int, int]
+    ) -> None:
+        """Store metadata for a file with the given (size, mtime_ns, inode)"""
+        with span("cache.store"):
+            self.connection.execute(
+                "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?)",
+                (str(file_path), *key, json.dumps(metadata.to_dict())),
+            )
+        self.n_pending += 1
+        if self.n_pending >= self.COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self) -> None:
+        """Write any pending changes to disk"""
+        with span("cache.commit"):
+            self.connection.commit()
+        self.n_pending = 0
+
+    def close(self) -> None:
+        """Commit pending changes and close the database"""
+        self.commit()
+        self.connection.close()
+        logger.debug(
+            f"Metadata cache: [bold]{self.n_hits}[/] hit(s), [bold]{self.n_misses}[/] miss(es)"
+        )
+
+
+class ClassificationCache:
+    """SQLite cache of classification results, keyed by image content.
+
+    All tags returned by the service are stored with their confidence, so that
+    the confidence cutoff can be changed without repeating any requests.
+    """
+
+    SCHEMA_VERSION = 1
+
+    def __init__(self, path: str | Path | None = None):
+        self.path = Path(path) if path else default_cache_path("classifications.sqlite")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != self.SCHEMA_VERSION:
+            self.connection.execute("DROP TABLE IF EXISTS classifications")
+            self.connection.execute(f"PRAGMA user_version={self.SCHEMA_VERSION}")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS classifications ("
+            " content TEXT NOT NULL,"
+            " api_version TEXT NOT NULL,"
+            " tags TEXT NOT NULL,"
+            " PRIMARY KEY (content, api_version)"
+            ")"
+        )
+        self.connection.commit()
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def get(self, content: str, api_version: str) -> list[tuple[str, float]] | None:
+        """Return the (name, confidence) tags stored for some image content"""
+        row = self.connection.execute(
+            "SELECT tags FROM classifications WHERE content = ? AND api_version = ?",
+            (content, api_version),
+        ).fetchone()
+        if row is None:
+            self.n_misses += 1
+            return None
+        self.n_hits += 1
+        return [(name, confidence) for name, confidence in json.loads(row[0])]
+
+    def store(
+        self, content: str, api_version: str, tags: list[tuple[str, float]]
+    ) -> None:
+        """Store the (name, confidence) tags returned for some image content"""
+        self.connection.execute(
+            "INSERT OR REPLACE INTO classifications VALUES (?, ?, ?)",
+            (content, api_version, json.dumps(tags)),
+        )
+
+    def commit(self) -> None:
+        """Write any pending changes to disk"""
+        self.connection.commit()
+
+    def close(self) -> None:
+        """Commit pending changes and close the database"""
+        self.commit()
+        self.connection.close()
+        logger.debug(
+            f"Classification cache: [bold]{self.n_hits}[/] hit(s), [bold]{self.n_misses}[/] miss(es)"
+        )
+
+
+class CheckJournal:
+    """SQLite journal of check results, used to skip files that have not changed.
+
+    Each result is stored with the (size, mtime_ns, inode) of the file and the
+    options it was checked with, and is only reused if both still match.
+    """
+
+    SCHEMA_VERSION = 2
+
+    def __init__(self, path: str | Path | None = None):
+        self.path = Path(path) if path else default_cache_path("journal.sqlite")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != self.SCHEMA_VERSION:
+            self.connection.execute("DROP TABLE IF EXISTS journal")
+            self.connection.execute(f"PRAGMA user_version={self.SCHEMA_VERSION}")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS journal ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " inode INTEGER NOT NULL,"
+            " mode TEXT NOT NULL,"
+            " success INTEGER NOT NULL,"
+            " message TEXT NOT NULL,"
+            " failed TEXT NOT NULL"
+            ")"
+        )
+        self.connection.commit()
+
+    def results(
+        self, base_path: Path
+    ) -> dict[str, tuple[tuple[int, int, int], str, bool, str, list[str]]]:
+        """Return (key, mode, success, message, failed checks) for each file checked under a directory"""
+        prefix = os.path.join(base_path, "")
+        return {
+            path: (
+                (size, mtime_ns, inode),
+                mode,
+                bool(success),
+                message,
+                failed.split(),
+            )
+            for path, size, mtime_ns, inode, mode, success, message, failed in self.connection.execute(
+                "SELECT * FROM journal WHERE substr(path, 1, ?) = ?",
+                (len(prefix), prefix),
+            )
+        }
+
+    def store(
+        self,
+        file_path: str | Path,
+        key: tuple[int, int, int],
+        mode: str,
+        success: bool,
+        message: str,
+        failed: Iterable[str] = (),
+    ) -> None:
+        """Record the result of checking a file"""
+        self.connection.execute(
+            "INSERT OR REPLACE INTO journal VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (str(file_path), *key, mode, success, message, " ".join(failed)),
+        )
+
+    def remove(self, paths: Iterable[str]) -> None:
+        """Forget files that no longer exist"""
+        self.connection.executemany(
+            "DELETE FROM journal WHERE path = ?", ((path,) for path in paths)
+        )
+
+    def commit(self) -> None:
+        """Write any pending changes to disk"""
+        self.connection.commit()
+
+    def close(self) -> None:
+        """Commit pending changes and close the database"""
+        self.commit()
+        self.connection.close()
+
+
+class LibraryIndex:
+    """SQLite index of the photos in one or more libraries.
+
+    Each photo is stored with the keys used to identify duplicates (its image
+    dimensions and encoded image size, a hash of the start and end of its image
+    data, and its fingerprint), so that copies can be found without reading the
+    library, and with the values that --where filters select photos by. Entries
+    are validated by (size, mtime_ns, inode) like the metadata cache, so that
+    the index can be updated incrementally.
+    """
+
+    SCHEMA_VERSION = 2
+
+    def __init__(self, path: str | Path | None = None):
+        self.path = Path(path) if path else default_cache_path("index.sqlite")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != self.SCHEMA_VERSION:
+            if version:
+                logger.info(f"Rebuilding library index at [cyan]{self.path}[/]")
+            self.connection.execute("DROP TABLE IF EXISTS photos")
+            self.connection.execute(f"PRAGMA user_version={self.SCHEMA_VERSION}")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS photos ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " inode INTEGER NOT NULL,"
+            " width INTEGER,"
+            " height INTEGER,"
+            " payload_size INTEGER,"
+            " partial_hash BLOB,"
+            " fingerprint BLOB,"
+            " directory TEXT NOT NULL,"
+            " filename TEXT NOT NULL,"
+            " date TEXT,"
+            " camera TEXT,"
+            " copyright INTEGER NOT NULL,"
+            " failed TEXT NOT NULL"
+            ")"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS photos_header"
+            " ON photos (width, height, payload_size, partial_hash)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS photos_fingerprint ON photos (fingerprint)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS photos_date ON photos (date)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS photos_camera ON photos (camera)"
+        )
+        self.connection.commit()
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM photos").fetchone()[0]
+
+    def keys(self, base_path: Path) -> dict[str, tuple[int, int, int]]:
+        """Return the (size, mtime_ns, inode) of each file indexed under a directory"""
+        prefix = os.path.join(base_path, "")
+        return {
+            path: (size, mtime_ns, inode)
+            for path, size, mtime_ns, inode in self.connection.execute(
+                "SELECT path, size, mtime_ns, inode FROM photos"
+                " WHERE substr(path, 1, ?) = ?",
+                (len(prefix), prefix),
+            )
+        }
+
+    def select(self, base_path: Path, query: Query) -> list[str]:
+        """Return the paths of files indexed under a directory that match a filter"""
+        prefix = os.path.join(base_path, "")
+        return [
+            path
+            for (path,) in self.connection.execute(
+                "SELECT path FROM photos WHERE substr(path, 1, ?) = ?"
+                f" AND ({query.sql}) ORDER BY directory, filename",
+                (len(prefix), prefix, *query.parameters),
+            )
+        ]
+
+    def store(
+        self,
+        file_path: str | Path,
+        key: tuple[int, int, int],
+        header_key: tuple[int, int, int] | None,
+        partial_hash: bytes,
+        fingerprint: bytes | None,
+        *,
+        date: str | None = None,
+        camera: str | None = None,
+        copyright: bool = False,
+        failed: Iterable[str] = (),
+    ) -> None:
+        """Index a file, where `header_key` is its (width, height, payload size)"""
+        file_path = Path(file_path)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO photos VALUES"
+            " (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                str(file_path),
+                *key,
+                *(header_key or (None, None, None)),
+                partial_hash or None,
+                fingerprint,
+                str(file_path.parent),
+                file_path.name,
+                date,
+                camera or None,
+                copyright,
+                " ".join(failed),
+            ),
+        )
+
+    def lookup(
+        self,
+        header_key: tuple[int, int, int] | None,
+        partial_hash: bytes,
+    ) -> list[tuple[str, bytes | None]]:
+        """Return the (path, fingerprint) of indexed files whose cheap keys match"""
+        if header_key is None or not partial_hash:
+            return []
+        return self.connection.execute(
+            "SELECT path, fingerprint FROM photos"
+            " WHERE width = ? AND height = ? AND payload_size = ? AND partial_hash = ?",
+            (*header_key, partial_hash),
+        ).fetchall()
+
+    def lookup_fingerprint(self, fingerprint: bytes) -> list[str]:
+        """Return the paths of indexed files with the given fingerprint"""
+        return [
+            path
+            for (path,) in self.connection.execute(
+                "SELECT path FROM photos WHERE fingerprint = ?", (fingerprint,)
+            )
+        ]
+
+    def remove(self, paths: Iterable[str]) -> None:
+        """Forget files that no longer exist"""
+        self.connection.executemany(
+            "DELETE FROM photos WHERE path = ?", ((path,) for path in paths)
+        )
+
+    def commit(self) -> None:
+        """Write any pending changes to disk"""
+        self.connection.commit()
+
+    def close(self) -> None:
+        """Commit pending changes and close the database"""
+        self.commit()
+        self.connection.close()
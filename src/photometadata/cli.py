@@ -1,34 +1,65 @@
 import logging
+from pathlib import Path
+
 import typer
 
 from rich.logging import RichHandler
 from rich.highlighter import NullHighlighter
 
+from photometadata import profiling
 from photometadata.commands import (
     check_command,
     classify_command,
     duplicates_command,
+    index_command,
+    merge_command,
     metadata_command,
 )
 
 
+class ProfiledRichHandler(RichHandler):
+    """RichHandler that records the time spent rendering log messages"""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        with profiling.span("log.render"):
+            super().emit(record)
+
+
+def configure(
+    ctx: typer.Context,
+    *,
+    profile: bool = False,
+    profile_output: Path | None = None,
+) -> None:
+    """Entrypoint for photometadata commands
+
+    With --profile, a breakdown of where the time was spent is printed at the end
+    of the run, and saved as JSON if --profile-output is given.
+    """
+    if profile or profile_output:
+        profiling.enable()
+        ctx.call_on_close(lambda: profiling.report(profile_output))
+
+
 def main():
     # Set up logging
     logging.basicConfig(
         level=logging.INFO,
         format="%(message)s",
-        handlers=[RichHandler(markup=True, highlighter=NullHighlighter())],
+        handlers=[ProfiledRichHandler(markup=True, highlighter=NullHighlighter())],
     )
 
     # Build the typer application
     application = typer.Typer(
         context_settings={"help_option_names": ["-h", "--help"]},
-        help="Entrypoint for photometadata commands",
+        callback=configure,
         no_args_is_help=True,
     )
     application.add_typer(check_command)
     application.add_typer(classify_command)
     application.add_typer(duplicates_command)
+    application.add_typer(index_command)
+    application.add_typer(merge_command)
     application.add_typer(metadata_command)
 
     # Run the application
@@ -3,11 +3,15 @@
 from .check import check_command
 from .classify import classify_command
 from .duplicates import duplicates_command
+from .index import index_command
+from .merge import merge_command
 from .metadata import metadata_command
 
 __all__ = [
     "check_command",
     "classify_command",
     "duplicates_command",
+    "index_command",
+    "merge_command",
     "metadata_command",
 ]
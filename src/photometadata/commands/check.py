@@ -2,9 +2,15 @@
 
 import logging
 import typer
+from contextlib import nullcontext
+from pathlib import Path
 
-from photometadata.library import Library
+from photometadata.cache import CheckJournal, LibraryIndex, MetadataCache
+from photometadata.library import Library, Pool
+from photometadata.output import OutputFormat
+from photometadata.query import QueryError, parse as parse_query
 from photometadata.settings import Settings
+from photometadata.shard import Shard, ShardBy, open_partial
 
 logger = logging.getLogger(__name__)
 
@@ -13,9 +19,74 @@ check_command = typer.Typer()
 
 @check_command.command(no_args_is_help=True)
 def check(
-    path: str, settings: str = "settings.yaml", *, broken_only: bool = False
+    path: str,
+    settings: str = "settings.yaml",
+    *,
+    broken_only: bool = False,
+    verify_images: bool = True,
+    since_last_run: bool = False,
+    cache: bool = True,
+    rebuild_cache: bool = False,
+    workers: int = 1,
+    jobs: int = 1,
+    pool: Pool = Pool.THREAD,
+    output: OutputFormat = OutputFormat.RICH,
+    where: str | None = None,
+    index_file: Path | None = None,
+    shard: str | None = None,
+    shard_by: ShardBy = ShardBy.PATH,
+    partial: Path | None = None,
 ) -> None:
-    """Check metadata for all photos in a given path."""
+    """Check metadata for all photos in a given path.
+
+    With --shard i/N, only the i-th of N parts of the library is checked and the
+    results are written to a partial result file for `merge`. With --jobs, up to
+    that many photos are checked at a time on a --pool of threads or processes.
+    """
+    try:
+        shard_ = Shard.parse(shard, shard_by) if shard else None
+    except ValueError as exc:
+        raise typer.BadParameter(str(exc)) from None
+    try:
+        where_ = parse_query(where) if where else None
+    except QueryError as exc:
+        raise typer.BadParameter(str(exc)) from None
     settings_ = Settings(settings)
-    library = Library(path, settings_)
-    library.check_photos(broken_only=broken_only)
+    output_ = output.create()
+    cache_ = MetadataCache(rebuild=rebuild_cache) if cache else None
+    index_ = LibraryIndex(index_file) if where_ else None
+    library = Library(
+        path,
+        settings_,
+        cache_,
+        workers=workers,
+        jobs=jobs,
+        pool=pool,
+        output=output_,
+        shard=shard_,
+        where=where_,
+        index=index_,
+    )
+    journal = CheckJournal() if since_last_run else None
+    partial_ = (
+        open_partial(
+            partial or Path(f"check-{shard_.index}-of-{shard_.count}.jsonl"),
+            shard_,
+            "check",
+            library.base_path,
+        )
+        if shard_
+        else nullcontext(library.output)
+    )
+    try:
+        with partial_ as library.output:
+            library.check_photos(
+                broken_only=broken_only, verify_images=verify_images, journal=journal
+            )
+    finally:
+        if journal:
+            journal.close()
+        if cache_:
+            cache_.close()
+        if index_:
+            index_.close()
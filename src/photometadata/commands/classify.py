@@ -2,8 +2,13 @@
 
 import logging
 import typer
+from pathlib import Path
 
+from photometadata.cache import ClassificationCache, LibraryIndex, MetadataCache
 from photometadata.library import Library
+from photometadata.output import OutputFormat
+from photometadata.query import QueryError, parse as parse_query
+from photometadata.processors import WriterBackend
 from photometadata.settings import Settings
 
 logger = logging.getLogger(__name__)
@@ -12,8 +17,50 @@ classify_command = typer.Typer()
 
 
 @classify_command.command(no_args_is_help=True)
-def classify(path: str, settings: str = "settings.yaml") -> None:
+def classify(
+    path: str,
+    settings: str = "settings.yaml",
+    *,
+    cache: bool = True,
+    rebuild_cache: bool = False,
+    workers: int = 1,
+    output: OutputFormat = OutputFormat.RICH,
+    where: str | None = None,
+    index_file: Path | None = None,
+    batch: bool = False,
+    writer: WriterBackend = WriterBackend.EXIV2,
+    concurrency: int = 1,
+) -> None:
     """Add tags to a photo using Azure Compute Vision."""
+    try:
+        where_ = parse_query(where) if where else None
+    except QueryError as exc:
+        raise typer.BadParameter(str(exc)) from None
     settings_ = Settings(settings)
-    library = Library(path, settings_)
-    library.classify_photos()
+    output_ = output.create()
+    cache_ = MetadataCache(rebuild=rebuild_cache) if cache else None
+    index_ = LibraryIndex(index_file) if where_ else None
+    library = Library(
+        path,
+        settings_,
+        cache_,
+        workers=workers,
+        output=output_,
+        where=where_,
+        index=index_,
+    )
+    classification_cache = ClassificationCache() if cache else None
+    try:
+        library.classify_photos(
+            batch=batch,
+            writer=writer,
+            concurrency=concurrency,
+            classification_cache=classification_cache,
+        )
+    finally:
+        if classification_cache:
+            classification_cache.close()
+        if cache_:
+            cache_.close()
+        if index_:
+            index_.close()
@@ -2,9 +2,16 @@
 
 import logging
 import typer
+from contextlib import nullcontext
+from pathlib import Path
 
+from photometadata.cache import LibraryIndex, MetadataCache
 from photometadata.library import Library
+from photometadata.output import OutputFormat
+from photometadata.query import QueryError, parse as parse_query
+from photometadata.resolution import DuplicateResolver, KeepPolicy, Resolution
 from photometadata.settings import Settings
+from photometadata.shard import Shard, ShardBy, open_partial
 
 logger = logging.getLogger(__name__)
 
@@ -12,8 +19,118 @@ duplicates_command = typer.Typer()
 
 
 @duplicates_command.command(no_args_is_help=True)
-def duplicates(path: str, settings: str = "settings.yaml") -> None:
-    """Check for duplicated photos."""
+def duplicates(
+    path: str,
+    settings: str = "settings.yaml",
+    *,
+    cache: bool = True,
+    rebuild_cache: bool = False,
+    workers: int = 1,
+    output: OutputFormat = OutputFormat.RICH,
+    where: str | None = None,
+    index_file: Path | None = None,
+    similar: bool = False,
+    threshold: int = 6,
+    shard: str | None = None,
+    shard_by: ShardBy = ShardBy.PATH,
+    partial: Path | None = None,
+    against: Path | None = None,
+    resolve: Resolution | None = None,
+    keep: KeepPolicy = KeepPolicy.OLDEST,
+    quarantine_dir: Path | None = None,
+    dry_run: bool = False,
+) -> None:
+    """Check for duplicated photos.
+
+    With --similar, near-duplicates whose perceptual hashes differ by at most
+    --threshold bits are reported instead of exact duplicates. With --shard i/N,
+    only the i-th of N parts of the library is read and the results are written
+    to a partial result file, from which `merge` finds duplicates across shards.
+    With --against INDEX, each photo is instead looked up in an index built by
+    the `index` command, reporting those already indexed and listing new ones.
+
+    With --resolve, the photo chosen by the --keep policy is kept in each group
+    of duplicates and the others are replaced by hardlinks or reflinks to it, or
+    moved to --quarantine-dir. --dry-run reports the space that would be
+    reclaimed without changing anything.
+    """
+    try:
+        shard_ = Shard.parse(shard, shard_by) if shard else None
+    except ValueError as exc:
+        raise typer.BadParameter(str(exc)) from None
+    if shard_ and similar:
+        raise typer.BadParameter("--similar cannot be combined with --shard")
+    if against and (similar or shard_):
+        raise typer.BadParameter(
+            "--against cannot be combined with --similar or --shard"
+        )
+    if resolve and (similar or shard_ or against):
+        raise typer.BadParameter(
+            "--resolve cannot be combined with --similar, --shard or --against"
+        )
+    if dry_run and not resolve:
+        raise typer.BadParameter("--dry-run only applies to --resolve")
+    if (resolve is Resolution.QUARANTINE) != bool(quarantine_dir):
+        raise typer.BadParameter(
+            "--quarantine-dir must be given exactly when using --resolve quarantine"
+        )
+    if against and not against.is_file():
+        raise typer.BadParameter(f"No index found at {against}")
+    try:
+        where_ = parse_query(where) if where else None
+    except QueryError as exc:
+        raise typer.BadParameter(str(exc)) from None
     settings_ = Settings(settings)
-    library = Library(path, settings_)
-    library.identify_duplicates()
+    output_ = output.create()
+    cache_ = MetadataCache(rebuild=rebuild_cache) if cache else None
+    index_ = LibraryIndex(index_file) if where_ else None
+    against_index = LibraryIndex(against) if against else None
+    library = Library(
+        path,
+        settings_,
+        cache_,
+        workers=workers,
+        output=output_,
+        shard=shard_,
+        where=where_,
+        index=index_,
+    )
+    try:
+        if similar:
+            library.identify_similar(threshold)
+            return
+        if against_index:
+            library.find_in_index(against_index)
+            return
+        partial_ = (
+            open_partial(
+                partial or Path(f"duplicates-{shard_.index}-of-{shard_.count}.jsonl"),
+                shard_,
+                "duplicates",
+                library.base_path,
+            )
+            if shard_
+            else nullcontext(library.output)
+        )
+        resolver = None
+        if resolve:
+            if quarantine_dir and quarantine_dir.resolve().is_relative_to(
+                library.base_path
+            ):
+                raise typer.BadParameter("--quarantine-dir must be outside the library")
+            resolver = DuplicateResolver(
+                resolve,
+                keep=keep,
+                base_path=library.base_path,
+                quarantine=quarantine_dir.resolve() if quarantine_dir else None,
+                dry_run=dry_run,
+            )
+        with partial_ as library.output:
+            library.identify_duplicates(resolver)
+    finally:
+        if cache_:
+            cache_.close()
+        if index_:
+            index_.close()
+        if against_index:
+            against_index.close()
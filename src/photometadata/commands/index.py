@@ -0,0 +1,39 @@
+"""Command for building a fingerprint index of a photo library"""
+
+import logging
+import typer
+from pathlib import Path
+
+from photometadata.cache import LibraryIndex, MetadataCache
+from photometadata.library import Library
+from photometadata.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+index_command = typer.Typer()
+
+
+@index_command.command(no_args_is_help=True)
+def index(
+    path: str,
+    settings: str = "settings.yaml",
+    *,
+    index_file: Path | None = None,
+    cache: bool = True,
+    rebuild_cache: bool = False,
+    workers: int = 1,
+) -> None:
+    """Add a library to a fingerprint index, or update it if already indexed.
+
+    Only new or modified photos are read. Other libraries can then be checked
+    for photos that are already in the index with `duplicates --against`.
+    """
+    settings_ = Settings(settings)
+    cache_ = MetadataCache(rebuild=rebuild_cache) if cache else None
+    index_ = LibraryIndex(index_file)
+    try:
+        Library(path, settings_, cache_, workers=workers).update_index(index_)
+    finally:
+        index_.close()
+        if cache_:
+            cache_.close()
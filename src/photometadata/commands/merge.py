@@ -0,0 +1,29 @@
+"""Command for combining partial results from sharded runs"""
+
+import logging
+import typer
+from pathlib import Path
+
+from photometadata.output import OutputFormat
+from photometadata.shard import merge as merge_partials
+
+logger = logging.getLogger(__name__)
+
+merge_command = typer.Typer()
+
+
+@merge_command.command(no_args_is_help=True)
+def merge(
+    partials: list[Path],
+    *,
+    output: OutputFormat = OutputFormat.RICH,
+) -> None:
+    """Combine partial results written by check or duplicates with --shard.
+
+    Check results are summarised for the whole library, and duplicates are
+    found across all shards.
+    """
+    try:
+        merge_partials(partials, output.create())
+    except ValueError as exc:
+        raise typer.BadParameter(str(exc)) from None
@@ -2,8 +2,13 @@
 
 import logging
 import typer
+from pathlib import Path
 
-from photometadata.library import Library
+from photometadata.cache import LibraryIndex, MetadataCache
+from photometadata.library import Library, Pool
+from photometadata.output import OutputFormat
+from photometadata.query import QueryError, parse as parse_query
+from photometadata.processors import WriterBackend
 from photometadata.settings import Settings
 
 logger = logging.getLogger(__name__)
@@ -12,8 +17,73 @@ metadata_command = typer.Typer()
 
 
 @metadata_command.command(no_args_is_help=True)
-def metadata(path: str, settings: str = "settings.yaml") -> None:
-    """Fix inconsistent photo metadata."""
+def metadata(
+    path: str,
+    settings: str = "settings.yaml",
+    *,
+    cache: bool = True,
+    rebuild_cache: bool = False,
+    workers: int = 1,
+    jobs: int = 1,
+    pool: Pool = Pool.THREAD,
+    output: OutputFormat = OutputFormat.RICH,
+    where: str | None = None,
+    index_file: Path | None = None,
+    batch: bool = False,
+    writer: WriterBackend = WriterBackend.EXIV2,
+    filename: bool = False,
+    interactive: bool = True,
+    plan: Path | None = None,
+    apply: Path | None = None,
+    explain: bool = False,
+) -> None:
+    """Fix inconsistent photo metadata.
+
+    With --explain, the copyright rule that matched each photo is logged. With
+    --jobs, up to that many photos are fixed at a time on a --pool of threads or
+    processes, which needs --no-interactive (and no --batch) unless applying a
+    plan.
+    """
+    if plan and apply:
+        raise typer.BadParameter("--plan and --apply cannot be used together")
+    if jobs > 1 and not (plan or apply) and (interactive or batch):
+        raise typer.BadParameter(
+            "--jobs needs --no-interactive and cannot be used with --batch"
+        )
+    try:
+        where_ = parse_query(where) if where else None
+    except QueryError as exc:
+        raise typer.BadParameter(str(exc)) from None
     settings_ = Settings(settings)
-    library = Library(path, settings_)
-    library.fix_metadata()
+    output_ = output.create()
+    cache_ = MetadataCache(rebuild=rebuild_cache) if cache else None
+    index_ = LibraryIndex(index_file) if where_ else None
+    library = Library(
+        path,
+        settings_,
+        cache_,
+        workers=workers,
+        jobs=jobs,
+        pool=pool,
+        output=output_,
+        where=where_,
+        index=index_,
+    )
+    try:
+        if plan:
+            library.plan_metadata(plan, filename=filename, explain=explain)
+        elif apply:
+            library.apply_plan(apply, writer=writer)
+        else:
+            library.fix_metadata(
+                batch=batch,
+                writer=writer,
+                filename=filename,
+                interactive=interactive,
+                explain=explain,
+            )
+    finally:
+        if cache_:
+            cache_.close()
+        if index_:
+            index_.close()
@@ -0,0 +1,228 @@
+"""In-place editing of the EXIF (TIFF) data stored in a JPEG APP1 segment"""
+
+import struct
+
+EXIF_SIGNATURE = b"Exif\x00\x00"
+
+# Sizes in bytes of each TIFF field type
+TYPE_SIZES = {
+    1: 1,
+    2: 1,
+    3: 2,
+    4: 4,
+    5: 8,
+    6: 1,
+    7: 1,
+    8: 2,
+    9: 4,
+    10: 8,
+    11: 4,
+    12: 8,
+    13: 4,
+}
+ASCII = 2
+LONG = 4
+
+IFD0 = "Image"
+EXIF_IFD = "Photo"
+EXIF_IFD_POINTER = 0x8769
+GPS_IFD_POINTER = 0x8825
+INTEROPERABILITY_IFD_POINTER = 0xA005
+SUB_IFD_POINTERS = {EXIF_IFD_POINTER, GPS_IFD_POINTER, INTEROPERABILITY_IFD_POINTER}
+THUMBNAIL_OFFSET = 0x0201
+THUMBNAIL_LENGTH = 0x0202
+
+# Writable ASCII tags, indexed by their exiv2 key
+TAGS = {
+    "Exif.Image.DocumentName": (IFD0, 0x010D),
+    "Exif.Image.ImageDescription": (IFD0, 0x010E),
+    "Exif.Image.Make": (IFD0, 0x010F),
+    "Exif.Image.Model": (IFD0, 0x0110),
+    "Exif.Image.Software": (IFD0, 0x0131),
+    "Exif.Image.DateTime": (IFD0, 0x0132),
+    "Exif.Image.Artist": (IFD0, 0x013B),
+    "Exif.Image.Copyright": (IFD0, 0x8298),
+    "Exif.Photo.DateTimeOriginal": (EXIF_IFD, 0x9003),
+    "Exif.Photo.DateTimeDigitized": (EXIF_IFD, 0x9004),
+}
+
+Entry = tuple[int, int, bytes]
+
+
+class ExifError(ValueError):
+    """Raised when EXIF data is malformed or cannot be updated"""
+
+
+class _Tiff:
+    """Mutable TIFF structure that only ever appends or overwrites data in place.
+
+    Existing values are never moved, so offsets stored inside opaque values such
+    as MakerNotes remain valid after editing.
+    """
+
+    def __init__(self, data: bytes) -> None:
+        self.data = bytearray(data)
+        if self.data[:2] not in (b"II", b"MM"):
+            raise ExifError("Unknown TIFF byte order")
+        self.order = "<" if self.data[:2] == b"II" else ">"
+        if self.unpack("H", 2) != 42:
+            raise ExifError("Invalid TIFF header")
+
+    def unpack(self, fmt: str, offset: int) -> int:
+        if offset + struct.calcsize(fmt) > len(self.data):
+            raise ExifError(f"Offset {offset} is outside the EXIF data")
+        return struct.unpack_from(self.order + fmt, self.data, offset)[0]
+
+    def pack(self, fmt: str, value: int) -> bytes:
+        return struct.pack(self.order + fmt, value)
+
+    def read_ifd(self, offset: int) -> tuple[dict[int, Entry], int]:
+        """Return the entries of an IFD and the offset of the next IFD"""
+        count = self.unpack("H", offset)
+        entries = {}
+        for idx in range(count):
+            position = offset + 2 + 12 * idx
+            entries[self.unpack("H", position)] = (
+                self.unpack("H", position + 2),
+                self.unpack("I", position + 4),
+                bytes(self.data[position + 8 : position + 12]),
+            )
+        return entries, self.unpack("I", offset + 2 + 12 * count)
+
+    def pointer(self, entry: Entry) -> int:
+        """Return the offset stored in an entry with a single LONG value"""
+        return struct.unpack(self.order + "I", entry[2])[0]
+
+    def location(self, entry: Entry) -> tuple[int, int] | None:
+        """Return (offset, size) of an entry value stored outside its IFD"""
+        type_, count, raw = entry
+        size = TYPE_SIZES.get(type_, 1) * count
+        if size <= 4:
+            return None
+        return self.pointer(entry), size
+
+    def ranges(
+        self, offset: int, visited: set[int] | None = None
+    ) -> list[tuple[int, int]]:
+        """Return (start, end) of an IFD, its values and any IFDs it points to"""
+        visited = visited if visited is not None else set()
+        if offset in visited:
+            raise ExifError(f"IFD at offset {offset} is referenced more than once")
+        visited.add(offset)
+        entries, _ = self.read_ifd(offset)
+        ranges = [(offset, offset + 6 + 12 * len(entries))]
+        for tag, entry in entries.items():
+            if tag in SUB_IFD_POINTERS:
+                ranges += self.ranges(self.pointer(entry), visited)
+            elif location := self.location(entry):
+                ranges.append((location[0], location[0] + location[1]))
+        return ranges
+
+    def append(self, data: bytes) -> int:
+        """Append word-aligned data, returning its offset"""
+        if len(self.data) % 2:
+            self.data.append(0)
+        offset = len(self.data)
+        self.data += data
+        return offset
+
+    def set_value(
+        self, entries: dict[int, Entry], tag: int, type_: int, value: bytes
+    ) -> None:
+        """Set the value of a tag, reusing the space of the old value if it fits"""
+        if len(value) <= 4:
+            raw = value.ljust(4, b"\x00")
+        else:
+            location = self.location(entries[tag]) if tag in entries else None
+            if location and location[1] >= len(value):
+                offset = location[0]
+                self.data[offset : offset + len(value)] = value
+            else:
+                offset = self.append(value)
+            raw = self.pack("I", offset)
+        entries[tag] = (type_, len(value) // TYPE_SIZES[type_], raw)
+
+    def write_ifd(
+        self, entries: dict[int, Entry], next_offset: int, old_offset: int | None
+    ) -> int:
+        """Write an IFD in place if it fits, otherwise append it"""
+        data = self.pack("H", len(entries))
+        for tag in sorted(entries):
+            type_, count, raw = entries[tag]
+            data += self.pack("H", tag) + self.pack("H", type_)
+            data += self.pack("I", count) + raw
+        data += self.pack("I", next_offset)
+        if old_offset is not None:
+            old_count = self.unpack("H", old_offset)
+            if len(entries) <= old_count:
+                self.data[old_offset : old_offset + len(data)] = data
+                return old_offset
+        return self.append(data)
+
+
+def read_thumbnail(payload: bytes) -> bytes | None:
+    """Return the JPEG thumbnail stored in IFD1 of an APP1 payload, if there is one"""
+    if not payload.startswith(EXIF_SIGNATURE):
+        raise ExifError("APP1 segment does not contain EXIF data")
+    tiff = _Tiff(payload[len(EXIF_SIGNATURE) :])
+    _, ifd1_offset = tiff.read_ifd(tiff.unpack("I", 4))
+    if not ifd1_offset:
+        return None
+    ifd1, _ = tiff.read_ifd(ifd1_offset)
+    if THUMBNAIL_OFFSET not in ifd1 or THUMBNAIL_LENGTH not in ifd1:
+        return None
+    offset = tiff.pointer(ifd1[THUMBNAIL_OFFSET])
+    length = tiff.pointer(ifd1[THUMBNAIL_LENGTH])
+    if offset + length > len(tiff.data):
+        raise ExifError("Thumbnail extends beyond the EXIF data")
+    return bytes(tiff.data[offset : offset + length])
+
+
+def update_exif(
+    payload: bytes | None, tags: dict[str, str], *, delete_thumbnail: bool = False
+) -> bytes:
+    """Return a new APP1 payload with the given tags set.
+
+    `payload` is the existing APP1 payload (including the 'Exif' signature), or
+    None to create new EXIF data. Tags are identified by their exiv2 keys.
+    """
+    updates: dict[str, dict[int, bytes]] = {IFD0: {}, EXIF_IFD: {}}
+    for key, value in tags.items():
+        if key not in TAGS:
+            raise ExifError(f"Writing {key} is not supported")
+        ifd, tag = TAGS[key]
+        updates[ifd][tag] = value.encode("utf-8") + b"\x00"
+
+    if payload is None:
+        # Little-endian TIFF header followed by an empty IFD0
+        payload = EXIF_SIGNATURE + b"II*\x00\x08\x00\x00\x00" + bytes(6)
+    if not payload.startswith(EXIF_SIGNATURE):
+        raise ExifError("APP1 segment does not contain EXIF data")
+    tiff = _Tiff(payload[len(EXIF_SIGNATURE) :])
+    ifd0_offset = tiff.unpack("I", 4)
+    ifd0, ifd1_offset = tiff.read_ifd(ifd0_offset)
+
+    if delete_thumbnail and ifd1_offset:
+        ifd1, _ = tiff.read_ifd(ifd1_offset)
+        start = ifd1_offset
+        if THUMBNAIL_OFFSET in ifd1:
+            start = min(start, tiff.pointer(ifd1[THUMBNAIL_OFFSET]))
+        # Reclaim the thumbnail's space if nothing else is stored after it
+        if max(end for _, end in tiff.ranges(ifd0_offset)) <= start:
+            del tiff.data[start:]
+        ifd1_offset = 0
+
+    for tag, value in updates[IFD0].items():
+        tiff.set_value(ifd0, tag, ASCII, value)
+    if updates[EXIF_IFD]:
+        exif_offset = (
+            tiff.pointer(ifd0[EXIF_IFD_POINTER]) if EXIF_IFD_POINTER in ifd0 else None
+        )
+        exif_ifd, exif_next = tiff.read_ifd(exif_offset) if exif_offset else ({}, 0)
+        for tag, value in updates[EXIF_IFD].items():
+            tiff.set_value(exif_ifd, tag, ASCII, value)
+        exif_offset = tiff.write_ifd(exif_ifd, exif_next, exif_offset)
+        ifd0[EXIF_IFD_POINTER] = (LONG, 1, tiff.pack("I", exif_offset))
+    ifd0_offset = tiff.write_ifd(ifd0, ifd1_offset, ifd0_offset)
+    tiff.data[4:8] = tiff.pack("I", ifd0_offset)
+    return EXIF_SIGNATURE + bytes(tiff.data)
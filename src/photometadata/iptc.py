@@ -0,0 +1,137 @@
+"""Reading and editing IPTC data stored in a JPEG APP13 (Photoshop) segment"""
+
+import struct
+from dataclasses import dataclass
+from hashlib import md5
+
+PHOTOSHOP_SIGNATURE = b"Photoshop 3.0\x00"
+RESOURCE_SIGNATURE = b"8BIM"
+IPTC_RESOURCE = 0x0404
+IPTC_DIGEST_RESOURCE = 0x0425
+KEYWORDS = (2, 25)
+RECORD_VERSION = (2, 0)
+CODED_CHARACTER_SET = (1, 90)
+UTF8 = b"\x1b%G"
+
+
+class IptcError(ValueError):
+    """Raised when IPTC data is malformed"""
+
+
+@dataclass
+class Resource:
+    """A Photoshop image resource"""
+
+    signature: bytes
+    resource_id: int
+    name: bytes
+    data: bytes
+
+
+def read_resources(payload: bytes) -> list[Resource]:
+    """Split a Photoshop APP13 payload into its image resources"""
+    if not payload.startswith(PHOTOSHOP_SIGNATURE):
+        raise IptcError("APP13 segment does not contain Photoshop resources")
+    resources = []
+    offset = len(PHOTOSHOP_SIGNATURE)
+    while offset + 12 <= len(payload):
+        signature = payload[offset : offset + 4]
+        (resource_id,) = struct.unpack_from(">H", payload, offset + 4)
+        name_length = payload[offset + 6]
+        # The name is a Pascal string padded to an even length
+        name_end = offset + 7 + name_length + (name_length + 1) % 2
+        name = payload[offset + 7 : offset + 7 + name_length]
+        if name_end + 4 > len(payload):
+            raise IptcError("Truncated Photoshop resource")
+        (size,) = struct.unpack_from(">I", payload, name_end)
+        data = payload[name_end + 4 : name_end + 4 + size]
+        if len(data) < size:
+            raise IptcError("Truncated Photoshop resource")
+        resources.append(Resource(signature, resource_id, name, data))
+        offset = name_end + 4 + size + size % 2
+    return resources
+
+
+def write_resources(resources: list[Resource]) -> bytes:
+    """Join image resources into a Photoshop APP13 payload"""
+    payload = bytearray(PHOTOSHOP_SIGNATURE)
+    for resource in resources:
+        name, data = resource.name, resource.data
+        payload += resource.signature
+        payload += struct.pack(">HB", resource.resource_id, len(name)) + name
+        if (len(name) + 1) % 2:
+            payload.append(0)
+        payload += struct.pack(">I", len(data)) + data
+        if len(data) % 2:
+            payload.append(0)
+    return bytes(payload)
+
+
+def read_datasets(data: bytes) -> list[tuple[int, int, bytes]]:
+    """Split IPTC-IIM data into (record, dataset, value) tuples"""
+    datasets = []
+    offset = 0
+    while offset + 5 <= len(data) and data[offset] == 0x1C:
+        record, dataset = data[offset + 1], data[offset + 2]
+        (size,) = struct.unpack_from(">H", data, offset + 3)
+        offset += 5
+        # Extended datasets store the length of their size field instead
+        if size & 0x8000:
+            n_bytes = size & 0x7FFF
+            size = int.from_bytes(data[offset : offset + n_bytes], "big")
+            offset += n_bytes
+        datasets.append((record, dataset, data[offset : offset + size]))
+        offset += size
+    return datasets
+
+
+def write_datasets(datasets: list[tuple[int, int, bytes]]) -> bytes:
+    """Join (record, dataset, value) tuples into IPTC-IIM data"""
+    data = bytearray()
+    for record, dataset, value in datasets:
+        if len(value) > 0x7FFF:
+            data += struct.pack(">BBBHI", 0x1C, record, dataset, 0x8004, len(value))
+        else:
+            data += struct.pack(">BBBH", 0x1C, record, dataset, len(value))
+        data += value
+    return bytes(data)
+
+
+def read_keywords(payload: bytes) -> list[str]:
+    """Return the keywords stored in a Photoshop APP13 payload"""
+    for resource in read_resources(payload):
+        if resource.resource_id == IPTC_RESOURCE:
+            return [
+                value.decode("utf-8", errors="replace")
+                for record, dataset, value in read_datasets(resource.data)
+                if (record, dataset) == KEYWORDS
+            ]
+    return []
+
+
+def add_keywords(payload: bytes | None, keywords: list[str]) -> bytes:
+    """Return a new APP13 payload with the given keywords added.
+
+    `payload` is the existing APP13 payload, or None to create a new one. Any
+    IPTC digest is updated so that other tools do not treat the data as stale.
+    """
+    resources = read_resources(payload) if payload else []
+    iptc = next((r for r in resources if r.resource_id == IPTC_RESOURCE), None)
+    if iptc is None:
+        iptc = Resource(RESOURCE_SIGNATURE, IPTC_RESOURCE, b"", b"")
+        resources.append(iptc)
+    datasets = read_datasets(iptc.data)
+    if not any((record, dataset) == RECORD_VERSION for record, dataset, _ in datasets):
+        datasets.append((*RECORD_VERSION, struct.pack(">H", 4)))
+    encoded = [keyword.encode("utf-8") for keyword in keywords]
+    if not all(value.isascii() for value in encoded) and not any(
+        (record, dataset) == CODED_CHARACTER_SET for record, dataset, _ in datasets
+    ):
+        datasets.append((*CODED_CHARACTER_SET, UTF8))
+    datasets += [(*KEYWORDS, value) for value in encoded]
+    # Datasets must be ordered by record, but otherwise keep their order
+    iptc.data = write_datasets(sorted(datasets, key=lambda dataset: dataset[0]))
+    for resource in resources:
+        if resource.resource_id == IPTC_DIGEST_RESOURCE:
+            resource.data = md5(iptc.data).digest()
+    return write_resources(resources)
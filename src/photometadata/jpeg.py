@@ -0,0 +1,203 @@
+"""Minimal reader and writer for the header segments of JPEG files"""
+
+import os
+import shutil
+import struct
+import tempfile
+from collections.abc import Container, Generator
+from pathlib import Path
+from typing import BinaryIO, NamedTuple
+
+from photometadata.exif import EXIF_SIGNATURE
+from photometadata.iptc import PHOTOSHOP_SIGNATURE
+
+SOI = 0xD8
+SOS = 0xDA
+APP0 = 0xE0
+APP1 = 0xE1
+APP13 = 0xED
+# Markers that are not followed by a length field
+STANDALONE_MARKERS = {0x01, *range(0xD0, 0xD8)}
+# Start-of-frame markers, excluding DHT (C4), JPG (C8) and DAC (CC)
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# Largest payload that fits into a single segment
+MAX_SEGMENT_SIZE = 0xFFFF - 2
+
+
+class JpegError(ValueError):
+    """Raised when a file does not have a valid JPEG header"""
+
+
+class JpegHeader(NamedTuple):
+    """Image properties that can be read without decoding the image data"""
+
+    width: int
+    height: int
+    scan_offset: int
+    tables: bytes
+
+    def payload_size(self, file_size: int) -> int:
+        """Return the number of bytes that encode the image, excluding metadata"""
+        return len(self.tables) + file_size - self.scan_offset
+
+
+class JpegMetadata(NamedTuple):
+    """Image dimensions and raw metadata payloads read from a JPEG header"""
+
+    width: int
+    height: int
+    exif: bytes | None
+    iptc: bytes | None
+    scan_offset: int
+    tables_size: int
+
+    def payload_size(self, file_size: int) -> int:
+        """Return the number of bytes that encode the image, as JpegHeader does"""
+        return self.tables_size + file_size - self.scan_offset
+
+
+class Segment(NamedTuple):
+    """A marker segment, with its payload excluding the marker and length"""
+
+    marker: int
+    data: bytes
+
+
+def is_metadata_marker(marker: int) -> bool:
+    """Whether a marker introduces an APPn or COM segment"""
+    return 0xE0 <= marker <= 0xEF or marker == 0xFE
+
+
+def iter_segments(
+    binary: BinaryIO, *, skip_metadata: bool = False, keep: Container[int] = ()
+) -> Generator[tuple[int, int, bytes | None], None, None]:
+    """Generator that yields (marker, offset, data) for segments before the scan.
+
+    The final item is the start-of-scan marker, whose offset is the position at
+    which the entropy-coded image data begins and whose data is None. Metadata
+    segments, other than those with markers in `keep`, are yielded with None
+    data when `skip_metadata` is set.
+    """
+    if binary.read(2) != b"\xff\xd8":
+        raise JpegError("Missing start-of-image marker")
+    while True:
+        if binary.read(1) != b"\xff":
+            raise JpegError(f"Expected a marker at offset {binary.tell() - 1}")
+        marker = binary.read(1)
+        # Any number of 0xFF fill bytes may precede a marker
+        while marker == b"\xff":
+            marker = binary.read(1)
+        if not marker:
+            raise JpegError("Unexpected end of file")
+        if marker[0] in STANDALONE_MARKERS:
+            continue
+        offset = binary.tell() - 2
+        if marker[0] == SOS:
+            yield SOS, offset, None
+            return
+        length_bytes = binary.read(2)
+        if len(length_bytes) < 2:
+            raise JpegError("Unexpected end of file")
+        (length,) = struct.unpack(">H", length_bytes)
+        if skip_metadata and is_metadata_marker(marker[0]) and marker[0] not in keep:
+            binary.seek(length - 2, os.SEEK_CUR)
+            yield marker[0], offset, None
+            continue
+        data = binary.read(length - 2)
+        if len(data) < length - 2:
+            raise JpegError("Unexpected end of file")
+        yield marker[0], offset, data
+
+
+def read_header(binary: BinaryIO) -> JpegHeader:
+    """Read the segments preceding the first scan of a JPEG file.
+
+    Metadata segments are skipped without being read. All other segments (for
+    example quantisation and Huffman tables and the frame header) are returned
+    in `tables` as they affect how the image data is decoded.
+    """
+    width, height = None, None
+    tables = []
+    for marker, offset, data in iter_segments(binary, skip_metadata=True):
+        if marker == SOS:
+            if width is None or height is None:
+                raise JpegError("Missing start-of-frame segment")
+            return JpegHeader(width, height, offset, b"".join(tables))
+        if data is None:
+            continue
+        if marker in SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[1:5])
+        tables.append(struct.pack(">BBH", 0xFF, marker, len(data) + 2) + data)
+    raise JpegError("Missing start-of-scan marker")
+
+
+def read_metadata(binary: BinaryIO) -> JpegMetadata:
+    """Read the dimensions and the EXIF and IPTC payloads of a JPEG file.
+
+    Only the header segments are read, skipping over any other metadata such as
+    ICC profiles, so this reads kilobytes rather than the whole file.
+    """
+    width, height = None, None
+    exif, iptc = None, None
+    tables_size = 0
+    for marker, offset, data in iter_segments(
+        binary, skip_metadata=True, keep=(APP1, APP13)
+    ):
+        if marker == SOS:
+            if width is None or height is None:
+                raise JpegError("Missing start-of-frame segment")
+            return JpegMetadata(width, height, exif, iptc, offset, tables_size)
+        if data is None:
+            continue
+        if not is_metadata_marker(marker):
+            # Counted as in the tables returned by read_header()
+            tables_size += len(data) + 4
+        if marker in SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[1:5])
+        elif marker == APP1 and exif is None and data.startswith(EXIF_SIGNATURE):
+            exif = data
+        elif marker == APP13 and iptc is None and data.startswith(PHOTOSHOP_SIGNATURE):
+            iptc = data
+    raise JpegError("Missing start-of-scan marker")
+
+
+def read_segments(binary: BinaryIO) -> tuple[list[Segment], int]:
+    """Read all segments preceding the first scan, with the offset of the scan"""
+    segments = []
+    for marker, offset, data in iter_segments(binary):
+        if data is None:
+            return segments, offset
+        segments.append(Segment(marker, data))
+    raise JpegError("Missing start-of-scan marker")
+
+
+def rewrite(file_path: str | Path, segments: list[Segment], scan_offset: int) -> None:
+    """Replace the header segments of a JPEG file, copying the image data as-is.
+
+    The new file is written alongside the original and then moved into place,
+    so that the original is left untouched if anything goes wrong.
+    """
+    path = Path(file_path)
+    with open(path, "rb") as source:
+        with tempfile.NamedTemporaryFile(
+            "wb", dir=path.parent, prefix=f".{path.name}.", delete=False
+        ) as target:
+            try:
+                target.write(b"\xff\xd8")
+                for segment in segments:
+                    if len(segment.data) > MAX_SEGMENT_SIZE:
+                        raise JpegError(
+                            f"Segment 0x{segment.marker:02X} is too large to write"
+                        )
+                    target.write(
+                        struct.pack(">BBH", 0xFF, segment.marker, len(segment.data) + 2)
+                    )
+                    target.write(segment.data)
+                source.seek(scan_offset)
+                shutil.copyfileobj(source, target)
+            except BaseException:
+                target.close()
+                os.unlink(target.name)
+                raise
+    shutil.copymode(path, target.name)
+    os.replace(target.name, path)
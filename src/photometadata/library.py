@@ -1,8 +1,31 @@
 import logging
-from collections import Counter
-from collections.abc import Generator, Iterable
-from pathlib import Path
+import os
+from collections import Counter, defaultdict, deque
+from collections.abc import Generator, Iterable, Iterator
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from enum import Enum
+from itertools import groupby
+from pathlib import Path, PurePosixPath
+from typing import Any
+from photometadata.cache import (
+    CheckJournal,
+    ClassificationCache,
+    LibraryIndex,
+    MetadataCache,
+)
+from photometadata.metadata import Metadata
+from photometadata.output import ResultWriter, log_results
 from photometadata.photo import Photo
+from photometadata import profiling
+from photometadata.query import Query
+from photometadata.resolution import DuplicateResolver
+from photometadata.scanner import FileEntry, Scanner
+from photometadata.shard import Shard
 from photometadata.settings import Settings
 from photometadata.processors import (
     Checker,
@@ -10,77 +33,789 @@ from photometadata.processors import (
     DuplicateIdentifier,
     MetadataFixer,
     ProcessingResult,
+    Processor,
+    SimilarityIdentifier,
+    WriterBackend,
+    read_plan,
+    write_plan,
 )
 
 logger = logging.getLogger(__name__)
 
 
+class Pool(str, Enum):
+    THREAD = "thread"
+    PROCESS = "process"
+
+    def create(self, jobs: int) -> Executor:
+        """Create an executor running up to `jobs` processors at a time"""
+        if self is Pool.PROCESS:
+            return ProcessPoolExecutor(jobs)
+        return ThreadPoolExecutor(jobs)
+
+
+def run_processor(
+    processor: Processor, photo: Photo, stage: str
+) -> ProcessingResult | None:
+    """Process a single photo on a pool, recording the time it took"""
+    with profiling.span(stage):
+        return processor(photo)
+
+
+def attach_photos(
+    results: list[ProcessingResult], photos: Iterable[Photo]
+) -> list[ProcessingResult]:
+    """Attach the photo each flushed result is for, matched on the path it names"""
+    by_path = {photo.metadata.filepath: photo for photo in photos}
+    for result in results:
+        if result.photo is None and result.path is not None:
+            result.photo = by_path.get(Path(result.path))
+    return results
+
+
 class Library:
-    def __init__(self, path: str | Path, settings: Settings) -> None:
+    # Photos in flight per job when running processors concurrently, which
+    # bounds memory use while keeping every job busy
+    PENDING_PER_JOB = 4
+
+    def __init__(
+        self,
+        path: str | Path,
+        settings: Settings,
+        cache: MetadataCache | None = None,
+        workers: int = 1,
+        output: ResultWriter | None = None,
+        shard: Shard | None = None,
+        jobs: int = 1,
+        pool: Pool = Pool.THREAD,
+        where: Query | None = None,
+        index: LibraryIndex | None = None,
+    ) -> None:
         self.base_path = Path(path).resolve(strict=True)
         logger.info(f"Looking for files under [cyan]{self.base_path}[/]")
         self.settings = settings
-        filepaths = [
-            filepath
-            for ext in self.settings.extensions
-            for filepath in self.base_path.rglob(f"*.{ext}")
-        ]
+        self.cache = cache
+        self.workers = workers
+        self.output = output
+        self.shard = shard
+        self.jobs = jobs
+        self.pool = pool
+        self.where = where
+        self.index = index
+        if where and not index:
+            raise ValueError("Selecting photos with a filter needs a library index")
+        if shard:
+            logger.info(f"Only processing shard [bold]{shard}[/] of the library")
+
+    def check_photos(
+        self,
+        broken_only: bool,
+        *,
+        verify_images: bool = True,
+        journal: CheckJournal | None = None,
+    ) -> None:
+        """Check metadata for all photos in the library.
+
+        With a journal, only photos that changed since they were last checked are
+        checked again, while the summary still covers the whole library.
+        """
+        checker = Checker(broken_only=broken_only, verify_images=verify_images)
+        # Without verification only the file headers need to be read
+        if journal:
+            mode = f"broken_only={broken_only} verify_images={verify_images}"
+            results = self.process_changed(
+                checker, journal, mode, fingerprint=verify_images
+            )
+        else:
+            results = self.process(checker, fingerprint=verify_images)
+        self.summarise(results)
+
+    def classify_photos(
+        self,
+        *,
+        batch: bool = False,
+        writer: WriterBackend = WriterBackend.EXIV2,
+        concurrency: int = 1,
+        classification_cache: ClassificationCache | None = None,
+    ) -> None:
+        """Add tags to all photos in the library using Azure Compute Vision."""
+        classifier = Classifier(
+            self.settings,
+            batch=batch,
+            writer=writer,
+            concurrency=concurrency,
+            cache=classification_cache,
+        )
+        self.summarise(self.process(classifier))
+
+    def fix_metadata(
+        self,
+        *,
+        batch: bool = False,
+        writer: WriterBackend = WriterBackend.EXIV2,
+        filename: bool = False,
+        interactive: bool = True,
+        explain: bool = False,
+    ) -> None:
+        """Fix inconsistent photo metadata in the library.
+
+        When not `interactive`, photos with values that would need to be chosen
+        are skipped, and the others can be fixed concurrently.
+        """
+        fixer = MetadataFixer(
+            self.settings,
+            batch=batch,
+            writer=writer,
+            filename=filename,
+            interactive=interactive,
+            explain=explain,
+        )
+        self.summarise(self.process(fixer))
+
+    def plan_metadata(
+        self, plan_path: str | Path, *, filename: bool = False, explain: bool = False
+    ) -> None:
+        """Record the metadata fixes needed in the library without prompting.
+
+        Values that would need user input are left unresolved in the plan, which
+        can be reviewed and edited before applying it with apply_plan().
+        """
+        fixer = MetadataFixer(
+            self.settings, filename=filename, interactive=False, explain=explain
+        )
+        n_fixes = Counter()
+        with open(plan_path, "w", encoding="utf-8") as plan:
+            for photo in self.walk(fingerprint=False):
+                fix = fixer.plan(photo)
+                if fix.tags or fix.unresolved:
+                    write_plan(plan, [fix])
+                    n_fixes["planned"] += 1
+                    n_fixes["unresolved"] += bool(fix.unresolved)
         logger.info(
-            f"Found [bold]{len(filepaths)}[/] files under [cyan]{self.base_path}[/]"
+            f"Planned fixes for [bold]{n_fixes['planned']}[/] photos in [cyan]{plan_path}[/], of which [bold]{n_fixes['unresolved']}[/] need a value to be chosen"
         )
-        self.photos = [Photo(filepath) for filepath in sorted(filepaths)]
+
+    def apply_plan(
+        self,
+        plan_path: str | Path,
+        *,
+        writer: WriterBackend = WriterBackend.EXIV2,
+        chunk_size: int = 500,
+    ) -> None:
+        """Apply the fixes in a plan to photos in the library, writing concurrently.
+
+        With a single job, fixes are written in batches of `chunk_size`, which
+        the writer applies several files at a time. With more jobs, each fix is
+        applied on its own on the pool, with results still in plan order.
+        Fixes for photos outside the library, with unresolved values or for files
+        that changed since the plan was made are skipped.
+        """
+        with open(plan_path, encoding="utf-8") as plan:
+            fixes = [
+                fix
+                for fix in read_plan(plan)
+                if fix.path.is_relative_to(self.base_path)
+            ]
         logger.info(
-            f"Loaded metadata for [bold]{len(self.photos)}[/] photos under [cyan]{self.base_path}[/]"
+            f"Applying [bold]{len(fixes)}[/] planned fixes from [cyan]{plan_path}[/]"
+        )
+        fixer = MetadataFixer(
+            self.settings, batch=self.jobs == 1, writer=writer, interactive=False
         )
 
-    def check_photos(self, broken_only: bool) -> None:
-        """Check metadata for all photos in the library."""
-        checker = Checker(broken_only=broken_only)
-        self.summarise(map(lambda photo: checker(photo), self.walk()))
+        def results() -> Iterator[ProcessingResult]:
+            for start in range(0, len(fixes), chunk_size):
+                for fix in fixes[start : start + chunk_size]:
+                    if (result := fixer.execute(fix)) is not None:
+                        yield result
+                yield from fixer.flush()
 
-    def classify_photos(self) -> None:
-        """Add tags to all photos in the library using Azure Compute Vision."""
-        classifier = Classifier(self.settings)
-        self.summarise(map(lambda photo: classifier(photo), self.walk()))
+        def concurrent_results() -> Iterator[ProcessingResult]:
+            profiled = self.pool is Pool.PROCESS and profiling.is_enabled()
+            pending: deque[Future] = deque()
+            limit = self.jobs * self.PENDING_PER_JOB
+
+            def finish(future: Future) -> list[ProcessingResult]:
+                result = future.result()
+                if profiled:
+                    result, stages = result
+                    profiling.merge(stages)
+                return [] if result is None else [result]
+
+            executor = self.pool.create(self.jobs)
+            try:
+                for fix in fixes:
+                    while len(pending) >= limit:
+                        yield from finish(pending.popleft())
+                    if profiled:
+                        pending.append(
+                            executor.submit(profiling.profiled, fixer.execute, fix)
+                        )
+                    else:
+                        pending.append(executor.submit(fixer.execute, fix))
+                while pending:
+                    yield from finish(pending.popleft())
+            finally:
+                executor.shutdown(cancel_futures=True)
+
+        self.summarise(concurrent_results() if self.jobs > 1 else results())
 
-    def fix_metadata(self) -> None:
-        """Fix inconsistent photo metadata in the library."""
-        fixer = MetadataFixer(self.settings)
-        self.summarise(map(lambda photo: fixer(photo), self.walk()))
+    def identify_duplicates(self, resolver: DuplicateResolver | None = None) -> None:
+        """Identify duplicates among all photos in the library.
 
-    def identify_duplicates(self) -> None:
-        """Identify duplicates among all photos in the library."""
+        With a resolver, one photo of each group is kept and the others are
+        replaced or moved to reclaim their space.
+        """
         duplicate_identifier = DuplicateIdentifier()
-        for photo in self.walk():
+        for photo in self.walk(fingerprint=False):
             duplicate_identifier(photo)
+        for group in duplicate_identifier.identify():
+            logger.debug(f"Duplicates: {', '.join(str(p.metadata) for p in group)}")
+        fields: dict[int, dict[str, Any]] = defaultdict(dict)
+        if self.shard:
+            # Keys that let duplicates in other shards be matched when merging.
+            # Any photo may match one in another shard, so each is fingerprinted
+            # to verify matches in the same way as within a shard.
+            for key, group in duplicate_identifier.candidates.items():
+                for photo in group:
+                    partial_hash = duplicate_identifier.partial_key(photo).hex()
+                    if key is not None and partial_hash:
+                        duplicate_identifier.fingerprint_key(photo)
+                    fields[id(photo)] |= {
+                        "header_key": key,
+                        "partial_hash": partial_hash or None,
+                    }
+        # Store fingerprints that were computed while comparing candidates
+        self.update_cache(duplicate_identifier.fingerprinted)
+        resolutions: dict[int, dict[str, Any]] = {}
+        if resolver:
+            resolutions = self.resolve_duplicates(
+                resolver, duplicate_identifier.duplicates
+            )
+        if self.output:
+            photos = [
+                photo
+                for group in duplicate_identifier.candidates.values()
+                for photo in group
+            ]
+            for photo_id, resolution in resolutions.items():
+                fields[photo_id] |= resolution
+            self.write_groups(photos, duplicate_identifier.duplicates, fields)
         logger.info(
             f"Found [bold]{duplicate_identifier.n_duplicates}[/] duplicate photo(s) in the library"
         )
 
-    def summarise(self, results: Iterable[ProcessingResult]) -> None:
-        """Summarise the result of a photo processing operation."""
-        n_photos = Counter()
-        for result in results:
+    def resolve_duplicates(
+        self, resolver: DuplicateResolver, groups: list[list[Photo]]
+    ) -> dict[int, dict[str, Any]]:
+        """Resolve groups of duplicates, returning record fields by id() of each copy"""
+        fields = {}
+        n_copies = Counter()
+        for replacement in resolver.resolve(groups):
+            result = replacement.result
             if result.success:
                 logger.debug(result.message)
             else:
-                logger.error(result.message)
-                n_photos["failed"] += 1
-            n_photos["processed"] += 1
-        percentage = (
-            100.0 * n_photos["failed"] / n_photos["processed"]
-            if n_photos["processed"]
-            else 0
+                logger.warning(result.message)
+            n_copies["resolved" if result.success else "skipped"] += 1
+            n_copies["bytes"] += replacement.reclaimed
+            fields[id(replacement.copy)] = {
+                "kept": str(replacement.keeper.path),
+                "resolved": result.success,
+                "reclaimed_bytes": replacement.reclaimed,
+            }
+        verb = "Would reclaim" if resolver.dry_run else "Reclaimed"
+        logger.info(
+            f"{verb} [bold]{n_copies['bytes'] / 2**20:.1f}[/] MiB by resolving [bold]{n_copies['resolved']}[/] duplicate(s) by {resolver.resolution.value}, skipping [bold]{n_copies['skipped']}[/]"
+        )
+        return fields
+
+    def identify_similar(self, threshold: int) -> None:
+        """Identify near-duplicates among all photos in the library."""
+        similarity_identifier = SimilarityIdentifier(threshold)
+        results = self.process(
+            similarity_identifier, fingerprint=False, perceptual_hash=True
+        )
+        if self.output:
+            # Records are written once the groups are known
+            failed = [result for result in results if not result.success]
+            self.write_groups(
+                similarity_identifier.photos, similarity_identifier.groups
+            )
+            for result in failed:
+                self.output.write(result)
+            self.output.flush()
+        else:
+            self.summarise(results)
+        for group in similarity_identifier.groups:
+            logger.debug(f"Similar: {', '.join(str(p.metadata) for p in group)}")
+        logger.info(
+            f"Found [bold]{similarity_identifier.n_duplicates}[/] near-duplicate photo(s) in [bold]{len(similarity_identifier.groups)}[/] group(s) in the library"
+        )
+
+    def update_index(self, index: LibraryIndex) -> None:
+        """Add new or modified photos in the library to a fingerprint index.
+
+        Files whose size, mtime and inode are unchanged are not read again, and
+        entries for files that no longer exist are removed.
+        """
+        indexed = index.keys(self.base_path)
+        n_photos = Counter()
+
+        def changed_directories() -> Iterator[tuple[Path, list[FileEntry]]]:
+            for directory, entries in self.directories():
+                changed = []
+                for entry in entries:
+                    if indexed.pop(str(entry.path), None) == entry.key:
+                        n_photos["unchanged"] += 1
+                    else:
+                        changed.append(entry)
+                if changed:
+                    yield directory, changed
+
+        keys = DuplicateIdentifier()
+        checker = Checker(broken_only=False)
+        try:
+            for _, photos in self.walk_directories(changed_directories()):
+                for photo in photos:
+                    dates = [date for date in photo.metadata.dates.values() if date]
+                    date = photo.metadata.canonical_date or min(dates, default=None)
+                    index.store(
+                        photo.path,
+                        photo.entry.key,
+                        keys.header_key(photo),
+                        keys.partial_key(photo),
+                        photo.metadata.fingerprint_digest,
+                        date=date.isoformat() if date else None,
+                        camera=photo.metadata.camera,
+                        copyright=bool(photo.metadata.copyright),
+                        failed=checker.failed_checks(photo),
+                    )
+                    n_photos["indexed"] += 1
+                index.commit()
+            # Files that were not selected were not scanned, but may still exist
+            if not self.where:
+                index.remove(indexed)
+        finally:
+            index.commit()
+        logger.info(
+            f"Indexed [bold]{n_photos['indexed']}[/] new or modified photos in [cyan]{index.path}[/], [bold]{n_photos['unchanged']}[/] were unchanged and [bold]{len(indexed)}[/] removed"
+        )
+
+    def find_in_index(self, index: LibraryIndex) -> None:
+        """Look up every photo in the library in a fingerprint index.
+
+        Photos are first matched on their dimensions, encoded image size and the
+        hash of the start and end of their image data, so that only photos with a
+        likely copy in the index are decoded to compare fingerprints.
+        """
+        keys = DuplicateIdentifier()
+        n_photos = Counter()
+        for photo in self.walk(fingerprint=False):
+            header_key = keys.header_key(photo)
+            if header_key is None:
+                # Without a JPEG header only the fingerprints can be compared
+                fingerprint = keys.fingerprint_key(photo)
+                matches = index.lookup_fingerprint(fingerprint) if fingerprint else []
+            elif candidates := index.lookup(header_key, keys.partial_key(photo)):
+                fingerprint = keys.fingerprint_key(photo)
+                matches = [
+                    path
+                    for path, indexed in candidates
+                    if fingerprint and indexed == fingerprint
+                ]
+            else:
+                matches = []
+            n_photos["matched" if matches else "new"] += 1
+            if self.output:
+                self.output.write(
+                    ProcessingResult(True, "", photo.path, photo=photo),
+                    matches=matches,
+                )
+            elif matches:
+                logger.debug(
+                    f"[blue]{photo.path}[/] is already indexed as {', '.join(matches)}"
+                )
+            else:
+                logger.info(f"New photo: [cyan]{photo.path}[/]")
+        self.update_cache(keys.fingerprinted)
+        if self.output:
+            self.output.flush()
+        logger.info(
+            f"Found [bold]{n_photos['matched']}[/] photos already in [cyan]{index.path}[/] and [bold]{n_photos['new']}[/] new photos"
+        )
+
+    def update_cache(self, photos: Iterable[Photo]) -> None:
+        """Store metadata values that were computed after loading."""
+        if not self.cache:
+            return
+        for photo in photos:
+            if photo.entry:
+                self.cache.store(photo.entry.path, photo.metadata, photo.entry.key)
+        self.cache.commit()
+
+    def process(
+        self,
+        processor: Processor,
+        directories: Iterable[tuple[Path, list[FileEntry]]] | None = None,
+        **options: bool,
+    ) -> Generator[ProcessingResult, None, None]:
+        """Run a processor over every photo, flushing deferred work per directory.
+
+        With more than one job, processors that declare themselves thread-safe
+        are run concurrently; results are yielded in the same order either way.
+        """
+        stage = f"processor.{type(processor).__name__}"
+        if self.jobs > 1:
+            if processor.thread_safe:
+                yield from self.process_concurrently(processor, directories, **options)
+                return
+            logger.info(f"{type(processor).__name__} must process photos one at a time")
+        for _, photos in self.walk_directories(directories, **options):
+            processed = []
+            for photo in photos:
+                processed.append(photo)
+                with profiling.span(stage):
+                    result = processor(photo)
+                if result is not None:
+                    result.photo = result.photo or photo
+                    yield result
+            with profiling.span(f"{stage}.flush"):
+                results = list(processor.flush())
+            yield from attach_photos(results, processed)
+
+    def process_concurrently(
+        self,
+        processor: Processor,
+        directories: Iterable[tuple[Path, list[FileEntry]]] | None = None,
+        **options: bool,
+    ) -> Generator[ProcessingResult, None, None]:
+        """Run a thread-safe processor on a pool, yielding results in order.
+
+        Photos are submitted as they are loaded, but only until a fixed number
+        are in flight, and the processor is flushed once all photos in a
+        directory are done, without waiting before starting the next directory.
+        """
+        if self.pool is Pool.PROCESS and processor.defers_work:
+            raise ValueError(
+                f"{type(processor).__name__} finishes its work when flushed, so cannot run on a process pool"
+            )
+        stage = f"processor.{type(processor).__name__}"
+        profiled = self.pool is Pool.PROCESS and profiling.is_enabled()
+        # Submitted photos in order, with a directory marking where to flush
+        pending: deque[tuple[Photo, Future] | Path] = deque()
+        processed: dict[Path, list[Photo]] = defaultdict(list)
+        limit = self.jobs * self.PENDING_PER_JOB
+
+        def finish(item: tuple[Photo, Future] | Path) -> list[ProcessingResult]:
+            if isinstance(item, Path):
+                with profiling.span(f"{stage}.flush"):
+                    results = list(processor.flush())
+                return attach_photos(results, processed.pop(item, []))
+            photo, future = item
+            result = future.result()
+            if profiled:
+                result, stages = result
+                profiling.merge(stages)
+            if result is None:
+                return []
+            result.photo = result.photo or photo
+            return [result]
+
+        executor = self.pool.create(self.jobs)
+        try:
+            for directory, photos in self.walk_directories(directories, **options):
+                for photo in photos:
+                    while len(pending) >= limit:
+                        yield from finish(pending.popleft())
+                    if profiled:
+                        future = executor.submit(
+                            profiling.profiled, run_processor, processor, photo, stage
+                        )
+                    else:
+                        future = executor.submit(run_processor, processor, photo, stage)
+                    pending.append((photo, future))
+                    processed[directory].append(photo)
+                pending.append(directory)
+            while pending:
+                yield from finish(pending.popleft())
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    def process_changed(
+        self, processor: Processor, journal: CheckJournal, mode: str, **options: bool
+    ) -> Generator[ProcessingResult, None, None]:
+        """Run a processor over new or modified photos, reusing journaled results.
+
+        Results are reused for files whose size, mtime and inode are unchanged and
+        that were processed in the same `mode`, and are yielded in walk order
+        between the new results. Journal entries for files that no longer exist
+        are removed once the whole library has been processed.
+        """
+        journaled = journal.results(self.base_path)
+        keys: dict[Path, tuple[int, int, int]] = {}
+        directory_of: dict[Path, Path] = {}
+        # Reused results and changed files, in walk order
+        slots: deque[ProcessingResult | Path] = deque()
+        done: dict[Path, ProcessingResult] = {}
+        n_unchanged = 0
+
+        def changed_directories() -> Iterator[tuple[Path, list[FileEntry]]]:
+            nonlocal n_unchanged
+            for directory, entries in self.directories():
+                changed = []
+                for entry in entries:
+                    record = journaled.pop(str(entry.path), None)
+                    if record and record[0] == entry.key and record[1] == mode:
+                        n_unchanged += 1
+                        slots.append(
+                            ProcessingResult(
+                                record[2], record[3], entry.path, record[4]
+                            )
+                        )
+                    else:
+                        keys[entry.path] = entry.key
+                        directory_of[entry.path] = directory
+                        slots.append(entry.path)
+                        changed.append(entry)
+                if changed:
+                    yield directory, changed
+
+        def in_walk_order(path: Path | None) -> Iterator[ProcessingResult]:
+            """Yield results in walk order up to the first file still being processed.
+
+            Changed files before `path` in earlier directories are done, so are
+            skipped if the processor had no result for them, as are any left once
+            `path` is None.
+            """
+            passed = False
+            while slots:
+                slot = slots[0]
+                if isinstance(slot, ProcessingResult):
+                    yield slots.popleft()
+                elif slot in done:
+                    slots.popleft()
+                    passed = passed or slot == path
+                    yield done.pop(slot)
+                elif path and (passed or directory_of[slot] == directory_of[path]):
+                    return
+                else:
+                    slots.popleft()
+
+        try:
+            for result in self.process(processor, changed_directories(), **options):
+                if result.path not in keys:
+                    yield result
+                    continue
+                journal.store(
+                    result.path,
+                    keys.pop(result.path),
+                    mode,
+                    result.success,
+                    result.message,
+                    result.failed,
+                )
+                done[result.path] = result
+                yield from in_walk_order(result.path)
+            # Files in other shards or not selected were not scanned, but may
+            # still exist
+            if not self.where:
+                journal.remove(path for path in journaled if self.in_shard(path))
+        finally:
+            journal.commit()
+        logger.info(
+            f"Reusing results for [bold]{n_unchanged}[/] unchanged photos from [cyan]{journal.path}[/]"
+        )
+        yield from in_walk_order(None)
+
+    def write_groups(
+        self,
+        photos: Iterable[Photo],
+        groups: list[list[Photo]],
+        fields: dict[int, dict[str, Any]] | None = None,
+    ) -> None:
+        """Write a record for each photo with the index of its group, if any.
+
+        `fields` maps the id() of a photo to extra fields for its record.
+        """
+        if not self.output:
+            return
+        group_index = {
+            id(photo): idx for idx, group in enumerate(groups) for photo in group
+        }
+        for photo in photos:
+            self.output.write(
+                ProcessingResult(True, "", photo.path, photo=photo),
+                group_index.get(id(photo)),
+                **(fields or {}).get(id(photo), {}),
+            )
+        self.output.flush()
+
+    def summarise(self, results: Iterable[ProcessingResult]) -> None:
+        """Summarise the result of a photo processing operation."""
+        if self.output:
+            for result in results:
+                self.output.write(result)
+            self.output.flush()
+            return
+        log_results(results)
+
+    def directories(self) -> Generator[tuple[Path, list[FileEntry]], None, None]:
+        """Generator that yields each directory in sorted order with its photo files."""
+        scanner = Scanner(
+            self.settings.extensions,
+            follow_symlinks=self.settings.follow_symlinks,
+            include_hidden=self.settings.include_hidden,
         )
+        scanned = self.select() if self.where else scanner.scan(self.base_path)
+        while True:
+            with profiling.span("library.scan"):
+                directory = next(scanned, None)
+            if directory is None:
+                return
+            if self.shard:
+                path, entries = directory
+                entries = [entry for entry in entries if self.in_shard(entry.path)]
+                if not entries:
+                    continue
+                directory = (path, entries)
+            yield directory
+
+    def select(self) -> Iterator[tuple[Path, list[FileEntry]]]:
+        """Generator that yields each directory with the photos selected from the index.
+
+        Only the files matching the filter are opened, so photos added since the
+        library was last indexed are not found.
+        """
+        paths = self.index.select(self.base_path, self.where)
         logger.info(
-            f"Processed [bold]{n_photos['processed']}[/] photos of which [bold]{n_photos['failed']}[/] ({percentage:.2f}%) failed validation"
+            f"Selected [bold]{len(paths)}[/] photos matching [bold]{self.where}[/] in [cyan]{self.index.path}[/]"
         )
+        for directory, group in groupby(paths, key=os.path.dirname):
+            entries = []
+            for path in group:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    logger.debug(f"Skipping {path}, which no longer exists")
+                    continue
+                entries.append(
+                    FileEntry(Path(path), stat.st_size, stat.st_mtime_ns, stat.st_ino)
+                )
+            if entries:
+                yield Path(directory), entries
+
+    def in_shard(self, file_path: str | Path) -> bool:
+        """Whether a file in the library is processed by this run"""
+        if not self.shard:
+            return True
+        relative = Path(file_path).relative_to(self.base_path)
+        return self.shard.includes(PurePosixPath(relative.as_posix()))
+
+    def load(
+        self,
+        directories: Iterable[tuple[Path, list[FileEntry]]],
+        executor: Executor | None = None,
+        **options: bool,
+    ) -> Generator[tuple[Path, Iterator[Photo]], None, None]:
+        """Generator that yields each directory with its loaded photos.
+
+        When an executor is provided, parsing for the next directory is submitted
+        before the current one is yielded, so that workers stay busy while the
+        results are consumed in order. Any options are passed to Metadata.
+        """
+        if not executor:
+            for directory, entries in directories:
+                yield (
+                    directory,
+                    (self.load_photo(entry, **options) for entry in entries),
+                )
+            return
+        pending = None
+        for directory, entries in directories:
+            submitted = [
+                self.submit_photo(executor, entry, **options) for entry in entries
+            ]
+            if pending:
+                yield pending[0], map(self.resolve_photo, pending[1])
+            pending = (directory, submitted)
+        if pending:
+            yield pending[0], map(self.resolve_photo, pending[1])
 
-    def walk(self) -> Generator[Photo, None, None]:
-        """Generator that yields all photos in the library."""
-        current_dir = None
-        for photo in self.photos:
-            if photo.directory != current_dir:
-                current_dir = photo.directory
-                logger.info(f"Working on directory [cyan]{current_dir}[/]")
-            yield photo
+    def load_photo(self, entry: FileEntry, **options: bool) -> Photo:
+        """Load a single photo, using the cache if available."""
+        if self.cache:
+            return Photo(self.cache.load(entry.path, entry.key, **options), entry)
+        return Photo(Metadata(entry.path, **options), entry)
+
+    def submit_photo(
+        self, executor: Executor, entry: FileEntry, **options: bool
+    ) -> Photo | tuple[Future, FileEntry]:
+        """Return a cached photo or submit a job to parse its metadata."""
+        if self.cache and (
+            metadata := self.cache.get(entry.path, entry.key, **options)
+        ):
+            return Photo(metadata, entry)
+        if profiling.is_enabled():
+            # Spans recorded in the worker are returned alongside the metadata
+            return (
+                executor.submit(profiling.profiled, Metadata, entry.path, **options),
+                entry,
+            )
+        return (executor.submit(Metadata, entry.path, **options), entry)
+
+    def resolve_photo(self, submitted: Photo | tuple[Future, FileEntry]) -> Photo:
+        """Wait for a submitted job and store its result in the cache."""
+        if isinstance(submitted, Photo):
+            return submitted
+        future, entry = submitted
+        metadata = future.result()
+        if profiling.is_enabled():
+            metadata, stages = metadata
+            profiling.merge(stages)
+        if self.cache:
+            self.cache.store(entry.path, metadata, entry.key)
+        return Photo(metadata, entry)
+
+    def walk(self, **options: bool) -> Generator[Photo, None, None]:
+        """Generator that loads and yields photos one directory at a time."""
+        for _, photos in self.walk_directories(**options):
+            yield from photos
+
+    def walk_directories(
+        self,
+        directories: Iterable[tuple[Path, list[FileEntry]]] | None = None,
+        **options: bool,
+    ) -> Generator[tuple[Path, Iterator[Photo]], None, None]:
+        """Generator that yields each directory with its photos as they are loaded.
+
+        Photos are found by scanning the library unless `directories` are given.
+        Any options (such as `fingerprint=False`) are passed to Metadata to control
+        which values are computed up front rather than on first access.
+        """
+        n_photos = Counter()
+
+        def counted_directories() -> Iterator[tuple[Path, list[FileEntry]]]:
+            if directories is None:
+                scanned = self.directories()
+            else:
+                scanned = directories
+            for directory, entries in scanned:
+                n_photos[directory] = len(entries)
+                yield directory, entries
+
+        executor = ProcessPoolExecutor(self.workers) if self.workers > 1 else None
+        try:
+            for directory, photos in self.load(
+                counted_directories(), executor, **options
+            ):
+                logger.info(f"Working on directory [cyan]{directory}[/]")
+                yield directory, photos
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
+            if self.cache:
+                self.cache.commit()
+        logger.info(
+            f"Loaded metadata for [bold]{n_photos.total()}[/] photos in [bold]{len(n_photos)}[/] directories under [cyan]{self.base_path}[/]"
+        )
@@ -1,10 +1,13 @@
 """Class for holding photo metadata"""
 
+import io
 import logging
+import os
 import re
 from hashlib import sha256
+from collections.abc import Callable, Iterable
 from itertools import groupby
-from typing import cast
+from typing import Any, BinaryIO, TypeVar, cast
 from pathlib import Path
 from PIL import Image
 
@@ -15,6 +18,11 @@ from exifread.tags.fields import FieldType
 from struct import error as StructError
 from iptcinfo3 import IPTCInfo
 from pendulum.parsing.exceptions import ParserError
+from photometadata.exif import EXIF_SIGNATURE
+from photometadata.iptc import IptcError, read_keywords
+from photometadata.jpeg import JpegError, read_metadata
+from photometadata.perceptual import dhash
+from photometadata.profiling import span
 
 # Suppress 'Possibly corrupted field' messages from exifread
 logging.getLogger("exifread").setLevel(logging.CRITICAL)
@@ -24,56 +32,209 @@ logging.getLogger("iptcinfo").setLevel(logging.CRITICAL)
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# Timestamps embedded in filenames, such as IMG_20190501_120000.jpg
+FILENAME_DATE_REGEX = re.compile(r".*([12][0-9]{3}[01][0-9][0-3][0-9][-_T][0-9]{6}).*")
+# Fixed-width formats used by EXIF ("YYYY:MM:DD HH:MM:SS") and by filenames
+EXIF_DATE_REGEX = re.compile(r"(\d{4}):(\d{2}):(\d{2}) (\d{2}):(\d{2}):(\d{2})")
+COMPACT_DATE_REGEX = re.compile(r"(\d{4})(\d{2})(\d{2})[-_T](\d{2})(\d{2})(\d{2})")
+
+# Tags read by the processors, which are the only ones kept after parsing. Other
+# tags (for example those named in copyright rules) are reloaded when requested.
+KEPT_TAGS = (
+    "Image Make",
+    "Image Model",
+    "Image DateTime",
+    "Image Copyright",
+    "Image DocumentName",
+    "EXIF DateTimeOriginal",
+    "EXIF DateTimeDigitized",
+    "EXIF UserComment",
+)
+# Stored in place of a fingerprint or perceptual hash for broken images
+NOT_AVAILABLE = "NotAvailable"
+
 
 class Metadata:
-    """Class for holding photo metadata"""
+    """Class for holding photo metadata
+
+    Only the tags in KEPT_TAGS are kept in memory, and the fingerprint is stored
+    as a raw digest, so that metadata for large libraries stays compact.
+    """
 
     IGNORED_FIELD_TYPES = [
         FieldType.PROPRIETARY,
         FieldType.UNDEFINED,
     ]
 
-    def __init__(self, file_path: str | Path) -> None:
-        """Constructor"""
-        self.path = Path(file_path).resolve()
+    __slots__ = (
+        "_path",
+        "tags",
+        "keywords",
+        "width",
+        "height",
+        "payload_size",
+        "_fingerprint",
+        "_perceptual_hash",
+        "_derived",
+    )
+
+    def __init__(
+        self,
+        file_path: str | Path,
+        *,
+        fingerprint: bool = True,
+        perceptual_hash: bool = False,
+    ) -> None:
+        """Constructor
+
+        Unless `fingerprint` or `perceptual_hash` are set, the image data is only
+        decoded when the corresponding property is first accessed.
+        """
+        self._path = str(Path(file_path).resolve())
+        self.height: int | None = None
+        self.width: int | None = None
+        # Size of the encoded image data of a JPEG, as used to find duplicates
+        self.payload_size: int | None = None
+        # An empty digest or negative hash marks a broken image
+        self._fingerprint: bytes | None = None
+        self._perceptual_hash: int | None = None
+        self._derived: dict[str, Any] = {}
         try:
-            with open(self.path, "rb") as binary:
+            with open(self._path, "rb") as binary:
                 try:
-                    self.tags: dict[str, IfdTag] = exifread.process_file(binary)
-                except StructError:
-                    self.tags = {}
-                    self.fingerprint = "NotAvailable"
-                self.keywords = [
-                    kwd.decode()
-                    for kwd in cast(
-                        list[bytes], IPTCInfo(binary, force=True)["keywords"]
-                    )
-                ]
-            try:
-                with Image.open(self.path) as im:
-                    self.histogram = im.histogram()
-                    self.height = im.height
-                    self.width = im.width
-                self.fingerprint = sha256(
-                    str([self.width, self.height] + self.histogram).encode("utf-8")
-                ).hexdigest()
-            # Broken image file
-            except OSError:
-                self.fingerprint = "NotAvailable"
+                    self.read_header(binary)
+                # Fall back to parsing the whole file if it is not a valid JPEG
+                except JpegError:
+                    binary.seek(0)
+                    self.read_file(binary)
+            if fingerprint and self._fingerprint is None:
+                self._fingerprint = self.compute_fingerprint()
+            if perceptual_hash:
+                self._perceptual_hash = self.compute_perceptual_hash()
         except Exception as exc:
             print(type(exc), exc)
             raise
 
+    def read_header(self, binary: BinaryIO) -> None:
+        """Read tags, keywords and dimensions from the header segments of a JPEG"""
+        with span("metadata.header") as header_span:
+            header = read_metadata(binary)
+            header_span.bytes = binary.tell()
+        self.width, self.height = header.width, header.height
+        self.payload_size = header.payload_size(os.fstat(binary.fileno()).st_size)
+        self.tags = {}
+        if header.exif:
+            try:
+                with span("metadata.exifread"):
+                    self.tags = self.printable_tags(
+                        exifread.process_file(
+                            io.BytesIO(header.exif[len(EXIF_SIGNATURE) :]),
+                            details=False,
+                        ),
+                        KEPT_TAGS,
+                    )
+            except StructError:
+                pass
+        self.keywords = []
+        if header.iptc:
+            try:
+                with span("metadata.iptc"):
+                    self.keywords = read_keywords(header.iptc)
+            except IptcError:
+                pass
+
+    def read_file(self, binary: BinaryIO) -> None:
+        """Read tags, keywords and dimensions from any image file"""
+        try:
+            with span("metadata.exifread"):
+                self.tags = self.printable_tags(
+                    exifread.process_file(binary, details=False), KEPT_TAGS
+                )
+        except StructError:
+            self.tags = {}
+        with span("metadata.iptcinfo"):
+            self.keywords = [
+                kwd.decode()
+                for kwd in cast(list[bytes], IPTCInfo(binary, force=True)["keywords"])
+            ]
+        try:
+            with span("metadata.pil_open"), Image.open(self._path) as im:
+                self.height = im.height
+                self.width = im.width
+        # Broken image file
+        except OSError:
+            self._fingerprint = b""
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "Metadata":
+        """Restore metadata previously serialised with to_dict"""
+        metadata = cls.__new__(cls)
+        metadata._path = data["path"]
+        metadata.tags = {
+            name: data["tags"][name] for name in KEPT_TAGS if name in data["tags"]
+        }
+        metadata.keywords = data["keywords"]
+        metadata.width = data["width"]
+        metadata.height = data["height"]
+        metadata.payload_size = data.get("payload_size")
+        fingerprint = data["fingerprint"]
+        metadata._fingerprint = (
+            None
+            if fingerprint is None
+            else b""
+            if fingerprint == NOT_AVAILABLE
+            else bytes.fromhex(fingerprint)
+        )
+        perceptual_hash = data["perceptual_hash"]
+        metadata._perceptual_hash = (
+            None
+            if perceptual_hash is None
+            else -1
+            if perceptual_hash == NOT_AVAILABLE
+            else int(perceptual_hash)
+        )
+        metadata._derived = {}
+        return metadata
+
+    def to_dict(self) -> dict[str, Any]:
+        """Serialise the parsed metadata into JSON-compatible types"""
+        return {
+            "path": self._path,
+            "tags": {
+                name: value for name, value in self.tags.items() if value is not None
+            },
+            "keywords": self.keywords,
+            "width": self.width,
+            "height": self.height,
+            "payload_size": self.payload_size,
+            "fingerprint": None if self._fingerprint is None else self.fingerprint,
+            "perceptual_hash": None
+            if self._perceptual_hash is None
+            else str(self._perceptual_hash)
+            if self._perceptual_hash >= 0
+            else NOT_AVAILABLE,
+        }
+
     def __repr__(self) -> str:
         """String representation"""
-        return f"{self.path}"
+        return self._path
+
+    @property
+    def path(self) -> Path:
+        """Return the resolved path of the file"""
+        return Path(self._path)
+
+    @property
+    def camera(self) -> str:
+        """Return the camera make and model, without repeated words"""
+        return self._memoised("camera", self._camera)
 
     @property
     def canonical_date(self) -> pendulum.DateTime | None:
         """Return a date if there is one, unambiguous one"""
-        if self.all_dates_equal():
-            return [d for d in self.dates.values() if d][0]
-        return None
+        return self._memoised("canonical_date", self._canonical_date)
 
     @property
     def comment(self) -> str | None:
@@ -88,6 +249,9 @@ class Metadata:
     @property
     def dates(self) -> dict[str, pendulum.DateTime | None]:
         """Get all available dates for this file"""
+        return self._memoised("dates", self._dates)
+
+    def _dates(self) -> dict[str, pendulum.DateTime | None]:
         return {
             "Filename": self.extract_date_from_filename(),
             "Exif.Image.DateTime": self.parse_date(self.read_tag("Image DateTime")),
@@ -102,13 +266,43 @@ class Metadata:
     @property
     def filename(self) -> str:
         """Return the filename for the file in question"""
-        return self.path.name
+        return os.path.basename(self._path)
 
     @property
     def filepath(self) -> Path:
         """Return the path for the file in question"""
         return self.path
 
+    @property
+    def fingerprint(self) -> str:
+        """Return a hash of the decoded image, computing it on first access"""
+        digest = self.fingerprint_digest
+        return digest.hex() if digest else NOT_AVAILABLE
+
+    @property
+    def fingerprint_digest(self) -> bytes | None:
+        """Return the raw fingerprint, or None if the image is broken"""
+        if self._fingerprint is None:
+            self._fingerprint = self.compute_fingerprint()
+        return self._fingerprint or None
+
+    @property
+    def has_fingerprint(self) -> bool:
+        """Whether the fingerprint has already been computed"""
+        return self._fingerprint is not None
+
+    @property
+    def perceptual_hash(self) -> int | None:
+        """Return the difference hash of the image, computing it on first access"""
+        if self._perceptual_hash is None:
+            self._perceptual_hash = self.compute_perceptual_hash()
+        return None if self._perceptual_hash < 0 else self._perceptual_hash
+
+    @property
+    def has_perceptual_hash(self) -> bool:
+        """Whether the perceptual hash has already been computed"""
+        return self._perceptual_hash is not None
+
     @property
     def name(self) -> str | None:
         """Return the value of the document name tag"""
@@ -120,6 +314,16 @@ class Metadata:
         if not date:
             return None
 
+        # Parse the common fixed-width formats directly, as pendulum.parse is slow
+        if match := EXIF_DATE_REGEX.fullmatch(date) or COMPACT_DATE_REGEX.fullmatch(
+            date
+        ):
+            try:
+                return pendulum.DateTime(*map(int, match.groups()), tzinfo=pendulum.UTC)
+            except ValueError:
+                logger.warning(f"String '{date}' could not be parsed as a DateTime!")
+                return None
+
         try:
             parsed_date = pendulum.parse(date)
         except (ParserError, TypeError, ValueError):
@@ -133,35 +337,125 @@ class Metadata:
             return None
         return parsed_date
 
+    @classmethod
+    def printable_tags(
+        cls, tags: dict[str, Any], names: Iterable[str]
+    ) -> dict[str, str]:
+        """Convert the named exifread tags into their printable values"""
+        return {
+            name: tag.printable.strip()
+            for name in names
+            if isinstance(tag := tags.get(name), IfdTag)
+            and tag.field_type not in cls.IGNORED_FIELD_TYPES
+        }
+
     def all_dates_equal(self) -> bool:
         """Check whether all dates are equal"""
+        return self._memoised("all_dates_equal", self._all_dates_equal)
+
+    def _all_dates_equal(self) -> bool:
         dates = [d for d in self.dates.values() if d]
         if not dates:
             return False
         return dates.count(dates[0]) == len(dates)
 
+    def fingerprint_image(self, image: Image.Image) -> bytes | None:
+        """Return the fingerprint, computing it from an image that is already open"""
+        if self._fingerprint is None:
+            self._fingerprint = self.compute_fingerprint(image)
+        return self._fingerprint or None
+
+    def compute_fingerprint(self, image: Image.Image | None = None) -> bytes:
+        """Hash the dimensions and histogram of the decoded image"""
+        try:
+            with span("metadata.decode"):
+                if image is None:
+                    with Image.open(self._path) as im:
+                        histogram = im.histogram()
+                else:
+                    histogram = image.histogram()
+            with span("metadata.sha256"):
+                return sha256(
+                    str([self.width, self.height] + histogram).encode("utf-8")
+                ).digest()
+        # Broken image file
+        except OSError:
+            return b""
+
+    def compute_perceptual_hash(self) -> int:
+        """Compute the difference hash of the image, or -1 if it is broken"""
+        with span("metadata.perceptual_hash"):
+            value = dhash(self._path)
+        return -1 if value is None else value
+
     def extract_date_from_filename(self) -> pendulum.DateTime | None:
         """Extract a date from a filename"""
-        timestamp_regex = re.compile(
-            r".*([12][0-9]{3}[01][0-9][0-3][0-9][-_T][0-9]{6}).*"
-        )
-        if match := timestamp_regex.match(self.path.name):
-            return self.parse_date(match.group(1))
+        return self._memoised("filename_date", self._extract_date_from_filename)
+
+    def _extract_date_from_filename(self) -> pendulum.DateTime | None:
+        return self.date_from_filename(self.filename)
+
+    @classmethod
+    def date_from_filename(cls, filename: str) -> pendulum.DateTime | None:
+        """Parse the date embedded in a filename such as IMG_20200101_120000.jpg"""
+        if match := FILENAME_DATE_REGEX.match(filename):
+            return cls.parse_date(match.group(1))
         return None
 
+    def invalidate(self) -> None:
+        """Discard derived fields, which must be done after changing tags or path"""
+        self._derived.clear()
+
+    def rename(self, file_path: str | Path) -> None:
+        """Point this metadata at the new location of a renamed file"""
+        self._path = str(Path(file_path).resolve())
+        self.invalidate()
+
     def read_tag(self, name: str) -> str | None:
         """Return the value of a given tag"""
         if name == "Camera":
-            raw_string = " ".join(
-                [
-                    t
-                    for t in [self.read_tag("Image Make"), self.read_tag("Image Model")]
-                    if t
-                ]
-            )
-            return " ".join([group[0] for group in groupby(raw_string.split(" "))])
-        if name in self.tags:
-            if self.tags[name].field_type in self.IGNORED_FIELD_TYPES:
-                return None
-            return self.tags[name].printable.strip()
+            return self.camera
+        if name not in self.tags and name not in KEPT_TAGS:
+            self.tags[name] = self.reload_tag(name)
+        return self.tags.get(name)
+
+    def reload_tag(self, name: str) -> str | None:
+        """Read a tag that was not kept after parsing from the file"""
+        try:
+            with open(self._path, "rb") as binary:
+                try:
+                    exif = read_metadata(binary).exif
+                    if not exif:
+                        return None
+                    tags = exifread.process_file(
+                        io.BytesIO(exif[len(EXIF_SIGNATURE) :]), details=False
+                    )
+                except JpegError:
+                    binary.seek(0)
+                    tags = exifread.process_file(binary, details=False)
+        except (OSError, StructError):
+            return None
+        return self.printable_tags(tags, [name]).get(name)
+
+    def _memoised(self, name: str, compute: Callable[[], T]) -> T:
+        """Return a derived field, computing it on first access"""
+        try:
+            return self._derived[name]
+        except KeyError:
+            value = self._derived[name] = compute()
+            return value
+
+    def _camera(self) -> str:
+        raw_string = " ".join(
+            [
+                t
+                for t in [self.read_tag("Image Make"), self.read_tag("Image Model")]
+                if t
+            ]
+        )
+        return " ".join([group[0] for group in groupby(raw_string.split(" "))])
+
+    def _canonical_date(self) -> pendulum.DateTime | None:
+        if self.all_dates_equal():
+            return [d for d in self.dates.values() if d][0]
         return None
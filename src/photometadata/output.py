@@ -0,0 +1,175 @@
+"""Structured per-photo result output for piping into other tools"""
+
+import csv
+import json
+import logging
+import sys
+from abc import ABC, abstractmethod
+from collections import Counter
+from collections.abc import Iterable
+from enum import Enum
+from typing import Any, TextIO
+
+from rich.text import Text
+
+from photometadata.processors import ProcessingResult
+
+logger = logging.getLogger(__name__)
+
+# Columns written in CSV mode, with one column per date source
+DATE_SOURCES = (
+    "Filename",
+    "Exif.Image.DateTime",
+    "Exif.Photo.DateTimeDigitized",
+    "Exif.Photo.DateTimeOriginal",
+)
+CSV_FIELDS = (
+    "path",
+    "success",
+    "failed_checks",
+    *DATE_SOURCES,
+    "fingerprint",
+    "duplicate_group",
+)
+
+
+class OutputFormat(str, Enum):
+    RICH = "rich"
+    JSONL = "jsonl"
+    CSV = "csv"
+
+    def create(self, stream: TextIO | None = None) -> "ResultWriter | None":
+        """Return a writer for structured formats, or None for Rich log output.
+
+        Structured formats also replace the Rich log handler with a plain one on
+        stderr that only shows warnings and errors, so that per-photo messages
+        are neither rendered nor mixed into the results.
+        """
+        if self is OutputFormat.RICH:
+            return None
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(PlainFormatter())
+        logging.basicConfig(level=logging.WARNING, handlers=[handler], force=True)
+        stream = stream or sys.stdout
+        return JsonlWriter(stream) if self is OutputFormat.JSONL else CsvWriter(stream)
+
+
+class PlainFormatter(logging.Formatter):
+    """Formatter that strips Rich markup from log messages"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = Text.from_markup(record.getMessage()).plain.strip()
+        return f"{record.levelname}: {message}"
+
+
+class ResultWriter(ABC):
+    """Buffered writer of one record per photo"""
+
+    def __init__(self, stream: TextIO, buffer_size: int = 1000) -> None:
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.buffer: list[dict[str, Any]] = []
+
+    def write(
+        self,
+        result: ProcessingResult,
+        duplicate_group: int | None = None,
+        **fields: Any,
+    ) -> None:
+        """Queue the record for a result, writing out the buffer when it is full.
+
+        Any extra fields are added to the record, but are not written as CSV.
+        """
+        self.add(record(result, duplicate_group) | fields)
+
+    def add(self, record: dict[str, Any]) -> None:
+        """Queue a record that has already been built, such as one read back"""
+        self.buffer.append(record)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write all queued records"""
+        if self.buffer:
+            self.write_records(self.buffer)
+            self.buffer = []
+        self.stream.flush()
+
+    @abstractmethod
+    def write_records(self, records: list[dict[str, Any]]) -> None:
+        pass
+
+
+class JsonlWriter(ResultWriter):
+    """Write each record as a JSON object on its own line"""
+
+    def write_records(self, records: list[dict[str, Any]]) -> None:
+        self.stream.write("".join(json.dumps(record) + "\n" for record in records))
+
+
+class CsvWriter(ResultWriter):
+    """Write records as CSV rows, with failed checks separated by semicolons"""
+
+    def __init__(self, stream: TextIO, buffer_size: int = 1000) -> None:
+        super().__init__(stream, buffer_size)
+        self.writer = csv.DictWriter(stream, CSV_FIELDS, extrasaction="ignore")
+        self.writer.writeheader()
+
+    def write_records(self, records: list[dict[str, Any]]) -> None:
+        self.writer.writerows(
+            record
+            | record["dates"]
+            | {"failed_checks": ";".join(record["failed_checks"])}
+            for record in records
+        )
+
+
+def record(
+    result: ProcessingResult, duplicate_group: int | None = None
+) -> dict[str, Any]:
+    """Return the structured record for a result.
+
+    Dates and fingerprints are only included when the photo is available and
+    has them already, so that writing records never decodes an image. Broken
+    images have no fingerprint.
+    """
+    dates: dict[str, str | None] = {}
+    fingerprint = None
+    if photo := result.photo:
+        dates = {
+            name: date.isoformat() if date else None
+            for name, date in photo.metadata.dates.items()
+        }
+        if photo.metadata.has_fingerprint and (
+            digest := photo.metadata.fingerprint_digest
+        ):
+            fingerprint = digest.hex()
+    path = result.path or (photo.path if photo else None)
+    return {
+        "path": str(path) if path else None,
+        "success": result.success,
+        "failed_checks": list(result.failed),
+        "dates": dates,
+        "fingerprint": fingerprint,
+        "duplicate_group": duplicate_group,
+    }
+
+
+def log_results(results: Iterable[ProcessingResult]) -> None:
+    """Log each result and a summary of how many photos failed"""
+    n_photos = Counter()
+    for result in results:
+        if result.success:
+            logger.debug(result.message)
+        else:
+            logger.error(result.message)
+            n_photos["failed"] += 1
+        n_photos["processed"] += 1
+    percentage = (
+        100.0 * n_photos["failed"] / n_photos["processed"]
+        if n_photos["processed"]
+        else 0
+    )
+    logger.info(
+        f"Processed [bold]{n_photos['processed']}[/] photos of which [bold]{n_photos['failed']}[/] ({percentage:.2f}%) failed validation"
+    )
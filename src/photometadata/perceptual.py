@@ -0,0 +1,35 @@
+"""Perceptual hashing for identifying visually similar photos"""
+
+from pathlib import Path
+from PIL import Image
+
+HASH_SIZE = 8
+
+
+def dhash(file_path: str | Path, hash_size: int = HASH_SIZE) -> int | None:
+    """Compute the difference hash of an image, returning None if it is broken.
+
+    The image is decoded at reduced resolution (using DCT scaling for JPEGs),
+    shrunk to (hash_size + 1) x hash_size greyscale pixels and each bit records
+    whether a pixel is brighter than its right-hand neighbour.
+    """
+    try:
+        with Image.open(file_path) as im:
+            im.draft("L", (hash_size * 8, hash_size * 8))
+            small = im.convert("L").resize(
+                (hash_size + 1, hash_size), Image.Resampling.BILINEAR
+            )
+    except OSError:
+        return None
+    pixels = small.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for column in range(offset, offset + hash_size):
+            value = (value << 1) | (pixels[column] > pixels[column + 1])
+    return value
+
+
+def hamming(left: int, right: int) -> int:
+    """Number of bits that differ between two hashes"""
+    return (left ^ right).bit_count()
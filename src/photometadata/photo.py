@@ -1,6 +1,7 @@
 import logging
 from pathlib import Path
 from photometadata.metadata import Metadata
+from photometadata.scanner import FileEntry
 # from photometadata.processors import ProcessingResult
 
 
@@ -8,9 +9,17 @@ logger = logging.getLogger(__name__)
 
 
 class Photo:
-    def __init__(self, path: Path) -> None:
-        self.metadata = Metadata(path)
+    __slots__ = ("metadata", "entry")
+
+    def __init__(self, metadata: Metadata, entry: FileEntry | None = None) -> None:
+        self.metadata = metadata
+        self.entry = entry
 
     @property
     def directory(self) -> Path:
         return self.metadata.filepath.parent
+
+    @property
+    def path(self) -> Path:
+        """Path the photo was found at while scanning, if known"""
+        return self.entry.path if self.entry else self.metadata.filepath
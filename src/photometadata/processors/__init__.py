@@ -1,13 +1,31 @@
 from .checker import Checker
 from .classifier import Classifier
 from .duplicate_identifier import DuplicateIdentifier
-from .metadata_fixer import MetadataFixer
-from .processor import ProcessingResult
+from .metadata_fixer import MetadataFixer, PlannedFix, read_plan, write_plan
+from .processor import ProcessingResult, Processor
+from .similarity_identifier import SimilarityIdentifier
+from .writer import (
+    Exiv2Writer,
+    MetadataUpdate,
+    MetadataWriter,
+    NativeWriter,
+    WriterBackend,
+)
 
 __all__ = [
     "Checker",
     "Classifier",
     "DuplicateIdentifier",
+    "Exiv2Writer",
     "MetadataFixer",
+    "MetadataUpdate",
+    "MetadataWriter",
+    "NativeWriter",
+    "PlannedFix",
     "ProcessingResult",
+    "Processor",
+    "SimilarityIdentifier",
+    "WriterBackend",
+    "read_plan",
+    "write_plan",
 ]
@@ -6,45 +6,36 @@ logger = logging.getLogger(__name__)
 
 
 class Checker(Processor):
-    def __init__(self, broken_only: bool) -> None:
+    thread_safe = True
+
+    def __init__(self, broken_only: bool, *, verify_images: bool = True) -> None:
         self.broken_only = broken_only
+        self.verify_images = verify_images
 
     def __call__(self, photo: Photo) -> ProcessingResult:
-        output = ProcessingResult(True, f"[blue]Validated {photo.metadata.path}[/]")
+        failed = self.failed_checks(photo)
         # Check for broken image
-        if photo.metadata.fingerprint == "NotAvailable":
+        if "broken_image" in failed:
             logger.error("  [red]\u2716[/] Image data is broken!")
-            output = ProcessingResult(
-                False, f"[red]Failed to validate {photo.metadata.path}[/]"
-            )
         if self.broken_only:
-            return output
+            return self.result(photo, failed)
         # Check for equal dates
-        if photo.metadata.all_dates_equal():
+        if "dates" in failed:
+            logger.error("  [red]\u2716[/] Not all dates are equal!")
+        else:
             logger.debug(
                 f"  [blue]\u2714[/] All dates are equal ({photo.metadata.canonical_date})"
             )
-        else:
-            logger.error("  [red]\u2716[/] Not all dates are equal!")
-            output = ProcessingResult(
-                False, f"[red]Failed to validate {photo.metadata.path}[/]"
-            )
         # Check for copyright
-        if photo.metadata.copyright:
+        if "copyright" in failed:
+            logger.info("  [red]\u2716[/] Copyright is missing!")
+        else:
             logger.debug(
                 f"  [blue]\u2714[/] Found copyright information ({photo.metadata.copyright})",
             )
-        else:
-            logger.info("  [red]\u2716[/] Copyright is missing!")
-            output = ProcessingResult(
-                False, f"[red]Failed to validate {photo.metadata.path}[/]"
-            )
         # Check for name or comment
-        if (not photo.metadata.name) and (not photo.metadata.comment):
+        if "name_or_comment" in failed:
             logger.info("  [red]\u2716[/] No comment or document name found!")
-            output = ProcessingResult(
-                False, f"[red]Failed to validate {photo.metadata.path}[/]"
-            )
         else:
             if photo.metadata.name:
                 logger.debug(
@@ -54,4 +45,33 @@ class Checker(Processor):
                 logger.debug(
                     f"  [blue]\u2714[/] Found comment information ({photo.metadata.comment})"
                 )
-        return output
+        return self.result(photo, failed)
+
+    def failed_checks(self, photo: Photo) -> list[str]:
+        """Return the names of the checks that a photo fails, without logging"""
+        failed = []
+        if self.verify_images and photo.metadata.fingerprint_digest is None:
+            failed.append("broken_image")
+        if self.broken_only:
+            return failed
+        if not photo.metadata.all_dates_equal():
+            failed.append("dates")
+        if not photo.metadata.copyright:
+            failed.append("copyright")
+        if (not photo.metadata.name) and (not photo.metadata.comment):
+            failed.append("name_or_comment")
+        return failed
+
+    def result(self, photo: Photo, failed: list[str]) -> ProcessingResult:
+        """Summarise the checks that failed for a photo"""
+        if failed:
+            return ProcessingResult(
+                False,
+                f"[red]Failed to validate {photo.metadata.path}[/]",
+                photo.path,
+                failed,
+                photo,
+            )
+        return ProcessingResult(
+            True, f"[blue]Validated {photo.metadata.path}[/]", photo.path, photo=photo
+        )
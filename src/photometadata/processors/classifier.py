@@ -1,11 +1,25 @@
 import logging
-from .processor import Processor, ProcessingResult
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from hashlib import sha256
+from .processor import ProcessingResult
+from .updater import MetadataUpdater
+from .writer import MetadataUpdate, WriterBackend
+from photometadata.cache import ClassificationCache
+from photometadata.exif import EXIF_SIGNATURE, ExifError, read_thumbnail
+from photometadata.jpeg import APP1, JpegError, iter_segments, read_header
 from photometadata.photo import Photo
+from photometadata.profiling import span
+from photometadata.ratelimit import TokenBucket, backoff
 from photometadata.settings import Settings
 from typing import cast
 
 from azure.cognitiveservices.vision.computervision import ComputerVisionClient
 from msrest.authentication import CognitiveServicesCredentials
+from msrest.exceptions import ClientRequestError
 from azure.cognitiveservices.vision.computervision.models import (
     ComputerVisionErrorResponseException,
     ImageTag,
@@ -17,62 +31,268 @@ from PIL import Image
 
 logger = logging.getLogger(__name__)
 
+# (name, confidence) pairs returned by Azure Computer Vision
+Tags = list[tuple[str, float]]
 
-class Classifier(Processor):
-    def __init__(self, settings: Settings) -> None:
+# Largest image file accepted by Azure Computer Vision
+MAX_UPLOAD_BYTES = 4 * 1024 * 1024
+
+
+class Classifier(MetadataUpdater):
+    """Tag photos using Azure Computer Vision.
+
+    With a `concurrency` above one, requests are sent from a thread pool and
+    their results are written in the order of the photos as they finish, or
+    when the directory is flushed. Requests from all threads share a single
+    client and are limited to the configured number of transactions per second.
+    """
+
+    # Requests waiting or in flight per thread, which bounds the image data held
+    # in memory while keeping every thread busy
+    PENDING_PER_THREAD = 4
+
+    def __init__(
+        self,
+        settings: Settings,
+        *,
+        batch: bool = False,
+        writer: WriterBackend = WriterBackend.EXIV2,
+        concurrency: int = 1,
+        cache: ClassificationCache | None = None,
+    ) -> None:
+        super().__init__(batch=batch, writer=writer)
         self.cv_client_: ComputerVisionClient | None = None
+        self.cv_client_lock = threading.Lock()
         self.settings = settings
-        self.resized_image_shape = (512, 512)
+        # Longest edge of uploaded images, and the smallest usable thumbnail
+        self.upload_size = 512
+        self.min_thumbnail_size = 256
         self.confidence_cutoff = 0.8
+        self.cache = cache
+        self.limiter = TokenBucket(settings.azure.transactions_per_second)
+        self.executor = (
+            ThreadPoolExecutor(max_workers=concurrency) if concurrency > 1 else None
+        )
+        self.max_pending = concurrency * self.PENDING_PER_THREAD
+        # Photos waiting for outstanding requests, which are shared between
+        # photos with the same content, or for earlier photos to finish
+        self.requests: deque[Callable[[], ProcessingResult | None]] = deque()
+        self.in_flight: dict[str, Future[Tags | None]] = {}
+        # Results of requests that finished before the directory was flushed
+        self.results: list[ProcessingResult] = []
+
+    @property
+    def defers_work(self) -> bool:
+        return self.batch or self.executor is not None
 
     @property
     def cv_client(self) -> ComputerVisionClient:
-        if not self.cv_client_:
-            self.cv_client_ = ComputerVisionClient(
-                self.settings.azure.endpoint,
-                CognitiveServicesCredentials(self.settings.azure.subscription_key),
-            )
+        with self.cv_client_lock:
+            if not self.cv_client_:
+                self.cv_client_ = ComputerVisionClient(
+                    self.settings.azure.endpoint,
+                    CognitiveServicesCredentials(self.settings.azure.subscription_key),
+                )
+                # Retries are handled in request_tags, which can also retry
+                # throttled requests and resend the image data
+                self.cv_client_.config.retry_policy.retries = 0
         return self.cv_client_
 
-    def __call__(self, photo: Photo) -> ProcessingResult:
+    @property
+    def api_version(self) -> str:
+        return self.cv_client.api_version
+
+    def __call__(self, photo: Photo) -> ProcessingResult | None:
         if photo.metadata.keywords:
-            return ProcessingResult(True, "Skipping as photo is already tagged.")
+            return self.in_order(
+                lambda: ProcessingResult(
+                    True,
+                    "Skipping as photo is already tagged.",
+                    photo.path,
+                    photo=photo,
+                )
+            )
+        try:
+            with open(photo.metadata.filepath, "rb") as binary:
+                image = binary.read()
+        except OSError as exc:
+            logger.debug(f"Could not read {photo.metadata.filepath}: {exc}")
+            return self.in_order(lambda: self.tag(photo, None))
+        content = self.content_key(image)
+        # Empty tag lists are cached too, so that such photos are not sent again
+        if (
+            self.cache
+            and (tags := self.cache.get(content, self.api_version)) is not None
+        ):
+            logger.debug("\u2714 using cached tags from Azure Computer Vision")
+            return self.in_order(lambda: self.tag(photo, tags))
+        if self.executor:
+            if content not in self.in_flight:
+                # Wait for the oldest requests before holding more images in memory
+                while len(self.requests) >= self.max_pending:
+                    self.finish_oldest()
+                self.in_flight[content] = self.executor.submit(
+                    self.classify, photo, image
+                )
+            future = self.in_flight[content]
+            self.requests.append(lambda: self.finish(photo, content, future.result()))
+            return None
+        return self.finish(photo, content, self.classify(photo, image))
+
+    def flush(self) -> list[ProcessingResult]:
+        """Wait for outstanding requests, then write their tags"""
+        while self.requests:
+            self.finish_oldest()
+        results = self.results
+        self.results = []
+        self.in_flight = {}
+        if self.cache:
+            self.cache.commit()
+        return results + super().flush()
 
-        # Get tags from Azure computer vision
+    def finish_oldest(self) -> None:
+        """Wait for the oldest outstanding request, then write its tags"""
+        if result := self.requests.popleft()():
+            self.results.append(result)
+
+    def in_order(
+        self, finish: Callable[[], ProcessingResult | None]
+    ) -> ProcessingResult | None:
+        """Finish a photo now, or after any outstanding requests to keep results in order"""
+        if not self.requests:
+            return finish()
+        self.requests.append(finish)
+        return None
+
+    @staticmethod
+    def content_key(image: bytes) -> str:
+        """Hash of the encoded image data, which does not change with its metadata"""
+        try:
+            header = read_header(io.BytesIO(image))
+        except JpegError:
+            return sha256(image).hexdigest()
+        return sha256(header.tables + image[header.scan_offset :]).hexdigest()
+
+    def classify(self, photo: Photo, image: bytes) -> Tags | None:
+        """Return all (name, confidence) tags for a photo, or None if the request failed"""
         logger.debug("\u2714 attempting to load tags from Azure Computer Vision")
-        img_bytes = open(photo.metadata.filepath, "rb")
         try:
-            cv_results = self.cv_client.tag_image_in_stream(img_bytes)
-        except ComputerVisionErrorResponseException:
-            img_bytes = io.BytesIO()
-            Image.open(photo.metadata.filepath).resize(self.resized_image_shape).save(
-                img_bytes, format="JPEG"
+            with span("classifier.downscale"):
+                upload = self.downscale(image)
+            cv_results = self.request_tags(upload)
+        except (
+            ComputerVisionErrorResponseException,
+            ClientRequestError,
+            OSError,
+        ) as exc:
+            logger.debug(f"Request for {photo.metadata.filepath} failed: {exc}")
+            return None
+        if not isinstance(cv_results, TagResult):
+            return None
+        return [
+            (tag.name, tag.confidence)
+            for tag in cast(list[ImageTag], cv_results.tags or [])
+        ]
+
+    def downscale(self, image: bytes) -> bytes:
+        """Return a version of an image no larger than the upload size.
+
+        The embedded EXIF thumbnail is used if it is large enough. Otherwise the
+        image is decoded at a reduced scale, which is much faster than decoding
+        it at full resolution. Images that are already small are sent as-is.
+        """
+        with Image.open(io.BytesIO(image)) as im:
+            if max(im.size) <= self.upload_size and len(image) <= MAX_UPLOAD_BYTES:
+                return image
+            if thumbnail := self.embedded_thumbnail(image):
+                return thumbnail
+            im.draft("RGB", (self.upload_size, self.upload_size))
+            im.thumbnail((self.upload_size, self.upload_size))
+            resized = io.BytesIO()
+            im.convert("RGB").save(resized, format="JPEG", quality=90)
+        return resized.getvalue()
+
+    def embedded_thumbnail(self, image: bytes) -> bytes | None:
+        """Return the EXIF thumbnail of an image if it is large enough to upload"""
+        try:
+            for marker, _, data in iter_segments(io.BytesIO(image)):
+                if data and marker == APP1 and data.startswith(EXIF_SIGNATURE):
+                    thumbnail = read_thumbnail(data)
+                    break
+            else:
+                return None
+            if thumbnail is None:
+                return None
+            with Image.open(io.BytesIO(thumbnail)) as im:
+                size = max(im.size)
+        except (ExifError, JpegError, OSError):
+            return None
+        if self.min_thumbnail_size <= size <= self.upload_size:
+            return thumbnail
+        return None
+
+    def finish(
+        self, photo: Photo, content: str, tags: Tags | None
+    ) -> ProcessingResult | None:
+        """Store the result of a request, then write its tags to the photo"""
+        if tags is not None and self.cache:
+            self.cache.store(content, self.api_version, tags)
+        return self.tag(photo, tags)
+
+    def request_tags(self, image: bytes) -> TagResult:
+        """Send an image to Azure, retrying throttled and failed requests"""
+        attempt = 0
+        while True:
+            with span("azure.rate_limit"):
+                self.limiter.acquire()
+            try:
+                with span("azure.request") as request_span:
+                    request_span.bytes = len(image)
+                    return self.cv_client.tag_image_in_stream(io.BytesIO(image))
+            except ComputerVisionErrorResponseException as exc:
+                status = exc.response.status_code
+                if attempt >= self.settings.azure.max_retries or not (
+                    status == 429 or status >= 500
+                ):
+                    raise
+                retry_after = exc.response.headers.get("Retry-After", "")
+                delay = (
+                    float(retry_after) if retry_after.isdigit() else backoff(attempt)
+                )
+            except ClientRequestError:
+                if attempt >= self.settings.azure.max_retries:
+                    raise
+                delay = backoff(attempt)
+            attempt += 1
+            logger.debug(f"Retrying Azure request in {delay:.2f}s (attempt {attempt})")
+            time.sleep(delay)
+
+    def select(self, tags: Tags) -> list[str]:
+        """Return the most confident tag and any others above the cutoff"""
+        tags_all = sorted(tags, key=lambda tag: tag[1], reverse=True)
+        return [tags_all[0][0]] + [
+            name
+            for name, confidence in tags_all[1:]
+            if confidence > self.confidence_cutoff
+        ]
+
+    def tag(self, photo: Photo, tags: Tags | None) -> ProcessingResult | None:
+        """Write the selected tags to a photo"""
+        if tags is None:
+            # Return an error if tags could not be retrieved
+            logger.error(
+                "  [red]\u2716[/] Failed to get tags from Azure Computer Vision"
             )
-            img_bytes.seek(0)
-            cv_results = self.cv_client.tag_image_in_stream(img_bytes)
-
-        # Add all tags with a high enough confidence score
-        if isinstance(cv_results, TagResult):
-            tags_all = sorted(
-                cast(list[ImageTag], cv_results.tags),
-                key=lambda tag: tag.confidence,
-                reverse=True,
+            return ProcessingResult(
+                False, "[red]Failed to classify[/]", photo.path, photo=photo
             )
-            tags_selected = [tags_all[0].name] + [
-                tag.name
-                for tag in tags_all[1:]
-                if tag.confidence > self.confidence_cutoff
-            ]
-
-            # Update the metadata
-            logger.debug(f"Found <b>{len(tags_selected)}</b> classes: {tags_selected}")
-            return self.run_exiv_cmds(
-                [
-                    f'exiv2 -q -M "add Iptc.Application2.Keywords String {tag_name}" "{photo.metadata.filepath}"'
-                    for tag_name in tags_selected
-                ]
+        if not tags:
+            logger.warning("  Azure Computer Vision found no tags")
+            return ProcessingResult(
+                True, "[yellow]No tags found[/]", photo.path, photo=photo
             )
 
-        # Return an error if tags could not be retrieved
-        logger.error("  [red]\u2716[/] Failed to get tags from Azure Computer Vision")
-        return ProcessingResult(False, "[red]Failed to classify[/]")
+        # Update the metadata
+        selected = self.select(tags)
+        logger.debug(f"Found <b>{len(selected)}</b> classes: {selected}")
+        return self.update(MetadataUpdate(photo.metadata.filepath, keywords=selected))
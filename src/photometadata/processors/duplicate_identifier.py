@@ -1,28 +1,137 @@
 import logging
+import os
+from collections import defaultdict
+from collections.abc import Callable, Hashable
+from functools import partial
+from hashlib import sha256
 from .processor import Processor, ProcessingResult
+from photometadata.jpeg import JpegError, read_header
 from photometadata.photo import Photo
-import operator
-from functools import reduce
+from photometadata.profiling import span
+from PIL import Image
 
 
 logger = logging.getLogger(__name__)
 
 
 class DuplicateIdentifier(Processor):
+    """Identify duplicated photos using progressively more expensive comparisons.
+
+    Photos are first bucketed by image dimensions and the size of their encoded
+    image data, both read from the JPEG header. Only photos that share a bucket
+    are compared using a hash of the start and end of their image data, then by
+    their (decoded) fingerprint and finally pixel by pixel. Images decoded for
+    their fingerprint are hashed pixel by pixel at the same time, so that no
+    image is decoded twice.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
     def __init__(self) -> None:
-        self.duplicates: dict[str, set[Photo]] = {}
+        self.candidates: dict[Hashable, list[Photo]] = defaultdict(list)
+        self.duplicates: list[list[Photo]] = []
+        self.fingerprinted: list[Photo] = []
+        # Pixel hashes computed along with fingerprints, by id() of each photo
+        self.pixel_hashes: dict[int, bytes | None] = {}
 
     def __call__(self, photo: Photo) -> ProcessingResult:
-        if photo.metadata.fingerprint in self.duplicates:
-            self.duplicates[photo.metadata.fingerprint].add(photo)
-            return ProcessingResult(False, "Identified as duplicate.")
-        self.duplicates[photo.metadata.fingerprint] = {photo}
-        return ProcessingResult(True, "Not a duplicate.")
+        self.candidates[self.header_key(photo)].append(photo)
+        return ProcessingResult(True, "Queued for duplicate identification.")
 
     @property
     def n_duplicates(self) -> int:
-        n_photos = reduce(
-            operator.add, (len(group) for group in self.duplicates.values())
+        return sum(len(group) - 1 for group in self.duplicates)
+
+    def identify(self) -> list[list[Photo]]:
+        """Split candidate buckets into groups of identical photos."""
+        groups = [group for group in self.candidates.values() if len(group) > 1]
+        fingerprint_key = partial(self.fingerprint_key, hash_pixels=True)
+        for key in (self.partial_key, fingerprint_key, self.pixel_key):
+            groups = [subgroup for group in groups for subgroup in split(group, key)]
+        self.duplicates = groups
+        return self.duplicates
+
+    def header_key(self, photo: Photo) -> Hashable:
+        """Image dimensions and encoded image size, read without decoding."""
+        metadata = photo.metadata
+        if metadata.payload_size is not None:
+            return (metadata.width, metadata.height, metadata.payload_size)
+        try:
+            with span("duplicates.header"):
+                with open(photo.metadata.filepath, "rb") as binary:
+                    header = read_header(binary)
+        except (JpegError, OSError):
+            # Leave photos without a readable header to the later comparisons
+            return None
+        file_size = (
+            photo.entry.size
+            if photo.entry
+            else os.path.getsize(photo.metadata.filepath)
         )
-        n_groups = len(self.duplicates)
-        return n_photos - n_groups
+        return (header.width, header.height, header.payload_size(file_size))
+
+    def partial_key(self, photo: Photo) -> Hashable:
+        """Hash of the decoding tables and the first and last chunks of image data."""
+        try:
+            with span("duplicates.partial_hash") as partial_span:
+                with open(photo.metadata.filepath, "rb") as binary:
+                    header = read_header(binary)
+                    digest = sha256(header.tables)
+                    binary.seek(header.scan_offset)
+                    digest.update(head := binary.read(self.CHUNK_SIZE))
+                    end = binary.seek(0, os.SEEK_END)
+                    binary.seek(max(header.scan_offset, end - self.CHUNK_SIZE))
+                    digest.update(tail := binary.read(self.CHUNK_SIZE))
+                partial_span.bytes = len(head) + len(tail)
+        except (JpegError, OSError):
+            return b""
+        return digest.digest()
+
+    def fingerprint_key(self, photo: Photo, *, hash_pixels: bool = False) -> Hashable:
+        """Fingerprint of the decoded image, which is None for broken images.
+
+        With `hash_pixels`, an image decoded for its fingerprint is also hashed
+        for pixel_key(), in case its fingerprint matches that of another.
+        """
+        if photo.metadata.has_fingerprint:
+            return photo.metadata.fingerprint_digest
+        self.fingerprinted.append(photo)
+        try:
+            with Image.open(photo.metadata.filepath) as im:
+                fingerprint = photo.metadata.fingerprint_image(im)
+                if fingerprint and hash_pixels:
+                    self.pixel_hashes[id(photo)] = pixel_hash(im)
+        except OSError:
+            return photo.metadata.fingerprint_digest
+        return fingerprint
+
+    def pixel_key(self, photo: Photo) -> Hashable:
+        """Hash of the full decoded pixel data, which is None for broken images."""
+        if id(photo) in self.pixel_hashes:
+            return self.pixel_hashes.pop(id(photo))
+        try:
+            with Image.open(photo.metadata.filepath) as im:
+                return pixel_hash(im)
+        except OSError:
+            return None
+
+
+def pixel_hash(im: Image.Image) -> bytes | None:
+    """Hash the full pixel data of an open image, or return None if it is broken."""
+    try:
+        with span("duplicates.pixel_hash") as pixel_span:
+            digest = sha256(f"{im.mode} {im.size}".encode("utf-8"))
+            digest.update(pixels := im.tobytes())
+            pixel_span.bytes = len(pixels)
+    except OSError:
+        return None
+    return digest.digest()
+
+
+def split(photos: list[Photo], key: Callable[[Photo], Hashable]) -> list[list[Photo]]:
+    """Split photos into groups with the same key, dropping unique photos."""
+    groups: dict[Hashable, list[Photo]] = defaultdict(list)
+    for photo in photos:
+        if (value := key(photo)) is not None:
+            groups[value].append(photo)
+    return [group for group in groups.values() if len(group) > 1]
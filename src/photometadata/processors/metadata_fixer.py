@@ -1,71 +1,197 @@
+import json
 import logging
+from collections.abc import Iterable
+from dataclasses import asdict, dataclass, field
 from pathlib import Path
-from .processor import Processor, ProcessingResult
+from typing import Any, TextIO
+from .processor import ProcessingResult
+from .updater import MetadataUpdater
+from .writer import MetadataUpdate, WriterBackend
 from photometadata.photo import Photo
 from photometadata.metadata import Metadata
 from photometadata.settings import Settings
+import os
 import pendulum
 from rich.prompt import Prompt
-import re
 
 logger = logging.getLogger(__name__)
 
+DATE_FORMAT = r"%Y:%m:%d %H:%M:%S"
+DATE_TAGS = (
+    "Exif.Image.DateTime",
+    "Exif.Photo.DateTimeDigitized",
+    "Exif.Photo.DateTimeOriginal",
+)
 
-class MetadataFixer(Processor):
-    def __init__(self, settings: Settings) -> None:
+
+@dataclass
+class PlannedFix:
+    """Changes intended for a single photo, which can be saved and applied later.
+
+    Values that could not be chosen without asking are listed in `unresolved`,
+    and must be filled in (for example by editing a saved plan) before the fix
+    can be applied. `key` is the (size, mtime_ns, inode) of the file when the
+    fix was planned, so that fixes for files changed since are not applied.
+    """
+
+    path: Path
+    key: tuple[int, int, int] | None = None
+    date: str | None = None
+    date_options: list[str] = field(default_factory=list)
+    copyright: str | None = None
+    document_name: str | None = None
+    unresolved: list[str] = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "PlannedFix":
+        data = dict(data)
+        data["path"] = Path(data["path"])
+        if data.get("key") is not None:
+            data["key"] = tuple(data["key"])
+        return cls(**data)
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self) | {"path": str(self.path)}
+
+    @property
+    def tags(self) -> dict[str, str]:
+        """EXIF tags to set, indexed by their exiv2 key"""
+        tags = {key: self.date for key in DATE_TAGS if self.date}
+        if self.copyright:
+            tags["Exif.Image.Copyright"] = self.copyright
+        if self.document_name:
+            tags["Exif.Image.DocumentName"] = self.document_name
+        return tags
+
+    @property
+    def pending(self) -> list[str]:
+        """Names of the unresolved values that have not been filled in"""
+        return [name for name in self.unresolved if not getattr(self, name)]
+
+
+class MetadataFixer(MetadataUpdater):
+    """Fix inconsistent dates, missing copyright holders and missing document names.
+
+    Each photo's changes are first planned and then executed. When not
+    `interactive`, ambiguous values are left unresolved instead of prompting,
+    so that plans can be made for a whole library without blocking. With
+    `filename`, the date in the filename is used whenever dates conflict. With
+    `explain`, the copyright rule chosen for each photo is logged.
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        *,
+        batch: bool = False,
+        writer: WriterBackend = WriterBackend.EXIV2,
+        filename: bool = False,
+        interactive: bool = True,
+        explain: bool = False,
+    ) -> None:
+        super().__init__(batch=batch, writer=writer)
         self.settings = settings
+        self.filename = filename
+        self.interactive = interactive
+        self.explain = explain
+
+    @property
+    def thread_safe(self) -> bool:
+        """Fixes can only run concurrently if they never prompt and are not batched"""
+        return not (self.interactive or self.batch)
+
+    def __call__(self, photo: Photo) -> ProcessingResult | None:
+        fix = self.plan(photo)
+        if not (fix.tags or fix.unresolved):
+            return ProcessingResult(True, "<info>Validated</info>")
+        return self.execute(fix, photo.metadata)
 
-    def __call__(self, photo: Photo) -> ProcessingResult:
-        tags2set = {}
+    def plan(self, photo: Photo) -> PlannedFix:
+        """Decide which changes to make to a photo, without changing anything"""
+        fix = PlannedFix(photo.metadata.filepath)
+        filepath = photo.metadata.filepath
+        if photo.entry:
+            fix.key = photo.entry.key
         if not photo.metadata.all_dates_equal():
-            date = self.choose_date(photo.metadata)
-            tags2set.update(
-                {
-                    key: date.strftime(r"%Y:%m:%d %H:%M:%S")
-                    for key in (
-                        "Exif.Image.DateTime",
-                        "Exif.Photo.DateTimeDigitized",
-                        "Exif.Photo.DateTimeOriginal",
-                    )
-                }
-            )
-            logger.debug(f"  <info>\u2714</info> updating all dates to ({date})")
-            self.set_filename_date(photo.metadata, date)
+            if date := self.choose_date(photo.metadata):
+                fix.date = date.strftime(DATE_FORMAT)
+                filepath = self.renamed(filepath, date)
+                logger.debug(f"  <info>\u2714</info> updating all dates to ({date})")
+            else:
+                fix.date_options = sorted(
+                    {
+                        date.strftime(DATE_FORMAT)
+                        for date in photo.metadata.dates.values()
+                        if date
+                    }
+                )
+                fix.unresolved.append("date")
         if not photo.metadata.copyright:
-            copyright_ = self.choose_copyright(photo.metadata)
-            tags2set.update({"Exif.Image.Copyright": copyright_})
-            logger.debug(
-                f"  <info>\u2714</info> adding copyright holder ({copyright_})",
-            )
+            if copyright_ := self.choose_copyright(photo.metadata):
+                fix.copyright = copyright_
+                logger.debug(
+                    f"  <info>\u2714</info> adding copyright holder ({copyright_})",
+                )
+            else:
+                fix.unresolved.append("copyright")
         if (not photo.metadata.name) and (not photo.metadata.comment):
-            document_name = photo.metadata.filepath.stem.split("- ")[-1].upper()
-            tags2set.update({"Exif.Image.DocumentName": document_name})
+            # Named after the file as it will be once renamed to match its date
+            fix.document_name = document_name(filepath)
             logger.debug(
-                f"  <info>\u2714</info> setting DocumentName ({document_name})",
+                f"  <info>\u2714</info> setting DocumentName ({fix.document_name})",
             )
+        return fix
+
+    def execute(
+        self, fix: PlannedFix, metadata: Metadata | None = None
+    ) -> ProcessingResult | None:
+        """Rename the file to match the chosen date and write the new tags.
 
-        if tags2set:
-            return self.update_metadata(tags2set, photo.metadata.filepath)
-        return ProcessingResult(True, "<info>Validated</info>")
-
-    def update_metadata(self, tags: dict[str, str], filepath: Path) -> ProcessingResult:
-        """Update file metadata using exiv2"""
-        # Update with exiv2
-        exiv_cmds = [
-            f'exiv2 -q -M "set {tag_name} {tag_value}" "{str(filepath)}"'
-            for tag_name, tag_value in tags.items()
-        ]
-        exiv_cmds += [f'exiv2 -q -d t "{str(filepath)}"']
-        return self.run_exiv_cmds(exiv_cmds)
-
-    def choose_date(self, metadata: Metadata) -> pendulum.DateTime:
-        """Choose the most appropriate date using user input"""
-        # if self.option("filename") and metadata.dates["Filename"]:
-        #     self.line(
-        #         f"  <info>\u2714</info> auto-accepting filename match for date ({metadata.dates['Filename']})",
-        #         verbosity=verbosity.VERY_VERBOSE,
-        #     )
-        #     return metadata.dates["Filename"]
+        Fixes with unresolved values, or for files that changed after the fix was
+        planned, are skipped. `metadata` is updated to follow the file if given.
+        """
+        if fix.pending:
+            return ProcessingResult(
+                False,
+                f"[red]Skipped {fix.path}: no {' or '.join(fix.pending)} chosen[/]",
+                fix.path,
+            )
+        try:
+            stat = os.stat(fix.path)
+        except OSError as exc:
+            return ProcessingResult(
+                False, f"[red]Skipped {fix.path}: {exc}[/]", fix.path
+            )
+        if fix.key and fix.key != (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+            return ProcessingResult(
+                False,
+                f"[red]Skipped {fix.path}: changed since it was planned[/]",
+                fix.path,
+            )
+        filepath = fix.path
+        if fix.date and (date := Metadata.parse_date(fix.date)):
+            filepath = self.set_filename_date(fix.path, date)
+            if metadata:
+                metadata.rename(filepath)
+            # A name taken from the old filename, for example because the date
+            # was only filled in after planning, follows the file
+            if fix.document_name == document_name(fix.path):
+                fix.document_name = document_name(filepath)
+        if not fix.tags:
+            return ProcessingResult(True, "<info>Validated</info>", filepath)
+        # The writer's result names the renamed file, as `metadata` may be a
+        # copy in another process
+        return self.update(
+            MetadataUpdate(filepath, tags=fix.tags, delete_thumbnail=True)
+        )
+
+    def choose_date(self, metadata: Metadata) -> pendulum.DateTime | None:
+        """Choose the most appropriate date, asking the user if interactive"""
+        if self.filename and metadata.dates["Filename"]:
+            logger.debug(
+                f"  <info>\u2714</info> auto-accepting filename match for date ({metadata.dates['Filename']})",
+            )
+            return metadata.dates["Filename"]
         available_dates = sorted(
             list({date for date in metadata.dates.values() if date})
         )
@@ -76,41 +202,67 @@ class MetadataFixer(Processor):
         for idx, date in date_map.items():
             logger.info(f"  [b]{idx})[/b] {date}")
         # Automatically take the earliest timestamp if they're all within 5 seconds
-        if (available_dates[-1] - available_dates[0]).as_duration().seconds < 5:
+        if (
+            available_dates
+            and (available_dates[-1] - available_dates[0]).in_seconds() < 5
+        ):
             logger.info(
                 f"Automatically selecting [b]{date_map['1']}[/b] among close-together timestamps."
             )
             return date_map["1"]
-        else:
-            user_input = Prompt.ask(
-                "Please pick one of these options (1, 2, 3 etc.) or enter a date in 'YYYY:MM:DD HH:MM:SS' format:"
-            )
-            if user_input in date_map:
-                return date_map[user_input]
+        if not self.interactive:
+            logger.warning(f"Leaving the date of {metadata.filepath} unresolved")
+            return None
+        user_input = Prompt.ask(
+            "Please pick one of these options (1, 2, 3 etc.) or enter a date in 'YYYY:MM:DD HH:MM:SS' format:"
+        )
+        if user_input in date_map:
+            return date_map[user_input]
         return Metadata.parse_date(user_input)
 
-    def choose_copyright(self, metadata: Metadata) -> str:
-        """Choose the most appropriate copyright using user input"""
-        for ruleset in self.settings.copyright:
-            for rule in ruleset.whenever:
-                tag, value = list(rule.items())[0]
-                if tag == "filename-regex":
-                    regex = re.compile(value)
-                    if regex.match(metadata.filename):
-                        return ruleset.name
-                elif (tag_value := metadata.read_tag(tag)) and (
-                    tag_value.casefold() == value.casefold()
-                ):
-                    return ruleset.name
+    def choose_copyright(self, metadata: Metadata) -> str | None:
+        """Choose the most appropriate copyright, asking the user if interactive"""
+        if rule := self.settings.copyright_rules.match(metadata):
+            if self.explain:
+                logger.info(
+                    f"Copyright of [blue]{metadata.filepath}[/] matched by {rule}"
+                )
+            return rule.name
         logger.warning(f"No copyright rule found for {metadata.filepath}")
+        if not self.interactive:
+            return None
         return Prompt.ask("Please enter the name of the copyright holder:")
 
-    def set_filename_date(self, metadata: Metadata, date: pendulum.DateTime) -> None:
-        filename_date = metadata.extract_date_from_filename()
+    def set_filename_date(self, filepath: Path, date: pendulum.DateTime) -> Path:
+        """Rename a file whose name contains a different date, returning its new path"""
+        new_filepath = self.renamed(filepath, date)
+        if new_filepath == filepath:
+            return filepath
+        return filepath.rename(new_filepath)
+
+    @staticmethod
+    def renamed(filepath: Path, date: pendulum.DateTime) -> Path:
+        """Return the path of a file once the date in its name matches `date`"""
+        filename_date = Metadata.date_from_filename(filepath.name)
         if (not filename_date) or filename_date == date:
-            return
-        filename = metadata.filename.replace(
+            return filepath
+        filename = filepath.name.replace(
             filename_date.strftime(r"%Y%m%d_%H%M%S"), date.strftime(r"%Y%m%d_%H%M%S")
         )
-        filepath = metadata.filepath.parent / filename
-        metadata.path = metadata.filepath.rename(filepath)
+        return filepath.parent / filename
+
+
+def document_name(filepath: Path) -> str:
+    """DocumentName given to photos without one, derived from their filename"""
+    return filepath.stem.split("- ")[-1].upper()
+
+
+def write_plan(plan: TextIO, fixes: Iterable[PlannedFix]) -> None:
+    """Write planned fixes as JSON lines"""
+    for fix in fixes:
+        plan.write(json.dumps(fix.to_dict()) + "\n")
+
+
+def read_plan(plan: TextIO) -> list[PlannedFix]:
+    """Read planned fixes written by write_plan(), skipping blank lines"""
+    return [PlannedFix.from_dict(json.loads(line)) for line in plan if line.strip()]
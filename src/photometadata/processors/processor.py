@@ -1,8 +1,8 @@
 from abc import ABC, abstractmethod
 import logging
 from photometadata.photo import Photo
-from dataclasses import dataclass
-import subprocess
+from dataclasses import dataclass, field
+from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
@@ -11,27 +11,28 @@ logger = logging.getLogger(__name__)
 class ProcessingResult:
     success: bool
     message: str
+    path: Path | None = None
+    # Names of the checks that failed, for structured output
+    failed: list[str] = field(default_factory=list)
+    photo: Photo | None = None
 
 
 class Processor(ABC):
+    # Whether photos can be processed concurrently from several threads or
+    # processes, which also requires flush() to be safe while photos are
+    # being processed. Processors that keep state or prompt the user must not
+    # declare themselves thread-safe.
+    thread_safe: bool = False
+    # Whether __call__ leaves work for flush() to finish, such as batched
+    # updates. Such processors cannot run on a process pool, where each photo
+    # is processed by a copy of the processor whose work would be lost.
+    defers_work: bool = False
+
     @abstractmethod
-    def __call__(self, photo: Photo) -> ProcessingResult:
+    def __call__(self, photo: Photo) -> ProcessingResult | None:
+        """Process a photo, returning None if its result is deferred until flush()"""
         pass
 
-    def run_exiv_cmd(self, exiv_cmd: str) -> ProcessingResult:
-        """Run a single external exiv2 commands"""
-        logger.debug(f"[blue]\u2728[/] running [bold]{exiv_cmd}[/]")
-        try:
-            subprocess.run(exiv_cmd, shell=True, check=True)
-        except (subprocess.CalledProcessError, TypeError, ValueError):
-            logger.error(f"{exiv_cmd} failed!")
-            return ProcessingResult(False, f"Failed to run {exiv_cmd}!")
-        return ProcessingResult(True, f"Ran {exiv_cmd} successfully.")
-
-    def run_exiv_cmds(self, exiv_cmds: list[str]) -> ProcessingResult:
-        """Run one or more external exiv2 commands"""
-        for exiv_cmd in exiv_cmds:
-            result = self.run_exiv_cmd(exiv_cmd)
-            if not result.success:
-                return result
-        return ProcessingResult(True, "All commands ran successfully.")
+    def flush(self) -> list[ProcessingResult]:
+        """Finish any deferred work, returning one result per deferred photo"""
+        return []
@@ -0,0 +1,76 @@
+import logging
+from collections import defaultdict
+from .processor import Processor, ProcessingResult
+from photometadata.bktree import BKTree
+from photometadata.perceptual import hamming
+from photometadata.photo import Photo
+from photometadata.profiling import span
+
+
+logger = logging.getLogger(__name__)
+
+
+class SimilarityIdentifier(Processor):
+    """Identify near-duplicate photos by comparing perceptual hashes.
+
+    Each photo is looked up in a BK-tree of the hashes seen so far, so only a
+    small fraction of the library is compared against it. Photos within
+    `threshold` bits of each other are joined into the same group.
+    """
+
+    def __init__(self, threshold: int) -> None:
+        self.threshold = threshold
+        self.index: BKTree[int] = BKTree(hamming)
+        self.photos: list[Photo] = []
+        self.parents: list[int] = []
+
+    def __call__(self, photo: Photo) -> ProcessingResult:
+        perceptual_hash = photo.metadata.perceptual_hash
+        if perceptual_hash is None:
+            logger.error("  [red]\u2716[/] Image data is broken!")
+            return ProcessingResult(
+                False,
+                f"[red]Failed to hash {photo.metadata.path}[/]",
+                photo.path,
+                ["broken_image"],
+            )
+        idx = len(self.photos)
+        self.photos.append(photo)
+        self.parents.append(idx)
+        with span("similarity.search"):
+            matches = self.index.search(perceptual_hash, self.threshold)
+        for distance, other in matches:
+            logger.debug(
+                f"  [blue]\u2714[/] Similar to {self.photos[other].metadata.path} (distance {distance})"
+            )
+            self.union(idx, other)
+        self.index.add(perceptual_hash, idx)
+        return ProcessingResult(
+            True,
+            f"[blue]Found {len(matches)} similar photo(s) to {photo.metadata.path}[/]",
+        )
+
+    @property
+    def groups(self) -> list[list[Photo]]:
+        """Groups of photos that are connected by similar pairs."""
+        groups: dict[int, list[Photo]] = defaultdict(list)
+        for idx, photo in enumerate(self.photos):
+            groups[self.find(idx)].append(photo)
+        return [group for group in groups.values() if len(group) > 1]
+
+    @property
+    def n_duplicates(self) -> int:
+        return sum(len(group) - 1 for group in self.groups)
+
+    def find(self, idx: int) -> int:
+        """Find the representative of the group containing idx."""
+        while self.parents[idx] != idx:
+            self.parents[idx] = self.parents[self.parents[idx]]
+            idx = self.parents[idx]
+        return idx
+
+    def union(self, left: int, right: int) -> None:
+        """Merge the groups containing left and right."""
+        root_left, root_right = self.find(left), self.find(right)
+        if root_left != root_right:
+            self.parents[max(root_left, root_right)] = min(root_left, root_right)
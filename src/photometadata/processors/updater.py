@@ -0,0 +1,32 @@
+from .processor import Processor, ProcessingResult
+from .writer import MetadataUpdate, WriterBackend
+
+
+class MetadataUpdater(Processor):
+    """Processor that writes metadata changes, optionally batched by directory"""
+
+    def __init__(
+        self, *, batch: bool = False, writer: WriterBackend = WriterBackend.EXIV2
+    ) -> None:
+        self.writer = writer.create()
+        self.batch = batch
+        self.pending: list[MetadataUpdate] = []
+
+    @property
+    def defers_work(self) -> bool:
+        return self.batch
+
+    def update(self, update: MetadataUpdate) -> ProcessingResult | None:
+        """Write an update now, or defer it until flush() in batch mode"""
+        if self.batch:
+            self.pending.append(update)
+            return None
+        return self.writer.apply(update)
+
+    def flush(self) -> list[ProcessingResult]:
+        """Write all deferred updates"""
+        if not self.pending:
+            return []
+        results = self.writer.apply_batch(self.pending)
+        self.pending = []
+        return results
@@ -0,0 +1,214 @@
+import logging
+import re
+import shlex
+import subprocess
+from abc import ABC, abstractmethod
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from enum import Enum
+from pathlib import Path
+from .processor import ProcessingResult
+from photometadata import jpeg, profiling
+from photometadata.exif import EXIF_SIGNATURE, ExifError, update_exif
+from photometadata.iptc import PHOTOSHOP_SIGNATURE, IptcError, add_keywords
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MetadataUpdate:
+    """Changes to make to the metadata of a single file"""
+
+    filepath: Path
+    tags: dict[str, str] = field(default_factory=dict)
+    keywords: list[str] = field(default_factory=list)
+    delete_thumbnail: bool = False
+
+    def __bool__(self) -> bool:
+        return bool(self.tags or self.keywords or self.delete_thumbnail)
+
+
+class WriterBackend(str, Enum):
+    """Available metadata writer backends"""
+
+    EXIV2 = "exiv2"
+    NATIVE = "native"
+
+    def create(self) -> "MetadataWriter":
+        """Return a writer using this backend"""
+        return Exiv2Writer() if self is WriterBackend.EXIV2 else NativeWriter()
+
+
+class MetadataWriter(ABC):
+    """Interface for applying metadata updates to files"""
+
+    @abstractmethod
+    def apply(self, update: MetadataUpdate) -> ProcessingResult:
+        """Apply an update to a single file"""
+
+    def apply_batch(self, updates: list[MetadataUpdate]) -> list[ProcessingResult]:
+        """Apply updates to several files, returning one result per update"""
+        return [self.apply(update) for update in updates]
+
+
+class Exiv2Writer(MetadataWriter):
+    """Apply metadata updates by running the external exiv2 tool"""
+
+    def __init__(self, executable: str = "exiv2", max_workers: int = 4) -> None:
+        self.executable = executable
+        self.max_workers = max_workers
+
+    def arguments(self, update: MetadataUpdate) -> list[tuple[str, ...]]:
+        """Return the exiv2 arguments needed to apply an update.
+
+        All tag modifications are made in a single invocation. Deleting the
+        thumbnail is a separate exiv2 action, so needs its own invocation.
+        """
+        commands = [
+            f"set {tag_name} {tag_value}" for tag_name, tag_value in update.tags.items()
+        ] + [f"add Iptc.Application2.Keywords String {kwd}" for kwd in update.keywords]
+        arguments = []
+        if commands:
+            arguments.append(tuple(arg for cmd in commands for arg in ("-M", cmd)))
+        if update.delete_thumbnail:
+            arguments.append(("-d", "t"))
+        return arguments
+
+    def run(self, arguments: tuple[str, ...], filepaths: list[Path]) -> set[Path]:
+        """Run exiv2 on one or more files, returning the files that failed"""
+        cmd = [self.executable, *arguments, *map(str, filepaths)]
+        logger.debug(f"[blue]\u2728[/] running [bold]{shlex.join(cmd)}[/]")
+        try:
+            with profiling.span("writer.exiv2"):
+                process = subprocess.run(cmd, capture_output=True, text=True)
+        except OSError as exc:
+            logger.error(f"Could not run {self.executable}: {exc}")
+            return set(filepaths)
+        if process.returncode == 0:
+            return set()
+        logger.error(f"{shlex.join(cmd)} failed!\n{process.stderr.strip()}")
+        # exiv2 names the file in its error messages, followed by a colon, which
+        # lets us attribute failures in a batch to individual files. Files are
+        # not rerun one by one, as adding keywords again would duplicate them.
+        failed = {fp for fp in filepaths if names_file(process.stderr, fp)}
+        return failed or set(filepaths)
+
+    def apply(self, update: MetadataUpdate) -> ProcessingResult:
+        """Apply an update to a single file"""
+        return self.apply_batch([update])[0]
+
+    def apply_batch(self, updates: list[MetadataUpdate]) -> list[ProcessingResult]:
+        """Apply updates to several files, returning one result per update.
+
+        Files that need identical arguments (for example thumbnail deletion) are
+        passed to a single exiv2 invocation. Invocations that touch different
+        files run concurrently, while each file's invocations still run in the
+        same order as they would for a single update.
+        """
+        phases: list[dict[tuple[str, ...], list[Path]]] = []
+        for update in updates:
+            for idx, arguments in enumerate(self.arguments(update)):
+                if idx == len(phases):
+                    phases.append({})
+                phases[idx].setdefault(arguments, []).append(update.filepath)
+        failed: set[Path] = set()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # A file appears at most once in each phase, so the invocations of a
+            # phase are independent of each other
+            for batches in phases:
+                runs = [
+                    (arguments, [fp for fp in filepaths if fp not in failed])
+                    for arguments, filepaths in batches.items()
+                ]
+                for failures in executor.map(
+                    lambda run: self.run(*run), [run for run in runs if run[1]]
+                ):
+                    failed |= failures
+        return [
+            ProcessingResult(
+                False, f"[red]Failed to update {update.filepath}[/]", update.filepath
+            )
+            if update.filepath in failed
+            else ProcessingResult(
+                True, f"[blue]Updated {update.filepath}[/]", update.filepath
+            )
+            for update in updates
+        ]
+
+
+class NativeWriter(MetadataWriter):
+    """Apply metadata updates by editing the APP1 and APP13 segments directly.
+
+    Only the header segments are rewritten; the image data is copied unchanged.
+    The writer keeps no state, so it is safe to use from several threads.
+    """
+
+    def __init__(self, max_workers: int = 4) -> None:
+        self.max_workers = max_workers
+
+    def apply(self, update: MetadataUpdate) -> ProcessingResult:
+        """Apply an update to a single file"""
+        logger.debug(f"[blue]\u2728[/] updating [bold]{update.filepath}[/]")
+        try:
+            with open(update.filepath, "rb") as binary:
+                with profiling.span("writer.read_segments"):
+                    segments, scan_offset = jpeg.read_segments(binary)
+            if update.tags or update.delete_thumbnail:
+                self.update_segment(
+                    segments,
+                    jpeg.APP1,
+                    EXIF_SIGNATURE,
+                    lambda payload: update_exif(
+                        payload, update.tags, delete_thumbnail=update.delete_thumbnail
+                    ),
+                )
+            if update.keywords:
+                self.update_segment(
+                    segments,
+                    jpeg.APP13,
+                    PHOTOSHOP_SIGNATURE,
+                    lambda payload: add_keywords(payload, update.keywords),
+                )
+            with profiling.span("writer.rewrite"):
+                jpeg.rewrite(update.filepath, segments, scan_offset)
+        except (jpeg.JpegError, ExifError, IptcError, OSError) as exc:
+            logger.error(f"Could not update {update.filepath}: {exc}")
+            return ProcessingResult(
+                False, f"[red]Failed to update {update.filepath}[/]", update.filepath
+            )
+        return ProcessingResult(
+            True, f"[blue]Updated {update.filepath}[/]", update.filepath
+        )
+
+    def apply_batch(self, updates: list[MetadataUpdate]) -> list[ProcessingResult]:
+        """Apply updates to several files concurrently, one result per update"""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self.apply, updates))
+
+    @staticmethod
+    def update_segment(
+        segments: list[jpeg.Segment],
+        marker: int,
+        signature: bytes,
+        edit: Callable[[bytes | None], bytes],
+    ) -> None:
+        """Replace the payload of the first segment with a given signature.
+
+        A new segment is inserted after any APP0 (JFIF) segments if the file does
+        not have one yet, as readers expect APP0 to come first.
+        """
+        for idx, segment in enumerate(segments):
+            if segment.marker == marker and segment.data.startswith(signature):
+                segments[idx] = jpeg.Segment(marker, edit(segment.data))
+                return
+        position = 0
+        while position < len(segments) and segments[position].marker == jpeg.APP0:
+            position += 1
+        segments.insert(position, jpeg.Segment(marker, edit(None)))
+
+
+def names_file(message: str, filepath: Path) -> bool:
+    """Whether an exiv2 error message names a file, rather than a longer path"""
+    pattern = rf"(?<![^\s'\"]){re.escape(str(filepath))}(?=[:'\"]|\s|$)"
+    return re.search(pattern, message, re.MULTILINE) is not None
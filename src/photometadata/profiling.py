@@ -0,0 +1,184 @@
+"""Lightweight timing spans for finding out where the time in a run goes"""
+
+import json
+import random
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any, TypeVar
+
+from rich.console import Console
+from rich.table import Table
+
+T = TypeVar("T")
+
+
+class Stage:
+    """Timing statistics for all spans with the same name.
+
+    Counts, totals and maxima are exact, while percentiles are estimated from a
+    bounded random sample of durations.
+    """
+
+    RESERVOIR_SIZE = 10000
+
+    __slots__ = ("count", "total", "maximum", "bytes", "samples")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.bytes = 0
+        self.samples: list[float] = []
+
+    def add(self, duration: float, n_bytes: int = 0) -> None:
+        """Record a single span"""
+        self.count += 1
+        self.total += duration
+        self.maximum = max(self.maximum, duration)
+        self.bytes += n_bytes
+        if len(self.samples) < self.RESERVOIR_SIZE:
+            self.samples.append(duration)
+        elif (idx := random.randrange(self.count)) < self.RESERVOIR_SIZE:
+            self.samples[idx] = duration
+
+    def merge(self, other: "Stage") -> None:
+        """Add the spans recorded in another Stage"""
+        self.count += other.count
+        self.total += other.total
+        self.maximum = max(self.maximum, other.maximum)
+        self.bytes += other.bytes
+        self.samples = (self.samples + other.samples)[: self.RESERVOIR_SIZE]
+
+    def percentile(self, q: float) -> float:
+        """Return the duration below which a fraction `q` of spans completed"""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def to_dict(self) -> dict[str, float | int]:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "max": self.maximum,
+            "bytes": self.bytes,
+        }
+
+
+class Span:
+    """Context manager that records the time spent inside it"""
+
+    __slots__ = ("name", "start", "bytes")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.bytes = 0
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        record(self.name, time.perf_counter() - self.start, self.bytes)
+
+
+class _NullSpan:
+    """Shared span used when profiling is disabled, which records nothing"""
+
+    bytes = 0
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        return None
+
+
+NULL_SPAN = _NullSpan()
+_enabled = False
+_lock = threading.Lock()
+_stages: dict[str, Stage] = {}
+
+
+def enable() -> None:
+    """Start recording spans in this process"""
+    global _enabled
+    _enabled = True
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def span(name: str) -> Span | _NullSpan:
+    """Return a context manager timing a stage, which does nothing unless enabled.
+
+    The number of bytes processed in the stage can be recorded by setting the
+    `bytes` attribute of the returned span.
+    """
+    return Span(name) if _enabled else NULL_SPAN
+
+
+def record(name: str, duration: float, n_bytes: int = 0) -> None:
+    """Record a span that was timed elsewhere"""
+    with _lock:
+        if (stage := _stages.get(name)) is None:
+            stage = _stages[name] = Stage()
+        stage.add(duration, n_bytes)
+
+
+def collect() -> dict[str, Stage]:
+    """Return and reset the stages recorded so far"""
+    global _stages
+    with _lock:
+        stages, _stages = _stages, {}
+    return stages
+
+
+def merge(stages: dict[str, Stage]) -> None:
+    """Add stages recorded in another process"""
+    with _lock:
+        for name, other in stages.items():
+            _stages.setdefault(name, Stage()).merge(other)
+
+
+def profiled(
+    function: Callable[..., T], *args: Any, **kwargs: Any
+) -> tuple[T, dict[str, Stage]]:
+    """Call a function in a worker process, returning its result and its spans"""
+    enable()
+    collect()
+    result = function(*args, **kwargs)
+    return result, collect()
+
+
+def report(output: str | Path | None = None) -> None:
+    """Print the recorded stages, slowest first, and optionally save them as JSON"""
+    stages = sorted(_stages.items(), key=lambda item: item[1].total, reverse=True)
+    table = Table(title="Profile")
+    for column in ("Stage", "Count", "Total (s)", "p50 (ms)", "p95 (ms)", "Max (ms)"):
+        if column == "Stage":
+            table.add_column(column, overflow="fold")
+        else:
+            table.add_column(column, justify="right")
+    table.add_column("Data (MiB)", justify="right")
+    for name, stage in stages:
+        table.add_row(
+            name,
+            f"{stage.count}",
+            f"{stage.total:.3f}",
+            f"{1000 * stage.percentile(0.5):.2f}",
+            f"{1000 * stage.percentile(0.95):.2f}",
+            f"{1000 * stage.maximum:.2f}",
+            f"{stage.bytes / 2**20:.2f}" if stage.bytes else "",
+        )
+    Console(stderr=True).print(table)
+    if output:
+        Path(output).write_text(
+            json.dumps({name: stage.to_dict() for name, stage in stages}, indent=2),
+            encoding="utf-8",
+        )
@@ -0,0 +1,204 @@
+"""Parser for --where filters, translated into SQL over the library index"""
+
+import re
+from typing import Any, NamedTuple
+
+# Fields that can be used in filters, with the SQL expression for each
+FIELDS = {
+    "path": "path",
+    "directory": "directory",
+    "filename": "filename",
+    "date": "date",
+    "year": "CAST(substr(date, 1, 4) AS INTEGER)",
+    "month": "CAST(substr(date, 6, 2) AS INTEGER)",
+    "camera": "camera",
+    "copyright": "copyright",
+    "valid": "(failed = '')",
+    "failed": "failed",
+}
+# Fields that can be used on their own as a condition, such as `not copyright`
+BOOLEAN_FIELDS = {"copyright", "valid"}
+OPERATORS = {
+    "=": "=",
+    "==": "=",
+    "!=": "!=",
+    "<>": "!=",
+    "<": "<",
+    "<=": "<=",
+    ">": ">",
+    ">=": ">=",
+}
+KEYWORDS = {"and", "or", "not", "like", "in", "is", "null", "true", "false"}
+
+TOKEN = re.compile(
+    r"""\s*(?:
+        (?P<number>-?\d+(?:\.\d+)?)
+        |(?P<string>'(?:[^']|'')*'|"(?:[^"]|"")*")
+        |(?P<operator><=|>=|!=|<>|==|=|<|>)
+        |(?P<punctuation>[(),])
+        |(?P<word>[A-Za-z_][A-Za-z0-9_]*)
+    )""",
+    re.VERBOSE,
+)
+
+
+class QueryError(ValueError):
+    pass
+
+
+class Token(NamedTuple):
+    kind: str
+    value: str
+
+
+class Query(NamedTuple):
+    """A filter translated into an SQL condition with its parameters"""
+
+    text: str
+    sql: str
+    parameters: tuple[Any, ...]
+
+    def __str__(self) -> str:
+        return self.text
+
+
+def tokenize(text: str) -> list[Token]:
+    """Split a filter into tokens, rejecting anything that is not recognised"""
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if not match or match.end() == position:
+            raise QueryError(f"Unexpected '{text[position:].strip()}' in filter")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "word" and value.lower() in KEYWORDS:
+            kind, value = "keyword", value.lower()
+        tokens.append(Token(kind, value))
+        position = match.end()
+    return tokens
+
+
+class Parser:
+    """Recursive descent parser for filters such as `camera='Apple iPhone 12' and year=2019`.
+
+    Only known fields, literals, comparisons, `like`, `in`, `is [not] null` and
+    `and`/`or`/`not` are accepted, and literals are always passed as parameters,
+    so a filter can never run arbitrary SQL.
+    """
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.tokens = tokenize(text)
+        self.position = 0
+        self.parameters: list[Any] = []
+
+    def parse(self) -> Query:
+        if not self.tokens:
+            raise QueryError("Empty filter")
+        sql = self.disjunction()
+        if self.peek():
+            raise QueryError(f"Unexpected '{self.peek().value}' in filter")
+        return Query(self.text, sql, tuple(self.parameters))
+
+    def peek(self) -> Token | None:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def accept(self, kind: str, value: str | None = None) -> Token | None:
+        """Consume the next token if it matches"""
+        token = self.peek()
+        if token and token.kind == kind and (value is None or token.value == value):
+            self.position += 1
+            return token
+        return None
+
+    def expect(self, kind: str, value: str | None = None) -> Token:
+        if token := self.accept(kind, value):
+            return token
+        found = self.peek()
+        raise QueryError(
+            f"Expected {value or kind} but found {found.value if found else 'end of filter'}"
+        )
+
+    def disjunction(self) -> str:
+        terms = [self.conjunction()]
+        while self.accept("keyword", "or"):
+            terms.append(self.conjunction())
+        return terms[0] if len(terms) == 1 else "(" + " OR ".join(terms) + ")"
+
+    def conjunction(self) -> str:
+        terms = [self.negation()]
+        while self.accept("keyword", "and"):
+            terms.append(self.negation())
+        return terms[0] if len(terms) == 1 else "(" + " AND ".join(terms) + ")"
+
+    def negation(self) -> str:
+        if self.accept("keyword", "not"):
+            return f"NOT {self.negation()}"
+        return self.condition()
+
+    def condition(self) -> str:
+        if self.accept("punctuation", "("):
+            sql = self.disjunction()
+            self.expect("punctuation", ")")
+            return f"({sql})"
+        token = self.expect("word")
+        name = token.value.lower()
+        if name not in FIELDS:
+            raise QueryError(
+                f"Unknown field '{token.value}', expected one of {', '.join(FIELDS)}"
+            )
+        field = FIELDS[name]
+        if operator := self.accept("operator"):
+            return f"({field} {OPERATORS[operator.value]} {self.operand()})"
+        if self.accept("keyword", "like"):
+            return f"({field} LIKE {self.operand()})"
+        if self.accept("keyword", "is"):
+            negated = bool(self.accept("keyword", "not"))
+            self.expect("keyword", "null")
+            return f"({field} IS {'NOT ' if negated else ''}NULL)"
+        if self.accept("keyword", "not"):
+            self.expect("keyword", "in")
+            return f"({field} NOT IN {self.operands()})"
+        if self.accept("keyword", "in"):
+            return f"({field} IN {self.operands()})"
+        if name in BOOLEAN_FIELDS:
+            return f"({field})"
+        raise QueryError(f"Field '{token.value}' must be compared with a value")
+
+    def operand(self) -> str:
+        """Consume a literal or a field, returning its SQL"""
+        if token := self.accept("word"):
+            if token.value.lower() not in FIELDS:
+                raise QueryError(f"Unknown field '{token.value}'")
+            return FIELDS[token.value.lower()]
+        if token := self.accept("string"):
+            quote = token.value[0]
+            self.parameters.append(token.value[1:-1].replace(quote * 2, quote))
+        elif token := self.accept("number"):
+            self.parameters.append(
+                float(token.value) if "." in token.value else int(token.value)
+            )
+        elif token := self.accept("keyword", "true") or self.accept("keyword", "false"):
+            self.parameters.append(token.value == "true")
+        else:
+            found = self.peek()
+            raise QueryError(
+                f"Expected a value but found {found.value if found else 'end of filter'}"
+            )
+        return "?"
+
+    def operands(self) -> str:
+        """Consume a parenthesised list of literals"""
+        self.expect("punctuation", "(")
+        values = [self.operand()]
+        while self.accept("punctuation", ","):
+            values.append(self.operand())
+        self.expect("punctuation", ")")
+        return "(" + ", ".join(values) + ")"
+
+
+def parse(text: str) -> Query:
+    """Parse a filter, raising QueryError if it is not valid"""
+    return Parser(text).parse()
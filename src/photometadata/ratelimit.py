@@ -0,0 +1,52 @@
+"""Helpers for rate limiting and retrying requests to remote services"""
+
+import random
+import threading
+import time
+from collections.abc import Callable
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` acquisitions per second on average.
+
+    Up to `capacity` tokens can accumulate while idle, which allows short bursts
+    above the average rate.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float | None = None,
+        *,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        if rate <= 0:
+            raise ValueError("Rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Take a token, blocking until one is available"""
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+def backoff(attempt: int, *, base: float = 0.5, maximum: float = 30.0) -> float:
+    """Return a randomised exponential delay before retrying after `attempt` failures"""
+    return random.uniform(0, min(maximum, base * 2**attempt))
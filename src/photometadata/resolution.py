@@ -0,0 +1,232 @@
+"""Reclaiming the space used by duplicate photos"""
+
+import errno
+import logging
+import os
+import shutil
+from collections.abc import Iterable, Iterator
+from enum import Enum
+from pathlib import Path
+from typing import BinaryIO, NamedTuple
+
+from photometadata.jpeg import JpegError, read_header
+from photometadata.photo import Photo
+from photometadata.processors import ProcessingResult
+from photometadata.profiling import span
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# ioctl request cloning a whole file on Linux filesystems such as Btrfs and XFS
+FICLONE = 0x40049409
+CHUNK_SIZE = 1024 * 1024
+
+
+class KeepPolicy(str, Enum):
+    OLDEST = "oldest"
+    RICHEST = "richest"
+    SHORTEST = "shortest"
+
+    def choose(self, group: Iterable[Photo]) -> Photo:
+        """Return the photo in a group of duplicates that should be kept"""
+        return min(group, key=self.key)
+
+    def key(self, photo: Photo) -> tuple:
+        """Sort key under which the photo to keep comes first"""
+        path = str(photo.path)
+        if self is KeepPolicy.OLDEST:
+            mtime_ns = (
+                photo.entry.mtime_ns if photo.entry else os.stat(path).st_mtime_ns
+            )
+            return (mtime_ns, len(path), path)
+        if self is KeepPolicy.RICHEST:
+            metadata = photo.metadata
+            richness = sum(1 for value in metadata.tags.values() if value) + len(
+                metadata.keywords
+            )
+            return (-richness, len(path), path)
+        return (len(path), path)
+
+
+class Resolution(str, Enum):
+    HARDLINK = "hardlink"
+    REFLINK = "reflink"
+    QUARANTINE = "quarantine"
+
+
+class Replacement(NamedTuple):
+    """The outcome of resolving one copy, with the bytes it (would have) reclaimed"""
+
+    keeper: Photo
+    copy: Photo
+    result: ProcessingResult
+    reclaimed: int
+
+
+class DuplicateResolver:
+    """Keep one photo of each group of duplicates and replace or move the others.
+
+    Copies are replaced with hardlinks or reflinks to the photo that is kept,
+    which requires the files to be identical byte for byte, or are moved to a
+    quarantine directory, which only requires their image data to be identical
+    so that copies with different metadata can be reviewed before deleting them.
+    Files are verified immediately before each change, and also in a dry run so
+    that its report only counts copies that would be resolved.
+    """
+
+    def __init__(
+        self,
+        resolution: Resolution,
+        *,
+        keep: KeepPolicy = KeepPolicy.OLDEST,
+        base_path: Path,
+        quarantine: Path | None = None,
+        dry_run: bool = False,
+    ) -> None:
+        if resolution is Resolution.QUARANTINE and not quarantine:
+            raise ValueError("A quarantine directory is needed to quarantine copies")
+        self.resolution = resolution
+        self.keep = keep
+        self.base_path = base_path
+        self.quarantine = quarantine
+        self.dry_run = dry_run
+
+    def resolve(self, groups: Iterable[list[Photo]]) -> Iterator[Replacement]:
+        """Resolve every copy in each group of duplicates"""
+        for group in groups:
+            keeper = self.keep.choose(group)
+            for photo in group:
+                if photo is not keeper:
+                    yield self.resolve_copy(keeper, photo)
+
+    def resolve_copy(self, keeper: Photo, copy: Photo) -> Replacement:
+        """Verify a copy against the photo that is kept, then replace or move it"""
+        try:
+            stat = os.stat(copy.path)
+            # A copy that is already linked to the photo kept is identical, but
+            # is still moved out of the library when quarantining
+            identical = os.path.samefile(keeper.path, copy.path)
+            if identical and self.resolution is not Resolution.QUARANTINE:
+                return Replacement(
+                    keeper,
+                    copy,
+                    ProcessingResult(
+                        True, f"{copy.path} is already linked to {keeper.path}"
+                    ),
+                    0,
+                )
+            if not identical:
+                with span("resolution.verify") as verify_span:
+                    identical = self.verify(keeper.path, copy.path)
+                    verify_span.bytes = 2 * stat.st_size
+        except OSError as exc:
+            return self.failed(keeper, copy, f"could not verify it: {exc}")
+        if not identical:
+            reason = (
+                f"its image data differs from {keeper.path}"
+                if self.resolution is Resolution.QUARANTINE
+                else f"it is not byte-identical to {keeper.path}, for example because its metadata differs"
+            )
+            return self.failed(keeper, copy, reason)
+        # Space is only freed once no other links to the copy remain
+        reclaimed = stat.st_size if stat.st_nlink == 1 else 0
+        action = {
+            Resolution.HARDLINK: "hardlink to",
+            Resolution.REFLINK: "reflink to",
+            Resolution.QUARANTINE: "quarantined copy of",
+        }[self.resolution]
+        if self.dry_run:
+            return Replacement(
+                keeper,
+                copy,
+                ProcessingResult(
+                    True, f"Would replace {copy.path} with a {action} {keeper.path}"
+                ),
+                reclaimed,
+            )
+        try:
+            if self.resolution is Resolution.QUARANTINE:
+                target = self.quarantine_path(copy.path)
+                if target.exists():
+                    raise OSError(errno.EEXIST, "already in quarantine", str(target))
+                target.parent.mkdir(parents=True, exist_ok=True)
+                shutil.move(copy.path, target)
+                message = f"Moved {copy.path} to {target}, keeping {keeper.path}"
+            else:
+                replace(keeper.path, copy.path, self.resolution)
+                message = f"Replaced {copy.path} with a {action} {keeper.path}"
+        except OSError as exc:
+            return self.failed(keeper, copy, f"could not replace it: {exc}")
+        return Replacement(keeper, copy, ProcessingResult(True, message), reclaimed)
+
+    def verify(self, keeper: Path, copy: Path) -> bool:
+        """Compare two files byte for byte, or only their image data for quarantine"""
+        if self.resolution is not Resolution.QUARANTINE:
+            if os.path.getsize(keeper) != os.path.getsize(copy):
+                return False
+            with open(keeper, "rb") as left, open(copy, "rb") as right:
+                return same_bytes(left, right)
+        with open(keeper, "rb") as left, open(copy, "rb") as right:
+            try:
+                left_header = read_header(left)
+                right_header = read_header(right)
+            except JpegError:
+                left.seek(0)
+                right.seek(0)
+                return same_bytes(left, right)
+            if left_header.tables != right_header.tables:
+                return False
+            left.seek(left_header.scan_offset)
+            right.seek(right_header.scan_offset)
+            return same_bytes(left, right)
+
+    def quarantine_path(self, file_path: Path) -> Path:
+        """Location of a quarantined copy, keeping its path relative to the library"""
+        return self.quarantine / Path(file_path).relative_to(self.base_path)
+
+    def failed(self, keeper: Photo, copy: Photo, reason: str) -> Replacement:
+        return Replacement(
+            keeper,
+            copy,
+            ProcessingResult(
+                False, f"[red]Skipped {copy.path}[/]: {reason}", copy.path
+            ),
+            0,
+        )
+
+
+def same_bytes(left: BinaryIO, right: BinaryIO) -> bool:
+    """Compare the rest of two files, one chunk at a time"""
+    while True:
+        left_chunk = left.read(CHUNK_SIZE)
+        if left_chunk != right.read(CHUNK_SIZE):
+            return False
+        if not left_chunk:
+            return True
+
+
+def replace(source: Path, target: Path, resolution: Resolution) -> None:
+    """Atomically replace a file with a hardlink or reflink to an identical one"""
+    temporary = target.with_name(f".{target.name}.photometadata")
+    try:
+        if resolution is Resolution.HARDLINK:
+            os.link(source, temporary)
+        else:
+            reflink(source, temporary)
+            shutil.copystat(target, temporary)
+        os.replace(temporary, target)
+    except OSError:
+        temporary.unlink(missing_ok=True)
+        raise
+
+
+def reflink(source: Path, target: Path) -> None:
+    """Create a copy of a file that shares its data blocks, where supported"""
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this platform")
+    with open(source, "rb") as src, open(target, "xb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
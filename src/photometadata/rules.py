@@ -0,0 +1,104 @@
+"""Copyright rules compiled into lookup tables for matching many photos"""
+
+import logging
+import re
+from collections.abc import Iterable
+from typing import NamedTuple
+
+from photometadata.metadata import Metadata
+
+logger = logging.getLogger(__name__)
+
+FILENAME_REGEX = "filename-regex"
+
+
+class Rule(NamedTuple):
+    """A single rule of a copyright holder, numbered by its order in the settings"""
+
+    name: str
+    tag: str
+    value: str
+    position: int
+    index: int
+
+    def __str__(self) -> str:
+        return f"rule {self.index} for {self.name} ({self.tag}: {self.value})"
+
+
+class CopyrightRules:
+    """Copyright rules compiled once for matching against many photos.
+
+    Rules on tags are indexed by tag and case-folded value, and rules on
+    filenames are combined into a single regex with a named group for each rule.
+    The rule that comes first in the settings wins, exactly as if each rule were
+    checked in order.
+    """
+
+    def __init__(self, rulesets: Iterable[tuple[str, Iterable[dict[str, str]]]]):
+        self.rules: list[Rule] = []
+        self.tags: dict[str, dict[str, Rule]] = {}
+        self.filename_rules: list[Rule] = []
+        for name, whenever in rulesets:
+            for index, rule in enumerate(whenever, start=1):
+                tag, value = next(iter(rule.items()))
+                rule_ = Rule(name, tag, value, len(self.rules), index)
+                self.rules.append(rule_)
+                if tag == FILENAME_REGEX:
+                    self.filename_rules.append(rule_)
+                else:
+                    self.tags.setdefault(tag, {}).setdefault(value.casefold(), rule_)
+        # Tags are read in the order of their first rule, so that tags which
+        # cannot change the outcome are not read
+        self.first_position = {
+            tag: min(rule.position for rule in values.values())
+            for tag, values in self.tags.items()
+        }
+        self.tag_order = sorted(self.tags, key=self.first_position.__getitem__)
+        self.filename_regexes = [
+            (re.compile(rule.value), rule) for rule in self.filename_rules
+        ]
+        self.filename_regex = combine(self.filename_rules)
+
+    def match(self, metadata: Metadata) -> Rule | None:
+        """Return the first rule matching a photo, if any"""
+        best = self.match_filename(metadata.filename)
+        for tag in self.tag_order:
+            if best and self.first_position[tag] > best.position:
+                break
+            if (
+                (value := metadata.read_tag(tag))
+                and (rule := self.tags[tag].get(value.casefold()))
+                and (best is None or rule.position < best.position)
+            ):
+                best = rule
+        return best
+
+    def match_filename(self, filename: str) -> Rule | None:
+        """Return the first filename rule matching the start of a filename"""
+        if self.filename_regex:
+            if match := self.filename_regex.match(filename):
+                return self.filename_rules[int(match.lastgroup[1:])]
+            return None
+        for regex, rule in self.filename_regexes:
+            if regex.match(filename):
+                return rule
+        return None
+
+
+def combine(rules: list[Rule]) -> re.Pattern | None:
+    """Combine filename rules into one regex whose first matching group is the first matching rule.
+
+    Returns None if the rules cannot be combined, for example because they use
+    groups or backreferences of their own, in which case each is tried in turn.
+    """
+    if not rules:
+        return None
+    try:
+        if any(re.compile(rule.value).groups for rule in rules):
+            return None
+        return re.compile(
+            "|".join(f"(?P<r{idx}>{rule.value})" for idx, rule in enumerate(rules))
+        )
+    except re.error:
+        logger.debug("Could not combine filename rules into a single regex")
+        return None
@@ -0,0 +1,88 @@
+"""Single-pass directory scanner for photo files"""
+
+import logging
+import os
+from collections.abc import Generator, Iterable
+from pathlib import Path
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+
+class FileEntry(NamedTuple):
+    """A photo file together with the stat results recorded while scanning"""
+
+    path: Path
+    size: int
+    mtime_ns: int
+    inode: int
+
+    @property
+    def key(self) -> tuple[int, int, int]:
+        """Return the (size, mtime_ns, inode) tuple identifying this version of the file"""
+        return (self.size, self.mtime_ns, self.inode)
+
+
+class Scanner:
+    """Walk a directory tree once, collecting files with matching extensions"""
+
+    def __init__(
+        self,
+        extensions: Iterable[str],
+        *,
+        follow_symlinks: bool = False,
+        include_hidden: bool = True,
+    ) -> None:
+        self.suffixes = {f".{ext.lower().lstrip('.')}" for ext in extensions}
+        self.follow_symlinks = follow_symlinks
+        self.include_hidden = include_hidden
+
+    def scan(
+        self, base_path: Path
+    ) -> Generator[tuple[Path, list[FileEntry]], None, None]:
+        """Generator that yields each directory in sorted order with its photo files.
+
+        Each directory is read exactly once and its files are yielded before any of
+        its subdirectories are visited.
+        """
+        visited: set[tuple[int, int]] = set()
+        stack = [base_path]
+        while stack:
+            directory = stack.pop()
+            if self.follow_symlinks:
+                # Guard against symlink loops by tracking visited directories
+                stat = directory.stat()
+                if (stat.st_dev, stat.st_ino) in visited:
+                    continue
+                visited.add((stat.st_dev, stat.st_ino))
+            try:
+                with os.scandir(directory) as iterator:
+                    entries = sorted(iterator, key=lambda entry: entry.name)
+            except OSError as exc:
+                logger.warning(f"Could not read directory [cyan]{directory}[/]: {exc}")
+                continue
+            subdirectories, files = [], []
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        # Symlinked directories are skipped unless followed,
+                        # while symlinked files are always included
+                        if entry.is_symlink() and not self.follow_symlinks:
+                            continue
+                        if self.include_hidden or not entry.name.startswith("."):
+                            subdirectories.append(entry)
+                    elif os.path.splitext(entry.name)[1].lower() in self.suffixes:
+                        stat = entry.stat()
+                        files.append(
+                            FileEntry(
+                                Path(entry.path),
+                                stat.st_size,
+                                stat.st_mtime_ns,
+                                stat.st_ino,
+                            )
+                        )
+                except OSError as exc:
+                    logger.warning(f"Could not read [cyan]{entry.path}[/]: {exc}")
+            if files:
+                yield directory, files
+            stack.extend(Path(entry.path) for entry in reversed(subdirectories))
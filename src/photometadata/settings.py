@@ -3,12 +3,16 @@ from pathlib import Path
 from yaml import safe_load
 from pydantic import BaseModel
 
+from photometadata.rules import CopyrightRules
+
 logger = logging.getLogger(__name__)
 
 
 class _Azure(BaseModel):
     subscription_key: str
     endpoint: str
+    transactions_per_second: float = 10.0
+    max_retries: int = 5
 
 
 class _Copyright(BaseModel):
@@ -18,14 +22,25 @@ class _Copyright(BaseModel):
 
 class Settings(BaseModel):
     extensions: list[str] = ["jpg", "JPG", "jpeg", "JPEG"]
+    follow_symlinks: bool = False
+    include_hidden: bool = True
     azure: _Azure
     copyright: list[_Copyright]
+    _copyright_rules: CopyrightRules
 
     def __init__(self, path: str | Path) -> None:
         """Load a YAML settings file into a Settings object"""
         try:
             with open(path, "r", encoding="utf-8") as f_yaml:
                 super().__init__(**safe_load(f_yaml))
+            self._copyright_rules = CopyrightRules(
+                (ruleset.name, ruleset.whenever) for ruleset in self.copyright
+            )
         except Exception:
             logger.error(f"Could not load settings from {path}!")
             raise
+
+    @property
+    def copyright_rules(self) -> CopyrightRules:
+        """Copyright rules compiled for matching"""
+        return self._copyright_rules
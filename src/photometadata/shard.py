@@ -0,0 +1,209 @@
+"""Partitioning of a library across machines and merging of partial results"""
+
+import json
+import logging
+import zlib
+from collections import Counter, defaultdict
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path, PurePosixPath
+from typing import Any
+
+from photometadata.output import JsonlWriter, ResultWriter, log_results
+from photometadata.processors import ProcessingResult
+
+logger = logging.getLogger(__name__)
+
+PARTIAL_VERSION = 1
+
+
+class ShardBy(str, Enum):
+    PATH = "path"
+    DIRECTORY = "directory"
+
+
+@dataclass(frozen=True)
+class Shard:
+    """One of `count` disjoint parts of a library, numbered from 1.
+
+    Files are assigned by a stable hash of their path relative to the library,
+    or of their directory's relative path so that directories are not split,
+    which gives the same partition on every machine and every run.
+    """
+
+    index: int
+    count: int
+    by: ShardBy = ShardBy.PATH
+
+    @classmethod
+    def parse(cls, spec: str, by: ShardBy = ShardBy.PATH) -> "Shard":
+        """Parse a specification such as '2/5'"""
+        try:
+            index, count = (int(value) for value in spec.split("/"))
+        except ValueError:
+            raise ValueError(f"Invalid shard '{spec}', expected i/N") from None
+        if not 1 <= index <= count:
+            raise ValueError(f"Invalid shard '{spec}', i must be between 1 and N")
+        return cls(index, count, by)
+
+    def includes(self, relative_path: PurePosixPath) -> bool:
+        """Whether a file, given relative to the library, belongs to this shard"""
+        key = relative_path.parent if self.by is ShardBy.DIRECTORY else relative_path
+        return zlib.crc32(key.as_posix().encode("utf-8")) % self.count == self.index - 1
+
+    def __str__(self) -> str:
+        return f"{self.index}/{self.count}"
+
+
+@contextmanager
+def open_partial(
+    path: str | Path, shard: Shard, command: str, base_path: Path
+) -> Iterator[JsonlWriter]:
+    """Write a partial result file, returning a writer for its records.
+
+    The first line describes the shard, and each following line is a record as
+    written by --output jsonl.
+    """
+    with open(path, "w", encoding="utf-8") as stream:
+        header = {
+            "version": PARTIAL_VERSION,
+            "command": command,
+            "shard": shard.index,
+            "shards": shard.count,
+            "by": shard.by.value,
+            "base_path": str(base_path),
+        }
+        stream.write(json.dumps(header) + "\n")
+        writer = JsonlWriter(stream)
+        yield writer
+        writer.flush()
+    logger.info(f"Wrote results for shard [bold]{shard}[/] to [cyan]{path}[/]")
+
+
+def read_partial(path: str | Path) -> tuple[dict[str, Any], list[dict[str, Any]]]:
+    """Read the header and records of a partial result file"""
+    with open(path, encoding="utf-8") as stream:
+        header = json.loads(next(stream))
+        if header.get("version") != PARTIAL_VERSION:
+            raise ValueError(f"{path} is not a partial result file")
+        return header, [json.loads(line) for line in stream if line.strip()]
+
+
+def check_coverage(headers: Iterable[dict[str, Any]]) -> bool:
+    """Warn about missing, repeated or inconsistent shards, returning whether all are present"""
+    complete = True
+    by_command: dict[str, list[dict[str, Any]]] = defaultdict(list)
+    for header in headers:
+        by_command[header["command"]].append(header)
+    for command, group in by_command.items():
+        if len({(header["shards"], header["by"]) for header in group}) > 1:
+            logger.warning(f"Partial {command} results use different shard layouts")
+            complete = False
+            continue
+        n_shards = group[0]["shards"]
+        indices = Counter(header["shard"] for header in group)
+        if missing := sorted(set(range(1, n_shards + 1)) - set(indices)):
+            logger.warning(
+                f"Missing {command} results for shard(s) {', '.join(map(str, missing))} of {n_shards}"
+            )
+            complete = False
+        if repeated := sorted(index for index, count in indices.items() if count > 1):
+            logger.warning(
+                f"Repeated {command} results for shard(s) {', '.join(map(str, repeated))}"
+            )
+            complete = False
+    return complete
+
+
+def duplicate_groups(
+    records: Iterable[dict[str, Any]],
+) -> tuple[list[list[dict[str, Any]]], list[dict[str, Any]]]:
+    """Group records from all shards that describe identical images.
+
+    Records are matched on the dimensions and encoded size of their image and
+    on a hash of its decoding tables and first and last chunks of data, which
+    every shard computes for all of its photos, then grouped by fingerprint.
+    A record without a fingerprint, such as a broken image, only joins a group
+    if its bucket has a single fingerprint, and is otherwise returned as
+    unverified along with the groups.
+    """
+    buckets: dict[tuple, list[dict[str, Any]]] = defaultdict(list)
+    for record in records:
+        if record.get("header_key") and record.get("partial_hash"):
+            buckets[(*record["header_key"], record["partial_hash"])].append(record)
+    groups = []
+    unverified = []
+    for bucket in buckets.values():
+        if len(bucket) < 2:
+            continue
+        by_fingerprint: dict[str, list[dict[str, Any]]] = defaultdict(list)
+        unknown = []
+        for record in bucket:
+            if record.get("fingerprint"):
+                by_fingerprint[record["fingerprint"]].append(record)
+            else:
+                unknown.append(record)
+        if unknown and len(by_fingerprint) == 1:
+            next(iter(by_fingerprint.values())).extend(unknown)
+        elif unknown:
+            unverified += unknown
+        groups += [group for group in by_fingerprint.values() if len(group) > 1]
+    return sorted(groups, key=lambda group: group[0]["path"]), unverified
+
+
+def merge(paths: Iterable[str | Path], output: ResultWriter | None = None) -> None:
+    """Combine partial results from all shards into global results.
+
+    Check results are summarised as a whole, and duplicates are grouped across
+    shards. With an output writer, the combined records are written instead,
+    with duplicate groups numbered globally.
+    """
+    headers = []
+    records: dict[str, list[dict[str, Any]]] = defaultdict(list)
+    for path in paths:
+        header, partial = read_partial(path)
+        headers.append(header)
+        records[header["command"]] += partial
+    check_coverage(headers)
+
+    if checks := records["check"]:
+        if output:
+            for record in checks:
+                output.add(record)
+        else:
+            log_results(
+                ProcessingResult(
+                    record["success"],
+                    f"[red]Failed to validate {record['path']}[/] ({', '.join(record['failed_checks'])})",
+                    Path(record["path"]),
+                )
+                if not record["success"]
+                else ProcessingResult(True, f"[blue]Validated {record['path']}[/]")
+                for record in checks
+            )
+
+    if photos := records["duplicates"]:
+        groups, unverified = duplicate_groups(photos)
+        for record in unverified:
+            logger.warning(
+                f"Could not verify whether {record['path']} duplicates other photos, as it has no fingerprint"
+            )
+        if output:
+            group_index = {
+                id(record): idx for idx, group in enumerate(groups) for record in group
+            }
+            for record in photos:
+                output.add(record | {"duplicate_group": group_index.get(id(record))})
+        else:
+            for group in groups:
+                logger.debug(
+                    f"Duplicates: {', '.join(record['path'] for record in group)}"
+                )
+            n_shards = len({header["shard"] for header in headers})
+            logger.info(
+                f"Found [bold]{sum(len(group) - 1 for group in groups)}[/] duplicate photo(s) among [bold]{len(photos)}[/] photos from [bold]{n_shards}[/] shard(s)"
+            )
+    if output:
+        output.flush()
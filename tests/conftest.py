@@ -0,0 +1,23 @@
+from pathlib import Path
+
+import pytest
+
+from benchmarks.corpus import Corpus, CorpusSpec, generate
+
+
+@pytest.fixture
+def corpus(tmp_path: Path) -> Corpus:
+    """A small library in which some photos need their dates and copyright fixed"""
+    spec = CorpusSpec(
+        photos=24,
+        fan_out=2,
+        depth=1,
+        width=64,
+        height=48,
+        conflicting_dates=0.5,
+        missing_copyright=0.5,
+        keywords=0,
+        broken=0,
+        duplicates=0,
+    )
+    return generate(tmp_path / "library", spec)
@@ -0,0 +1,37 @@
+import io
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+from photometadata.cache import CheckJournal
+from photometadata.library import Library
+from photometadata.output import JsonlWriter
+from photometadata.settings import Settings
+
+
+def check(
+    root: Path, settings: Path, journal: CheckJournal | None, jobs: int
+) -> list[str]:
+    """Check a library, returning the paths in the order reported"""
+    stream = io.StringIO()
+    library = Library(root, Settings(settings), output=JsonlWriter(stream), jobs=jobs)
+    library.check_photos(broken_only=False, journal=journal)
+    stream.seek(0)
+    return [json.loads(line)["path"] for line in stream]
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_since_last_run_keeps_walk_order(corpus, tmp_path, jobs):
+    journal = CheckJournal(tmp_path / "journal.sqlite")
+    try:
+        check(corpus.path, corpus.settings, journal, jobs)
+        # Every third photo changes, so reused and new results interleave
+        for photo in sorted(corpus.path.rglob("*.jpg"))[::3]:
+            stat = photo.stat()
+            os.utime(photo, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        order = check(corpus.path, corpus.settings, journal, jobs)
+    finally:
+        journal.close()
+    assert order == check(corpus.path, corpus.settings, None, jobs)
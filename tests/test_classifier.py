@@ -0,0 +1,49 @@
+import io
+import json
+import time
+from pathlib import Path
+
+from benchmarks.corpus import generate
+from photometadata.cache import ClassificationCache
+from photometadata.library import Library
+from photometadata.output import JsonlWriter
+from photometadata.processors import Classifier, WriterBackend
+from photometadata.settings import Settings
+
+
+def classify(root: Path, settings: Path, cache, concurrency: int) -> list[str]:
+    """Classify a library, returning the relative paths in the order reported"""
+    stream = io.StringIO()
+    library = Library(root, Settings(settings), output=JsonlWriter(stream))
+    library.classify_photos(
+        writer=WriterBackend.NATIVE, concurrency=concurrency, classification_cache=cache
+    )
+    stream.seek(0)
+    return [
+        str(Path(json.loads(line)["path"]).relative_to(root.resolve()))
+        for line in stream
+    ]
+
+
+def test_concurrent_results_keep_order_with_cache_hits(corpus, tmp_path, monkeypatch):
+    def slow_classify(self, photo, image):
+        time.sleep(0.01)
+        return [("dog", 0.9)]
+
+    monkeypatch.setattr(Classifier, "classify", slow_classify)
+    monkeypatch.setattr(Classifier, "api_version", "test")
+    # Every other photo has cached tags, so cache hits and requests interleave
+    cached = sorted(corpus.path.rglob("*.jpg"))[::2]
+    # An identical library and cache, as classifying tags photos and caches tags
+    copy = generate(tmp_path / "copy", corpus.spec)
+    orders = []
+    for library, concurrency in ((corpus, 1), (copy, 4)):
+        cache = ClassificationCache(library.path.parent / f"{concurrency}.sqlite")
+        for photo in cached:
+            content = Classifier.content_key(photo.read_bytes())
+            cache.store(content, "test", [("cat", 0.9)])
+        try:
+            orders.append(classify(library.path, library.settings, cache, concurrency))
+        finally:
+            cache.close()
+    assert orders[1] == orders[0]
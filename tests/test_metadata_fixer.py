@@ -0,0 +1,69 @@
+from pathlib import Path
+
+from PIL import Image
+
+from photometadata.library import Library
+from photometadata.processors import WriterBackend, read_plan, write_plan
+from photometadata.settings import Settings
+
+DOCUMENT_NAME = 0x010D
+SETTINGS = """\
+azure:
+  endpoint: http://127.0.0.1:9/
+  subscription_key: test
+copyright:
+  - name: Test Photographer
+    whenever:
+      - filename-regex: .*
+"""
+
+
+def write_photo(file_path: Path, date: str) -> None:
+    exif = Image.Exif()
+    exif[0x0132] = date
+    exif_ifd = exif.get_ifd(0x8769)
+    exif_ifd[0x9003] = date
+    exif_ifd[0x9004] = date
+    Image.new("RGB", (32, 24)).save(file_path, format="JPEG", exif=exif.tobytes())
+
+
+def document_name(file_path: Path) -> str:
+    with Image.open(file_path) as im:
+        return im.getexif()[DOCUMENT_NAME]
+
+
+def library(tmp_path: Path) -> Library:
+    settings = tmp_path / "settings.yaml"
+    settings.write_text(SETTINGS, encoding="utf-8")
+    return Library(tmp_path / "photos", Settings(settings))
+
+
+def test_document_name_follows_date_rename(tmp_path):
+    (tmp_path / "photos").mkdir()
+    # The filename is a few seconds after the EXIF dates, which are chosen
+    write_photo(
+        tmp_path / "photos" / "IMG_20120505_100003_00126.jpg", "2012:05:05 10:00:00"
+    )
+    library(tmp_path).fix_metadata(writer=WriterBackend.NATIVE, interactive=False)
+    renamed = tmp_path / "photos" / "IMG_20120505_100000_00126.jpg"
+    assert renamed.exists()
+    assert document_name(renamed) == "IMG_20120505_100000_00126"
+
+
+def test_document_name_follows_date_chosen_in_plan(tmp_path):
+    (tmp_path / "photos").mkdir()
+    write_photo(
+        tmp_path / "photos" / "IMG_20160104_173108_00126.jpg", "2012:05:05 10:00:00"
+    )
+    plan_path = tmp_path / "plan.jsonl"
+    library(tmp_path).plan_metadata(plan_path)
+    with open(plan_path, encoding="utf-8") as plan:
+        (fix,) = read_plan(plan)
+    assert fix.unresolved == ["date"]
+    fix.date = "2012:05:05 10:00:00"
+    with open(plan_path, "w", encoding="utf-8") as plan:
+        write_plan(plan, [fix])
+    library(tmp_path).apply_plan(plan_path, writer=WriterBackend.NATIVE)
+    renamed = tmp_path / "photos" / "IMG_20120505_100000_00126.jpg"
+    assert renamed.exists()
+    assert document_name(renamed) == "IMG_20120505_100000_00126"
@@ -0,0 +1,46 @@
+import csv
+import io
+import json
+
+import pytest
+
+from photometadata.library import Library
+from photometadata.output import CsvWriter, JsonlWriter
+from photometadata.processors import Classifier, WriterBackend
+from photometadata.settings import Settings
+
+
+def records(stream: io.StringIO, writer: type) -> list[dict]:
+    stream.seek(0)
+    if writer is CsvWriter:
+        return list(csv.DictReader(stream))
+    return [json.loads(line) for line in stream]
+
+
+@pytest.mark.parametrize("writer", [JsonlWriter, CsvWriter])
+def test_batched_metadata_records_have_paths(corpus, writer):
+    stream = io.StringIO()
+    library = Library(corpus.path, Settings(corpus.settings), output=writer(stream))
+    library.fix_metadata(
+        batch=True, writer=WriterBackend.NATIVE, filename=True, interactive=False
+    )
+    written = records(stream, writer)
+    assert len(written) == corpus.spec.photos
+    assert all(record["path"] for record in written)
+
+
+@pytest.mark.parametrize("writer", [JsonlWriter, CsvWriter])
+@pytest.mark.parametrize("batch", [False, True])
+def test_concurrent_classify_records_have_paths(corpus, monkeypatch, writer, batch):
+    # Every other photo fails to be classified
+    monkeypatch.setattr(
+        Classifier,
+        "classify",
+        lambda self, photo, image: [("dog", 0.9)] if len(image) % 2 else None,
+    )
+    stream = io.StringIO()
+    library = Library(corpus.path, Settings(corpus.settings), output=writer(stream))
+    library.classify_photos(batch=batch, writer=WriterBackend.NATIVE, concurrency=4)
+    written = records(stream, writer)
+    assert len(written) == corpus.spec.photos
+    assert all(record["path"] for record in written)